@@ -1,17 +1,59 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, Response
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, Response, g, has_app_context, stream_with_context, send_file
+from flask import before_render_template, template_rendered
 import sqlite3, os
+import threading
+import zlib
 import re
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
 from datetime import datetime, timedelta
+from werkzeug.http import is_resource_modified
+from werkzeug.exceptions import ClientDisconnected
 import csv
 from io import StringIO
+import time
+import click
+import json
+import queue
+import contextlib
+import asyncio
+import sys
+import hashlib
+import secrets
+import fcntl
+import atexit
+from io import BytesIO, TextIOWrapper, RawIOBase, BufferedReader
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import mimetypes
+import gzip
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    # Without Pillow uploads are stored as-is under their content hash, with no variants
+    Image = None
+from collections import OrderedDict
 
 app = Flask(__name__)
 app.secret_key = "secret123"
 
 UPLOAD_FOLDER = "static/uploads"
+# Raw uploads wait here, outside static/, until a background worker has built their variants
+IMAGE_PENDING_FOLDER = "uploads_pending"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(IMAGE_PENDING_FOLDER, exist_ok=True)
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
+app.config["IMAGE_PENDING_FOLDER"] = IMAGE_PENDING_FOLDER
+app.config["IMAGE_WORKERS"] = 2
+app.config["DATABASE"] = "hospital.db"
+# Appointments dated more than this many days ago are moved out of the live table into
+# "<database>-archive.db" by `flask archive-appointments` (run it daily from cron);
+# appointment_all reads the live and archived rows together
+app.config["ARCHIVE_AFTER_DAYS"] = 365
+app.config["ARCHIVE_BATCH_SIZE"] = 5000
+# Optional callable passed to sqlite3's set_trace_callback (used by the benchmarks)
+app.config["SQL_TRACE"] = None
 
 users = {
     "govthebri": "hebri123",
@@ -22,14 +64,762 @@ users = {
 }
 
 DAILY_APPOINTMENT_LIMIT = 3
+# Appointments are booked from today up to this many days ahead
+app.config["BOOKING_MAX_DAYS_AHEAD"] = 365
+
+# Completed bookings are replayed to retries carrying the same Idempotency-Key
+# header (or idempotency_key form field) for this many seconds
+app.config["IDEMPOTENCY_TTL"] = 24 * 3600
+IDEMPOTENCY_KEY_MAX_LENGTH = 128
+
+# Rendered-page cache for the public listing: "memory" (per worker), "sqlite" (one
+# file shared by every worker on the host) or None to always render
+app.config["PAGE_CACHE"] = "memory"
+app.config["PAGE_CACHE_SIZE"] = 256
+app.config["PAGE_CACHE_TTL"] = 300
+app.config["PAGE_CACHE_PATH"] = None
+
+# Opt-in request profiling: per-statement SQL timings, template render times,
+# /metrics, the slow-request log and the N+1 detector. Set before the first request;
+# connections opened earlier are not instrumented.
+app.config["PROFILING"] = False
+app.config["SLOW_REQUEST_MS"] = 500
+# Identical statements run this many times in one request are reported as N+1
+app.config["N_PLUS_ONE_THRESHOLD"] = 5
+# /metrics is only served while PROFILING is on, to scrapers sending
+# "Authorization: Bearer <METRICS_TOKEN>"; with no token set it is not served at all
+app.config["METRICS_TOKEN"] = None
+
+app.config["DB_POOL_SIZE"] = 10
+# Threads per process that run views in ASGI mode (see asgi_app); beyond DB_POOL_SIZE
+# the extra threads would only wait for a connection
+app.config["ASGI_THREADS"] = 10
+
+# Live slot events (/doctor_events/<id>): how often each worker checks for commits,
+# the keepalive interval of idle streams, and how long a stream lasts before the
+# browser reconnects. Only the ASGI mode streams them; under sync workers an open
+# stream would hold a whole worker, so booking pages poll /get_appointment_stats there.
+app.config["SLOT_EVENTS_POLL_INTERVAL"] = 0.25
+app.config["SLOT_EVENTS_KEEPALIVE"] = 15
+app.config["SLOT_EVENTS_MAX_SECONDS"] = 300
+SLOT_EVENTS_RETRY_MS = 3000
+# WSGI environ key through which asgi_app takes over a /doctor_events stream
+SLOT_SUBSCRIPTION_KEY = "drinfo.slot_subscription"
+app.config["DB_BUSY_TIMEOUT"] = 5.0
+app.config["DB_STATEMENT_CACHE_SIZE"] = 256
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Cursor that adds each statement's time and row count to the current request profile."""
+
+    entry = None
+
+    def execute(self, sql, parameters=()):
+        profile = current_profile()
+        if profile is None:
+            self.entry = None
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.entry = profile.record_statement(sql, time.perf_counter() - start, max(self.rowcount, 0))
+
+    def executemany(self, sql, seq_of_parameters):
+        profile = current_profile()
+        if profile is None:
+            self.entry = None
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.entry = profile.record_statement(sql, time.perf_counter() - start, max(self.rowcount, 0))
+
+    # Rows are produced lazily, so fetching is part of the statement's cost
+    def _fetched(self, start, rows):
+        if self.entry is not None:
+            self.entry[1] += time.perf_counter() - start
+            self.entry[2] += rows
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        row = super().__next__()
+        self._fetched(start, 1)
+        return row
+
+class ProfiledConnection(sqlite3.Connection):
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    # The C shortcuts create a plain cursor, so route them through a profiled one
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def connect_db(database=None, archive=True):
+    database = database or app.config["DATABASE"]
+    con = sqlite3.connect(database,
+                          factory=ProfiledConnection if app.config["PROFILING"] else sqlite3.Connection,
+                          timeout=app.config["DB_BUSY_TIMEOUT"],
+                          cached_statements=app.config["DB_STATEMENT_CACHE_SIZE"],
+                          # Pooled connections move between worker threads, one request at a time
+                          check_same_thread=False)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    if archive:
+        attach_archive(con, database)
+    return con
+
+def archive_path(database):
+    root, ext = os.path.splitext(database)
+    return f"{root}-archive{ext or '.db'}"
+
+# Live and archived appointments as one relation. The archive keeps the live ids, and
+# with an ORDER BY on (appointment_date, id) SQLite merges the two indexed sides
+# instead of sorting, so history pages stay index walks.
+APPOINTMENT_ALL_VIEW = """
+    CREATE TEMP VIEW IF NOT EXISTS appointment_all AS
+    SELECT id, doctor_id, appointment_date, patient_name, patient_phone, status, phone_digits FROM main.appointment
+    UNION ALL
+    SELECT id, doctor_id, appointment_date, patient_name, patient_phone, status, phone_digits FROM archive.appointment
+"""
+
+def attach_archive(con, database):
+    con.execute("ATTACH DATABASE ? AS archive", (archive_path(database),))
+    con.execute("PRAGMA archive.journal_mode=WAL")
+    con.execute("PRAGMA archive.synchronous=NORMAL")
+    if not con.execute("SELECT 1 FROM archive.sqlite_master WHERE name='appointment'").fetchone():
+        init_archive(con.cursor())
+    con.execute(APPOINTMENT_ALL_VIEW)
+
+def init_archive(cur):
+    # Same columns as the live table after migration 10; ids are copied, not generated
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS archive.appointment(
+        id INTEGER PRIMARY KEY,
+        doctor_id INTEGER,
+        appointment_date TEXT,
+        patient_name TEXT,
+        patient_phone TEXT,
+        status TEXT,
+        phone_digits TEXT
+    )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_doctor_date ON appointment(doctor_id, appointment_date)")
+    cur.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_doctor_status_date ON appointment(doctor_id, status, appointment_date)")
+    cur.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_phone ON appointment(phone_digits, appointment_date)")
+    cur.connection.commit()
+
+class ConnectionPool:
+    """Reusable SQLite connections for one database file, shared by the threads of a worker process."""
+
+    def __init__(self, database, max_size):
+        self.database = database
+        self.max_size = max_size
+        self.condition = threading.Condition()
+        self.idle = []
+        self.open_count = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.pid = os.getpid()
+
+    def acquire(self, timeout=None):
+        with self.condition:
+            self._forget_parent_connections()
+            self.checkouts += 1
+            while not self.idle and self.open_count >= self.max_size:
+                self.waits += 1
+                if not self.condition.wait(timeout or app.config["DB_BUSY_TIMEOUT"]):
+                    raise sqlite3.OperationalError("timed out waiting for a pooled database connection")
+            if self.idle:
+                return self.idle.pop()
+            self.open_count += 1
+
+        try:
+            return connect_db(self.database)
+        except Exception:
+            with self.condition:
+                self.open_count -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, con):
+        if con.in_transaction:
+            con.rollback()
+        con.set_trace_callback(None)
+        with self.condition:
+            if os.getpid() != self.pid:
+                return
+            self.idle.append(con)
+            self.condition.notify()
+
+    def _forget_parent_connections(self):
+        # A forked worker (gunicorn) must never reuse connections opened by its parent,
+        # so drop them without closing and start a fresh pool in this process.
+        if os.getpid() != self.pid:
+            self.pid = os.getpid()
+            self.idle = []
+            self.open_count = 0
+
+    def close_all(self):
+        with self.condition:
+            self._forget_parent_connections()
+            for con in self.idle:
+                con.close()
+            self.open_count -= len(self.idle)
+            self.idle = []
+
+    def stats(self):
+        with self.condition:
+            return {
+                "database": self.database,
+                "max_size": self.max_size,
+                "open": self.open_count,
+                "idle": len(self.idle),
+                "in_use": self.open_count - len(self.idle),
+                "checkouts": self.checkouts,
+                "waits": self.waits
+            }
+
+db_pools = {}
+db_pools_lock = threading.Lock()
+
+@atexit.register
+def close_db_pools():
+    # On worker shutdown; closing the last connection also checkpoints the WAL into the database
+    with db_pools_lock:
+        pools = list(db_pools.values())
+    for pool in pools:
+        pool.close_all()
+
+def get_pool():
+    database = app.config["DATABASE"]
+    with db_pools_lock:
+        pool = db_pools.get(database)
+        if pool is None:
+            pool = db_pools[database] = ConnectionPool(database, app.config["DB_POOL_SIZE"])
+        return pool
 
 def get_db():
-    return sqlite3.connect("hospital.db")
+    # One pooled connection per request/app context, returned to the pool on teardown
+    if not has_app_context():
+        return connect_db()
+    if "db" not in g:
+        g.db_pool = get_pool()
+        g.db = g.db_pool.acquire()
+        g.db.set_trace_callback(app.config["SQL_TRACE"])
+    return g.db
 
-def init_db():
-    con = get_db()
-    cur = con.cursor()
+@app.teardown_appcontext
+def release_db(exc):
+    con = g.pop("db", None)
+    if con is not None:
+        g.pop("db_pool").release(con)
+
+# ---------------------------------------------------------------------------
+# Request profiling (opt-in with app.config["PROFILING"])
+# ---------------------------------------------------------------------------
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = []
+        self.templates = []
+        self.template_starts = []
+        self.status = None
+
+    def record_statement(self, sql, seconds, rows):
+        # Returned so fetches on the same cursor keep adding to it
+        entry = [" ".join(sql.split()), seconds, rows]
+        self.statements.append(entry)
+        return entry
+
+    def sql_seconds(self):
+        return sum(entry[1] for entry in self.statements)
+
+    def template_seconds(self):
+        return sum(seconds for _, seconds in self.templates)
+
+    def repeated_statements(self, threshold):
+        counts = {}
+        for sql, _, _ in self.statements:
+            counts[sql] = counts.get(sql, 0) + 1
+        return sorted(((count, sql) for sql, count in counts.items() if count >= threshold), reverse=True)
+
+def current_profile():
+    return g.get("profile") if has_app_context() else None
+
+REQUEST_DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# name -> (type, help) for everything /metrics exposes
+METRICS = {
+    "drinfo_requests_total": ("counter", "Requests handled, by endpoint, method and status."),
+    "drinfo_request_duration_seconds": ("histogram", "Wall time per request, by endpoint."),
+    "drinfo_sql_statements_total": ("counter", "SQL statements executed, by endpoint."),
+    "drinfo_sql_duration_seconds_total": ("counter", "Time spent executing and fetching SQL, by endpoint."),
+    "drinfo_sql_rows_total": ("counter", "Rows fetched or changed by SQL, by endpoint."),
+    "drinfo_template_render_seconds_total": ("counter", "Time spent in render_template, by template."),
+    "drinfo_template_renders_total": ("counter", "render_template calls, by template."),
+    "drinfo_slow_requests_total": ("counter", "Requests slower than SLOW_REQUEST_MS, by endpoint."),
+    "drinfo_n_plus_one_total": ("counter", "Requests that repeated one statement N_PLUS_ONE_THRESHOLD or more times, by endpoint."),
+    "drinfo_db_pool_connections": ("gauge", "Pooled SQLite connections, by database and state."),
+    "drinfo_db_pool_checkouts_total": ("counter", "Connections handed out by the pool, by database."),
+    "drinfo_db_pool_waits_total": ("counter", "Checkouts that waited for a free connection, by database."),
+    "drinfo_page_cache_lookups_total": ("counter", "Rendered-page cache lookups, by backend and outcome."),
+    "drinfo_page_cache_entries": ("gauge", "Pages held by the rendered-page cache, by backend."),
+    "drinfo_page_cache_evictions_total": ("counter", "Pages evicted from the rendered-page cache, by backend."),
+}
+
+class Metrics:
+    """Process-local counters and histograms, rendered in the Prometheus text format.
+
+    Every gunicorn worker keeps its own; scrape each worker or aggregate in Prometheus.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            # One count per bucket, then sum and count
+            histogram = self.histograms.setdefault(key, [0] * len(REQUEST_DURATION_BUCKETS) + [0.0, 0])
+            for i, bound in enumerate(REQUEST_DURATION_BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def render(self, samples=()):
+        """The text exposition; samples are (name, labels, value) read at scrape time."""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: list(values) for key, values in self.histograms.items()}
+        for name, labels, value in samples:
+            counters[(name, tuple(sorted(labels.items())))] = value
+
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{format_labels(labels)} {value:g}")
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric == name:
+                    for bound, count in zip(REQUEST_DURATION_BUCKETS, values):
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', f'{bound:g}'),))} {count}")
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {values[-1]}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {values[-2]:g}")
+                    lines.append(f"{name}_count{format_labels(labels)} {values[-1]}")
+        return "\n".join(lines) + "\n"
+
+def label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{label_value(value)}"' for key, value in labels) + "}"
+
+metrics = Metrics()
+
+@app.before_request
+def start_profile():
+    if app.config["PROFILING"]:
+        g.profile = RequestProfile()
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    profile = current_profile()
+    if profile is not None:
+        profile.template_starts.append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def stop_template_timer(sender, template, context, **extra):
+    profile = current_profile()
+    if profile is not None and profile.template_starts:
+        profile.templates.append((template.name, time.perf_counter() - profile.template_starts.pop()))
+
+@app.after_request
+def add_server_timing(response):
+    profile = current_profile()
+    if profile is not None:
+        profile.status = response.status_code
+        # Visible in the browser's network panel; streamed bodies are still running at this point
+        response.headers["Server-Timing"] = (
+            f'db;dur={profile.sql_seconds() * 1000:.1f};desc="{len(profile.statements)} queries", '
+            f"tpl;dur={profile.template_seconds() * 1000:.1f}, "
+            f"app;dur={(time.perf_counter() - profile.started) * 1000:.1f}")
+    return response
+
+@app.teardown_request
+def finish_profile(exc):
+    # Teardown runs after a streamed response has finished, so its rows are included
+    profile = g.pop("profile", None)
+    if profile is None:
+        return
+    seconds = time.perf_counter() - profile.started
+    endpoint = request.endpoint or "unmatched"
+    status = profile.status or 500
+
+    metrics.inc("drinfo_requests_total", {"endpoint": endpoint, "method": request.method, "status": status})
+    metrics.observe("drinfo_request_duration_seconds", {"endpoint": endpoint}, seconds)
+    metrics.inc("drinfo_sql_statements_total", {"endpoint": endpoint}, len(profile.statements))
+    metrics.inc("drinfo_sql_duration_seconds_total", {"endpoint": endpoint}, profile.sql_seconds())
+    metrics.inc("drinfo_sql_rows_total", {"endpoint": endpoint}, sum(entry[2] for entry in profile.statements))
+    for name, template_seconds in profile.templates:
+        metrics.inc("drinfo_template_render_seconds_total", {"template": name}, template_seconds)
+        metrics.inc("drinfo_template_renders_total", {"template": name})
+
+    repeated = profile.repeated_statements(app.config["N_PLUS_ONE_THRESHOLD"])
+    if repeated:
+        metrics.inc("drinfo_n_plus_one_total", {"endpoint": endpoint})
+        app.logger.warning("Possible N+1 in %s %s: %s", request.method, request.path,
+                           "; ".join(f"{count}x {sql}" for count, sql in repeated))
+
+    if seconds * 1000 >= app.config["SLOW_REQUEST_MS"]:
+        metrics.inc("drinfo_slow_requests_total", {"endpoint": endpoint})
+        slowest = sorted(profile.statements, key=lambda entry: entry[1], reverse=True)[:3]
+        app.logger.warning(
+            "Slow request %s %s: %.1fms, %d queries (%.1fms SQL), templates %.1fms%s",
+            request.method, request.path, seconds * 1000, len(profile.statements),
+            profile.sql_seconds() * 1000, profile.template_seconds() * 1000,
+            "".join(f"\n  {entry[1] * 1000:.1f}ms {entry[2]} rows: {entry[0]}" for entry in slowest))
+
+def metrics_authorized():
+    token = app.config["METRICS_TOKEN"]
+    if not app.config["PROFILING"] or not token:
+        return False
+    presented = request.headers.get("Authorization", "").encode()
+    return secrets.compare_digest(presented, f"Bearer {token}".encode())
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    # Per-endpoint latencies and query counts are for the operators' scraper only;
+    # anyone else gets the same 404 as for a route that does not exist
+    if not metrics_authorized():
+        return "Not found", 404
+    response = Response(metrics.render(diagnostic_samples()), mimetype="text/plain; version=0.0.4")
+    response.cache_control.no_store = True
+    return response
+
+# Resized copies built for every uploaded photo, as (variant, max width); each is
+# written as WebP and JPEG. The image columns store the "card" JPEG name.
+IMAGE_VARIANTS = [("thumb", 320), ("card", 960)]
+IMAGE_FORMATS = [
+    ("webp", "WEBP", {"quality": 80, "method": 4}),
+    ("jpg", "JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+]
+IMAGE_NAME_RE = re.compile(r"([0-9a-f]{20})-card\.jpg")
+# An unreferenced image whose file was reused more recently than this is not collected yet:
+# the upload that reused it may still be on its way to committing the reference
+IMAGE_COLLECT_GRACE_SECONDS = 60
+IMAGE_LOCK_STRIPES = 16
+IMAGE_VARIANT_RE = re.compile(r"([0-9a-f]{20})-(?:thumb|card)\.(?:webp|jpg)")
+
+def image_variant_name(digest, variant, ext):
+    return f"{digest}-{variant}.{ext}"
+
+def write_file(path, data):
+    # Readers only ever see complete files: write aside, then rename into place
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+@contextlib.contextmanager
+def image_lock(image, pending_folder):
+    """Cross-process lock that keeps building and collecting the same image apart."""
+    stripe = zlib.crc32(image.encode()) % IMAGE_LOCK_STRIPES
+    with open(os.path.join(pending_folder, f".lock{stripe}"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def reuse_file(path):
+    # Touching the existing file tells collect_image it was just reused; once collect_image
+    # has moved it aside the touch fails and the caller writes the image afresh
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def save_upload(file):
+    """Store an uploaded photo and return the name to keep in the image column (None if unusable).
+
+    Only hashing and one file write happen in the request; resizing and
+    re-encoding run on the image worker pool.
+    """
+    data = file.read()
+    if not data:
+        return None
+    digest = hashlib.sha256(data).hexdigest()[:20]
+
+    if Image is None:
+        filename = digest + os.path.splitext(secure_filename(file.filename))[1].lower()
+        path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
+        if not reuse_file(path):
+            write_precompressed(path, data)
+            write_file(path, data)
+        return filename
+
+    try:
+        # Parses headers only; cheap enough to reject non-images before queueing them
+        Image.open(BytesIO(data)).verify()
+    except Exception:
+        app.logger.warning("Ignoring upload %r: not a readable image", file.filename)
+        return None
+
+    filename = image_variant_name(digest, "card", "jpg")
+    # Same content, same name: an image that was already processed is simply reused
+    if not reuse_file(os.path.join(app.config["UPLOAD_FOLDER"], filename)):
+        write_file(os.path.join(app.config["IMAGE_PENDING_FOLDER"], digest), data)
+        get_image_executor().submit(process_image, digest, app.config["IMAGE_PENDING_FOLDER"], app.config["UPLOAD_FOLDER"])
+    return filename
+
+# Formats that are not compressed already; JPEG, WebP and PNG gain nothing from gzip
+PRECOMPRESS_EXTENSIONS = {".svg", ".bmp", ".tif", ".tiff", ".ico"}
+
+def write_precompressed(path, data):
+    # A .gz sibling served to clients that accept gzip, kept only when it actually saves bytes
+    if os.path.splitext(path)[1] in PRECOMPRESS_EXTENSIONS:
+        compressed = gzip.compress(data, 9, mtime=0)
+        if len(compressed) < len(data):
+            write_file(path + ".gz", compressed)
+
+def build_image_variants(source, digest, upload_folder):
+    with Image.open(source) as original:
+        # Bake in the camera rotation; re-encoding from pixels drops EXIF, GPS and other metadata
+        img = ImageOps.exif_transpose(original)
+        if img.mode in ("RGBA", "LA", "P"):
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", rgba.size, "white")
+            img.paste(rgba, mask=rgba.getchannel("A"))
+        else:
+            img = img.convert("RGB")
+
+    # The card JPEG is written last, so its presence means every variant exists
+    for variant, width in IMAGE_VARIANTS:
+        resized = img.copy()
+        resized.thumbnail((width, width * 2), Image.LANCZOS)
+        for ext, fmt, options in IMAGE_FORMATS:
+            out = BytesIO()
+            resized.save(out, fmt, **options)
+            write_file(os.path.join(upload_folder, image_variant_name(digest, variant, ext)), out.getvalue())
+
+def process_image(digest, pending_folder, upload_folder):
+    source = os.path.join(pending_folder, digest)
+    try:
+        with image_lock(image_variant_name(digest, "card", "jpg"), pending_folder):
+            build_image_variants(source, digest, upload_folder)
+    except FileNotFoundError:
+        # Another worker process already finished this upload
+        return
+    except Exception:
+        # Keep the source: serve_upload falls back to it and the next restart retries the build
+        app.logger.exception("Could not process uploaded image %s", digest)
+        return
+    try:
+        os.remove(source)
+    except FileNotFoundError:
+        pass
+
+image_executors = {}
+image_executors_lock = threading.Lock()
+
+def get_image_executor():
+    # One pool per process: threads do not survive a fork, so a gunicorn worker starts its own
+    with image_executors_lock:
+        executor = image_executors.get(os.getpid())
+        if executor is None:
+            image_executors.clear()
+            executor = image_executors[os.getpid()] = ThreadPoolExecutor(
+                max_workers=app.config["IMAGE_WORKERS"], thread_name_prefix="image")
+            # Uploads accepted before a restart are still waiting in the pending folder
+            pending_folder = app.config["IMAGE_PENDING_FOLDER"]
+            for name in os.listdir(pending_folder):
+                if re.fullmatch(r"[0-9a-f]{20}", name):
+                    executor.submit(process_image, name, pending_folder, app.config["UPLOAD_FOLDER"])
+        return executor
+
+@app.before_request
+def start_image_workers():
+    if Image is not None:
+        get_image_executor()
+
+def image_files(image):
+    """Every file the upload folder holds for one stored image name."""
+    match = IMAGE_NAME_RE.fullmatch(image)
+    if match:
+        names = [image_variant_name(match[1], variant, ext) for variant, _ in IMAGE_VARIANTS for ext, _, _ in IMAGE_FORMATS]
+    else:
+        names = [image]
+    return names + [name + ".gz" for name in names]
+
+def image_referenced(image, database):
+    con = connect_db(database)
+    try:
+        cur = con.cursor()
+        cur.execute("SELECT 1 FROM doctor WHERE image=? UNION ALL SELECT 1 FROM hospital WHERE image=? LIMIT 1",
+                    (image, image))
+        return cur.fetchone() is not None
+    finally:
+        con.close()
+
+def collect_image(image, database, upload_folder, pending_folder):
+    # Identical uploads share files, so only delete once no hospital or doctor points at them.
+    # save_upload reuses a file before its view commits the reference, so the check alone
+    # races with it: the file is moved aside first, which makes a later reuse write it afresh,
+    # and one that was reused just before is put back and retried after the grace period.
+    if image_referenced(image, database):
+        return
+    path = os.path.join(upload_folder, image)
+    aside = f"{path}.{os.getpid()}.{threading.get_ident()}.collect"
+    with image_lock(image, pending_folder):
+        try:
+            os.rename(path, aside)
+        except FileNotFoundError:
+            aside = None
+        if aside:
+            if time.time() - os.stat(aside).st_mtime < IMAGE_COLLECT_GRACE_SECONDS:
+                os.replace(aside, path)
+                retry = threading.Timer(IMAGE_COLLECT_GRACE_SECONDS, release_image, (image,))
+                retry.daemon = True
+                retry.start()
+                return
+            if image_referenced(image, database):
+                os.replace(aside, path)
+                return
+            os.remove(aside)
+        for name in image_files(image):
+            try:
+                os.remove(os.path.join(upload_folder, name))
+            except FileNotFoundError:
+                pass
+
+def release_image(image):
+    """Garbage-collect an image that a hospital or doctor stopped using; call after the commit."""
+    if image and secure_filename(image) == image:
+        get_image_executor().submit(collect_image, image, app.config["DATABASE"], app.config["UPLOAD_FOLDER"],
+                                    app.config["IMAGE_PENDING_FOLDER"])
+
+@app.template_global()
+def image_srcset(image, ext):
+    """srcset listing every variant of a processed upload; empty for legacy single-file images."""
+    match = IMAGE_NAME_RE.fullmatch(image or "")
+    if not match:
+        return ""
+    return ", ".join(f"/uploads/{image_variant_name(match[1], variant, ext)} {width}w"
+                     for variant, width in IMAGE_VARIANTS)
+
+def image_json(image):
+    return {"webp": image_srcset(image, "webp"), "jpg": image_srcset(image, "jpg")} if image else None
+
+def sqlite_has_fts5():
+    try:
+        sqlite3.connect(":memory:").execute("CREATE VIRTUAL TABLE fts5_probe USING fts5(x)")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+HAS_FTS5 = sqlite_has_fts5()
+
+# **SEARCH INDEX** - one FTS5 row per doctor (rowid = doctor.id), kept in sync by triggers
+SEARCH_INDEX_ROW_SQL = """
+    SELECT d.id, d.name, d.specialization, d.education, h.name, h.location
+    FROM doctor d LEFT JOIN hospital h ON h.username = d.username
+"""
+
+SEARCH_INDEX_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS doctor_search_insert AFTER INSERT ON doctor BEGIN
+        INSERT INTO doctor_search (rowid, name, specialization, education, hospital_name, location)
+        VALUES (NEW.id, NEW.name, NEW.specialization, NEW.education,
+                (SELECT name FROM hospital WHERE username = NEW.username),
+                (SELECT location FROM hospital WHERE username = NEW.username));
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS doctor_search_update AFTER UPDATE ON doctor BEGIN
+        DELETE FROM doctor_search WHERE rowid = OLD.id;
+        INSERT INTO doctor_search (rowid, name, specialization, education, hospital_name, location)
+        VALUES (NEW.id, NEW.name, NEW.specialization, NEW.education,
+                (SELECT name FROM hospital WHERE username = NEW.username),
+                (SELECT location FROM hospital WHERE username = NEW.username));
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS doctor_search_delete AFTER DELETE ON doctor BEGIN
+        DELETE FROM doctor_search WHERE rowid = OLD.id;
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS hospital_search_insert AFTER INSERT ON hospital BEGIN
+        UPDATE doctor_search SET hospital_name = NEW.name, location = NEW.location
+        WHERE rowid IN (SELECT id FROM doctor WHERE username = NEW.username);
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS hospital_search_update AFTER UPDATE OF name, location ON hospital BEGIN
+        UPDATE doctor_search SET hospital_name = NEW.name, location = NEW.location
+        WHERE rowid IN (SELECT id FROM doctor WHERE username = NEW.username);
+    END"""
+]
+
+def init_search_index(cur):
+    cur.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS doctor_search USING fts5(
+        name, specialization, education, hospital_name, location,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )""")
+
+    for trigger in SEARCH_INDEX_TRIGGERS:
+        cur.execute(trigger)
+
+    # Backfill databases that had doctors before the index existed
+    cur.execute("SELECT (SELECT COUNT(*) FROM doctor), (SELECT COUNT(*) FROM doctor_search)")
+    doctor_count, indexed_count = cur.fetchone()
+    if doctor_count != indexed_count:
+        cur.execute("DELETE FROM doctor_search")
+        cur.execute("INSERT INTO doctor_search (rowid, name, specialization, education, hospital_name, location) "
+                    + SEARCH_INDEX_ROW_SQL)
 
+def fts_match_expression(text):
+    # Every word must match, each as a prefix: "card ped" -> "card"* "ped"*
+    terms = re.findall(r"\w+", text.lower())
+    return " ".join(f'"{term}"*' for term in terms)
+
+def normalize_phone(phone):
+    return re.sub(r'\D', '', phone or "")
+
+def migrate_base_tables(cur):
     cur.execute("""
     CREATE TABLE IF NOT EXISTS hospital(
         username TEXT PRIMARY KEY,
@@ -64,92 +854,1029 @@ def init_db():
         status TEXT DEFAULT 'confirmed'
     )""")
 
+def migrate_search_index(cur):
+    if HAS_FTS5:
+        init_search_index(cur)
+
+def migrate_appointment_indexes(cur):
+    # Daily limit check and history sorted by date: (doctor_id, appointment_date [, rowid])
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_appointment_doctor_date ON appointment(doctor_id, appointment_date)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_appointment_doctor_status_date ON appointment(doctor_id, status, appointment_date)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_doctor_username ON doctor(username)")
+
+    # Digits-only copy of patient_phone so lookups can use an index instead of LIKE '%...%'
+    cur.execute("ALTER TABLE appointment ADD COLUMN phone_digits TEXT")
+    cur.connection.create_function("normalize_phone", 1, normalize_phone, deterministic=True)
+    cur.execute("UPDATE appointment SET phone_digits = normalize_phone(patient_phone)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_appointment_phone ON appointment(phone_digits, appointment_date)")
+
+def migrate_doctor_day_capacity(cur):
+    # One row per doctor and day holding how many appointments are booked;
+    # bookings reserve a slot here before inserting the appointment itself.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS doctor_day_capacity(
+        doctor_id INTEGER NOT NULL,
+        appointment_date TEXT NOT NULL,
+        booked INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (doctor_id, appointment_date)
+    ) WITHOUT ROWID""")
+    cur.execute("""
+        INSERT OR REPLACE INTO doctor_day_capacity (doctor_id, appointment_date, booked)
+        SELECT doctor_id, appointment_date, COUNT(*) FROM appointment
+        WHERE doctor_id IS NOT NULL AND appointment_date IS NOT NULL
+        GROUP BY doctor_id, appointment_date
+    """)
+
+DOCTOR_CHANGE_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS appointment_change_insert AFTER INSERT ON appointment BEGIN
+        INSERT INTO doctor_change (doctor_id, version, changed_at) VALUES (NEW.doctor_id, 1, datetime('now'))
+        ON CONFLICT(doctor_id) DO UPDATE SET version = version + 1, changed_at = excluded.changed_at;
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS appointment_change_update AFTER UPDATE ON appointment BEGIN
+        INSERT INTO doctor_change (doctor_id, version, changed_at) VALUES (NEW.doctor_id, 1, datetime('now'))
+        ON CONFLICT(doctor_id) DO UPDATE SET version = version + 1, changed_at = excluded.changed_at;
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS appointment_change_delete AFTER DELETE ON appointment BEGIN
+        INSERT INTO doctor_change (doctor_id, version, changed_at) VALUES (OLD.doctor_id, 1, datetime('now'))
+        ON CONFLICT(doctor_id) DO UPDATE SET version = version + 1, changed_at = excluded.changed_at;
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS doctor_change_update AFTER UPDATE ON doctor BEGIN
+        INSERT INTO doctor_change (doctor_id, version, changed_at) VALUES (NEW.id, 1, datetime('now'))
+        ON CONFLICT(doctor_id) DO UPDATE SET version = version + 1, changed_at = excluded.changed_at;
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS doctor_change_delete AFTER DELETE ON doctor BEGIN
+        DELETE FROM doctor_change WHERE doctor_id = OLD.id;
+    END"""
+]
+
+def migrate_doctor_change(cur):
+    # Version + timestamp of the last appointment or doctor change, per doctor (UTC).
+    # Clients polling a doctor's stats revalidate against it instead of re-running counts.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS doctor_change(
+        doctor_id INTEGER PRIMARY KEY,
+        version INTEGER NOT NULL,
+        changed_at TEXT NOT NULL
+    )""")
+    cur.execute("INSERT OR IGNORE INTO doctor_change (doctor_id, version, changed_at) SELECT id, 1, datetime('now') FROM doctor")
+    for trigger in DOCTOR_CHANGE_TRIGGERS:
+        cur.execute(trigger)
+
+def migrate_cache_generation(cur):
+    # Counters that in-process caches compare against to notice writes made by other workers
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS cache_generation(
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )""")
+    cur.execute("INSERT OR IGNORE INTO cache_generation (name, value) VALUES ('doctor', 1)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS doctor_generation_{event.lower()} AFTER {event} ON doctor BEGIN
+            UPDATE cache_generation SET value = value + 1 WHERE name = 'doctor';
+        END""")
+
+def migrate_doctor_leave(cur):
+    # Leave calendar: any number of date ranges per doctor, replacing the single
+    # "YYYY-MM-DD Session" value that used to live in doctor.emergency_leave
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS doctor_leave(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        doctor_id INTEGER NOT NULL,
+        start_date TEXT NOT NULL,
+        end_date TEXT NOT NULL,
+        session TEXT NOT NULL
+    )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_doctor_leave_doctor_date ON doctor_leave(doctor_id, start_date, end_date)")
+    # Leaves still running or upcoming, for the daily availability rollover
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_doctor_leave_end ON doctor_leave(end_date)")
+
+    cur.execute("""
+        INSERT INTO doctor_leave (doctor_id, start_date, end_date, session)
+        SELECT id, substr(emergency_leave, 1, 10), substr(emergency_leave, 1, 10), substr(emergency_leave, 12)
+        FROM doctor WHERE emergency_leave GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] ?*'
+    """)
+    cur.execute("UPDATE doctor SET emergency_leave = '' WHERE emergency_leave != ''")
+
+    for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+        cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS doctor_leave_{event.lower()} AFTER {event} ON doctor_leave BEGIN
+            UPDATE cache_generation SET value = value + 1 WHERE name = 'doctor';
+            INSERT INTO doctor_change (doctor_id, version, changed_at) VALUES ({row}.doctor_id, 1, datetime('now'))
+            ON CONFLICT(doctor_id) DO UPDATE SET version = version + 1, changed_at = excluded.changed_at;
+        END""")
+
+LISTING_GENERATION_TABLES = ["hospital", "doctor", "doctor_leave", "appointment"]
+
+def migrate_listing_generation(cur):
+    # Bumped by every write that can change the rendered public listing, so cached
+    # pages from any worker are dropped as soon as the data behind them moves
+    cur.execute("INSERT OR IGNORE INTO cache_generation (name, value) VALUES ('listing', 1)")
+    for table in LISTING_GENERATION_TABLES:
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS listing_generation_{table}_{event.lower()} AFTER {event} ON {table} BEGIN
+                UPDATE cache_generation SET value = value + 1 WHERE name = 'listing';
+            END""")
+
+def migrate_booking_dedupe(cur):
+    # One active booking per patient, doctor and day. Earlier duplicates (form resubmits)
+    # are cancelled, keeping the first booking, before the unique index goes on.
+    cur.execute("""
+        UPDATE appointment SET status = 'cancelled'
+        WHERE status != 'cancelled' AND phone_digits != '' AND id NOT IN (
+            SELECT MIN(id) FROM appointment
+            WHERE status != 'cancelled' AND phone_digits != ''
+            GROUP BY doctor_id, appointment_date, phone_digits
+        )
+    """)
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_appointment_active_booking
+        ON appointment(doctor_id, appointment_date, phone_digits)
+        WHERE status != 'cancelled' AND phone_digits != ''
+    """)
+
+    # Responses of completed bookings by Idempotency-Key, replayed to retries until they expire
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS idempotency_key(
+        key TEXT PRIMARY KEY,
+        fingerprint TEXT NOT NULL,
+        status INTEGER NOT NULL,
+        mimetype TEXT NOT NULL,
+        body BLOB NOT NULL,
+        expires_at INTEGER NOT NULL
+    ) WITHOUT ROWID""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_key_expires ON idempotency_key(expires_at)")
+
+def migrate_appointment_foreign_keys(cur):
+    # Appointments used to copy the doctor and hospital names into every row; reads now
+    # join them through doctor_id. Rows from before doctor_id was filled in get it back
+    # from an unambiguous doctor name first, then the text columns go.
+    cur.execute("""
+        UPDATE appointment SET doctor_id = (
+            SELECT d.id FROM doctor d WHERE d.name = appointment.doctor_name
+        )
+        WHERE doctor_id IS NULL AND doctor_name IS NOT NULL
+          AND (SELECT COUNT(*) FROM doctor d WHERE d.name = appointment.doctor_name) = 1
+    """)
+    cur.execute("ALTER TABLE appointment DROP COLUMN doctor_name")
+    cur.execute("ALTER TABLE appointment DROP COLUMN hospital_name")
+
+# Per doctor, day (or month) and status appointment counts for the dashboard analytics,
+# kept current by these triggers. Nothing decrements on DELETE: archiving moves rows
+# out of the live table without removing them from history, and deleting a doctor
+# drops the doctor's rollup rows with everything else.
+ROLLUP_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS appointment_rollup_insert AFTER INSERT ON appointment
+    WHEN NEW.doctor_id IS NOT NULL AND NEW.appointment_date IS NOT NULL AND NEW.status IS NOT NULL BEGIN
+        INSERT INTO appointment_daily (doctor_id, appointment_date, status, appointments)
+        VALUES (NEW.doctor_id, NEW.appointment_date, NEW.status, 1)
+        ON CONFLICT(doctor_id, appointment_date, status) DO UPDATE SET appointments = appointments + 1;
+        INSERT INTO appointment_monthly (doctor_id, month, status, appointments)
+        VALUES (NEW.doctor_id, substr(NEW.appointment_date, 1, 7), NEW.status, 1)
+        ON CONFLICT(doctor_id, month, status) DO UPDATE SET appointments = appointments + 1;
+    END""",
+    """
+    CREATE TRIGGER IF NOT EXISTS appointment_rollup_update AFTER UPDATE OF doctor_id, appointment_date, status ON appointment
+    WHEN OLD.status IS NOT NEW.status OR OLD.appointment_date IS NOT NEW.appointment_date
+      OR OLD.doctor_id IS NOT NEW.doctor_id BEGIN
+        UPDATE appointment_daily SET appointments = appointments - 1
+        WHERE doctor_id = OLD.doctor_id AND appointment_date = OLD.appointment_date AND status = OLD.status;
+        UPDATE appointment_monthly SET appointments = appointments - 1
+        WHERE doctor_id = OLD.doctor_id AND month = substr(OLD.appointment_date, 1, 7) AND status = OLD.status;
+        INSERT INTO appointment_daily (doctor_id, appointment_date, status, appointments)
+        SELECT NEW.doctor_id, NEW.appointment_date, NEW.status, 1
+        WHERE NEW.doctor_id IS NOT NULL AND NEW.appointment_date IS NOT NULL AND NEW.status IS NOT NULL
+        ON CONFLICT(doctor_id, appointment_date, status) DO UPDATE SET appointments = appointments + 1;
+        INSERT INTO appointment_monthly (doctor_id, month, status, appointments)
+        SELECT NEW.doctor_id, substr(NEW.appointment_date, 1, 7), NEW.status, 1
+        WHERE NEW.doctor_id IS NOT NULL AND NEW.appointment_date IS NOT NULL AND NEW.status IS NOT NULL
+        ON CONFLICT(doctor_id, month, status) DO UPDATE SET appointments = appointments + 1;
+    END""",
+]
+
+def migrate_appointment_rollups(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS appointment_daily(
+        doctor_id INTEGER NOT NULL,
+        appointment_date TEXT NOT NULL,
+        status TEXT NOT NULL,
+        appointments INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (doctor_id, appointment_date, status)
+    ) WITHOUT ROWID""")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS appointment_monthly(
+        doctor_id INTEGER NOT NULL,
+        month TEXT NOT NULL,
+        status TEXT NOT NULL,
+        appointments INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (doctor_id, month, status)
+    ) WITHOUT ROWID""")
+
+    # Backfill from live and archived appointments, then keep both tables current with triggers
+    history = """
+        SELECT doctor_id, appointment_date, status FROM main.appointment
+        UNION ALL
+        SELECT doctor_id, appointment_date, status FROM archive.appointment
+    """
+    cur.execute(f"""
+        INSERT OR REPLACE INTO appointment_daily (doctor_id, appointment_date, status, appointments)
+        SELECT doctor_id, appointment_date, status, COUNT(*) FROM ({history})
+        WHERE doctor_id IS NOT NULL AND appointment_date IS NOT NULL AND status IS NOT NULL
+        GROUP BY doctor_id, appointment_date, status
+    """)
+    cur.execute("""
+        INSERT OR REPLACE INTO appointment_monthly (doctor_id, month, status, appointments)
+        SELECT doctor_id, substr(appointment_date, 1, 7), status, SUM(appointments) FROM appointment_daily
+        GROUP BY doctor_id, substr(appointment_date, 1, 7), status
+    """)
+    for trigger in ROLLUP_TRIGGERS:
+        cur.execute(trigger)
+
+# While a hospital's bulk import runs, its username is in doctor_import and the per-row
+# doctor triggers skip that hospital's rows; refresh_doctor_import() then re-indexes its
+# doctors and bumps the cache generations once for the whole import.
+DOCTOR_IMPORT_GATE = "WHEN NOT EXISTS (SELECT 1 FROM doctor_import WHERE username = NEW.username)"
+# A marker not renewed for this long is left over from an import that died before its
+# refresh (worker killed, Ctrl-C); the triggers stop honouring it and init_db cleans it up
+DOCTOR_IMPORT_STALE_SECONDS = 15 * 60
+# strftime('%s') rather than unixepoch(), which needs SQLite 3.38+
+DOCTOR_IMPORT_LIVE_GATE = ("WHEN NOT EXISTS (SELECT 1 FROM doctor_import WHERE username = NEW.username "
+                           f"AND started_at > CAST(strftime('%s', 'now') AS INTEGER) - {DOCTOR_IMPORT_STALE_SECONDS})")
+
+# Per-row doctor triggers that imports suspend: name -> (event, body)
+GATED_DOCTOR_TRIGGERS = {
+    "doctor_change_update": ("UPDATE", """
+        INSERT INTO doctor_change (doctor_id, version, changed_at) VALUES (NEW.id, 1, datetime('now'))
+        ON CONFLICT(doctor_id) DO UPDATE SET version = version + 1, changed_at = excluded.changed_at;"""),
+    "doctor_generation_insert": ("INSERT", "UPDATE cache_generation SET value = value + 1 WHERE name = 'doctor';"),
+    "doctor_generation_update": ("UPDATE", "UPDATE cache_generation SET value = value + 1 WHERE name = 'doctor';"),
+    "listing_generation_doctor_insert": ("INSERT", "UPDATE cache_generation SET value = value + 1 WHERE name = 'listing';"),
+    "listing_generation_doctor_update": ("UPDATE", "UPDATE cache_generation SET value = value + 1 WHERE name = 'listing';"),
+}
+GATED_SEARCH_TRIGGERS = {
+    "doctor_search_insert": ("INSERT", """
+        INSERT INTO doctor_search (rowid, name, specialization, education, hospital_name, location)
+        VALUES (NEW.id, NEW.name, NEW.specialization, NEW.education,
+                (SELECT name FROM hospital WHERE username = NEW.username),
+                (SELECT location FROM hospital WHERE username = NEW.username));"""),
+    "doctor_search_update": ("UPDATE", """
+        DELETE FROM doctor_search WHERE rowid = OLD.id;
+        INSERT INTO doctor_search (rowid, name, specialization, education, hospital_name, location)
+        VALUES (NEW.id, NEW.name, NEW.specialization, NEW.education,
+                (SELECT name FROM hospital WHERE username = NEW.username),
+                (SELECT location FROM hospital WHERE username = NEW.username));"""),
+}
+GATED_DOCTOR_TRIGGER_SQL = """
+    CREATE TRIGGER {name} AFTER {event} ON doctor
+    {gate}
+    BEGIN
+        {body}
+    END"""
+
+def gate_doctor_triggers(cur, gate):
+    triggers = dict(GATED_DOCTOR_TRIGGERS)
+    if HAS_FTS5:
+        triggers.update(GATED_SEARCH_TRIGGERS)
+    for name, (event, body) in triggers.items():
+        cur.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cur.execute(GATED_DOCTOR_TRIGGER_SQL.format(name=name, event=event, gate=gate, body=body))
+
+def migrate_doctor_import(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS doctor_import(
+        username TEXT PRIMARY KEY,
+        started_at REAL NOT NULL
+    )""")
+    gate_doctor_triggers(cur, DOCTOR_IMPORT_GATE)
+
+def migrate_doctor_import_staleness(cur):
+    gate_doctor_triggers(cur, DOCTOR_IMPORT_LIVE_GATE)
+
+def migrate_doctor_import_portable_gate(cur):
+    # Databases that ran step 13 before the gate moved off unixepoch() carry triggers
+    # that fail on every doctor write under SQLite < 3.38; rebuild them.
+    gate_doctor_triggers(cur, DOCTOR_IMPORT_LIVE_GATE)
+
+# One version bump per imported doctor, through the doctor(username) index
+DOCTOR_IMPORT_VERSIONS_SQL = """
+    INSERT INTO doctor_change (doctor_id, version, changed_at)
+    SELECT id, 1, datetime('now') FROM doctor WHERE username = ?
+    ON CONFLICT(doctor_id) DO UPDATE SET version = version + 1, changed_at = excluded.changed_at
+"""
+
+def refresh_doctor_import(con, username):
+    """Catch search, availability and listing caches up with username's imported doctors, once."""
+    cur = con.cursor()
+    if con.in_transaction:
+        con.rollback()
+    cur.execute("BEGIN IMMEDIATE")
+    if HAS_FTS5:
+        cur.execute("DELETE FROM doctor_search WHERE rowid IN (SELECT id FROM doctor WHERE username=?)", (username,))
+        cur.execute("INSERT INTO doctor_search (rowid, name, specialization, education, hospital_name, location) "
+                    + SEARCH_INDEX_ROW_SQL + " WHERE d.username = ?", (username,))
+    cur.execute(DOCTOR_IMPORT_VERSIONS_SQL, (username,))
+    cur.execute("UPDATE cache_generation SET value = value + 1 WHERE name IN ('doctor', 'listing')")
+    cur.execute("DELETE FROM doctor_import WHERE username=?", (username,))
+    con.commit()
+
+def refresh_stale_doctor_imports(con):
+    """Finish the refresh of imports that died before running it."""
+    cur = con.cursor()
+    cur.execute("SELECT username FROM doctor_import WHERE started_at <= ?", (time.time() - DOCTOR_IMPORT_STALE_SECONDS,))
+    for (username,) in cur.fetchall():
+        app.logger.warning("refreshing doctors of %s after an interrupted import", username)
+        refresh_doctor_import(con, username)
+
+# Ordered schema migrations; each runs once and is recorded in schema_version.
+# Never edit or reorder an applied step - append a new one instead.
+MIGRATIONS = [
+    (1, "base tables", migrate_base_tables),
+    (2, "doctor search index", migrate_search_index),
+    (3, "appointment hot path indexes", migrate_appointment_indexes),
+    (4, "doctor day capacity counters", migrate_doctor_day_capacity),
+    (5, "doctor change tracking", migrate_doctor_change),
+    (6, "cache generation counters", migrate_cache_generation),
+    (7, "doctor leave calendar", migrate_doctor_leave),
+    (8, "listing cache generation", migrate_listing_generation),
+    (9, "booking dedupe and idempotency keys", migrate_booking_dedupe),
+    (10, "appointment names via doctor_id", migrate_appointment_foreign_keys),
+    (11, "appointment analytics rollups", migrate_appointment_rollups),
+    (12, "bulk doctor import", migrate_doctor_import),
+    (13, "expire stale doctor import markers", migrate_doctor_import_staleness),
+    (14, "doctor import gate without unixepoch", migrate_doctor_import_portable_gate),
+]
+
+def init_db(database=None, until=None):
+    """Apply pending migrations; with until, stop after that version (benchmarks of older layouts)."""
+    con = connect_db(database)
+    cur = con.cursor()
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version(
+        version INTEGER PRIMARY KEY,
+        name TEXT,
+        applied_at TEXT
+    )""")
     con.commit()
+
+    for version, name, migrate in MIGRATIONS:
+        if until is not None and version > until:
+            break
+        # BEGIN IMMEDIATE serializes workers that start at the same time;
+        # whoever gets the lock second sees the step as already applied.
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("SELECT 1 FROM schema_version WHERE version=?", (version,))
+        if cur.fetchone():
+            con.rollback()
+            continue
+        try:
+            migrate(cur)
+            cur.execute("INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                        (version, name, datetime.now().isoformat(timespec="seconds")))
+            con.commit()
+        except Exception:
+            con.rollback()
+            con.close()
+            raise
+
+    if until is None:
+        refresh_stale_doctor_imports(con)
     con.close()
 
 init_db()
 
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+AVAILABLE = (False, None, None)
+
+def weekday_mask(weekly_holiday):
+    # "Sunday, Monday" -> bit 6 | bit 0 (bits follow date.weekday())
+    mask = 0
+    for day in (weekly_holiday or "").split(','):
+        if day.strip() in WEEKDAYS:
+            mask |= 1 << WEEKDAYS.index(day.strip())
+    return mask
+
+def unavailability_on(mask, leave_session, day):
+    day_str = day.strftime('%Y-%m-%d')
+    if mask & (1 << day.weekday()):
+        return True, "weekly_holiday", f"{WEEKDAYS[day.weekday()]} (Weekly Holiday)"
+    if leave_session:
+        return True, "emergency", f"{day_str} - {leave_session}"
+    return AVAILABLE
+
+def cache_generation(cur, name):
+    cur.execute("SELECT value FROM cache_generation WHERE name=?", (name,))
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+LEAVES_COVERING_SQL = "SELECT doctor_id, session FROM doctor_leave WHERE end_date >= ? AND start_date <= ?"
+
+class AvailabilityCache:
+    """Weekly holiday bitmasks for every doctor plus today's status, shared by all requests.
+
+    Rebuilt whenever the doctor generation (bumped by triggers on every doctor or
+    leave write, in any worker) changes, and rolled over to the new date after midnight.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.database = None
+        self.generation = None
+        self.day = None
+        self.masks = {}
+        self.today = {}
+
+    def today_status(self, cur):
+        generation = cache_generation(cur, "doctor")
+        today = datetime.now().date()
+        with self.lock:
+            if self.generation != generation or self.database != app.config["DATABASE"]:
+                cur.execute("SELECT id, weekly_holiday FROM doctor")
+                self.masks = {doctor_id: weekday_mask(weekly_holiday) for doctor_id, weekly_holiday in cur.fetchall()}
+                self.generation = generation
+                self.database = app.config["DATABASE"]
+                self.day = None
+            if self.day != today:
+                today_str = today.strftime('%Y-%m-%d')
+                cur.execute(LEAVES_COVERING_SQL, (today_str, today_str))
+                on_leave = dict(cur.fetchall())
+                self.today = {}
+                for doctor_id, mask in self.masks.items():
+                    status = unavailability_on(mask, on_leave.get(doctor_id), today)
+                    if status[0]:
+                        self.today[doctor_id] = status
+                self.day = today
+            return self.today
+
+availability = AvailabilityCache()
+
 # **NEW: Function to check if doctor is unavailable TODAY**
 def is_doctor_unavailable_today(doctor):
     if not doctor:
-        return False, None, None
-    
-    today_str = datetime.now().strftime('%Y-%m-%d')
-    today_weekday = datetime.now().strftime('%A')
-    
-    # Check WEEKLY HOLIDAY
-    weekly_holiday = doctor[6] or ""
-    weekly_days = [day.strip() for day in weekly_holiday.split(',') if day.strip()]
-    if today_weekday in weekly_days:
-        return True, "weekly_holiday", f"{today_weekday} (Weekly Holiday)"
-    
-    # Check EMERGENCY LEAVE
-    emergency_leave = doctor[7] or ""
-    if emergency_leave.startswith(today_str + " "):
-        session_info = emergency_leave.replace(today_str + " ", "")
-        return True, "emergency", f"{today_str} - {session_info}"
-    
-    return False, None, None
+        return AVAILABLE
 
-@app.route("/", methods=["GET","POST"])
-def home():
-    search_query = request.args.get("search", "").strip().lower()
-   
-    con = get_db()
+    # Refreshed at most once per request; afterwards every doctor is a dictionary lookup
+    if "unavailable_today" not in g:
+        g.unavailable_today = availability.today_status(get_db().cursor())
+    return g.unavailable_today.get(doctor[0], AVAILABLE)
+
+DOCTOR_LEAVE_ON_SQL = "SELECT session FROM doctor_leave WHERE doctor_id=? AND start_date <= ? AND end_date >= ? LIMIT 1"
+
+def doctor_unavailable_on(cur, doctor, day):
+    if day == datetime.now().date():
+        return is_doctor_unavailable_today(doctor)
+    day_str = day.strftime('%Y-%m-%d')
+    cur.execute(DOCTOR_LEAVE_ON_SQL, (doctor[0], day_str, day_str))
+    leave = cur.fetchone()
+    return unavailability_on(weekday_mask(doctor[6]), leave[0] if leave else None, day)
+
+UPCOMING_LEAVES_SQL = """
+    SELECT id, doctor_id, start_date, end_date, session FROM doctor_leave
+    WHERE doctor_id IN ({placeholders}) AND end_date >= ?
+    ORDER BY start_date, id
+"""
+
+def upcoming_leaves(cur, doctor_ids):
+    # {doctor_id: [(leave_id, start_date, end_date, session), ...]} for leaves not yet over
+    if not doctor_ids:
+        return {}
+    today = datetime.now().strftime('%Y-%m-%d')
+    cur.execute(UPCOMING_LEAVES_SQL.format(placeholders=",".join("?" * len(doctor_ids))), (*doctor_ids, today))
+    leaves = {}
+    for leave_id, doctor_id, start_date, end_date, session_name in cur.fetchall():
+        leaves.setdefault(doctor_id, []).append((leave_id, start_date, end_date, session_name))
+    return leaves
+
+def valid_appointment_date(value):
+    try:
+        return datetime.strptime(value or "", '%Y-%m-%d').strftime('%Y-%m-%d') == value
+    except ValueError:
+        return False
+
+def booking_date_error(value):
+    """Why value can't be booked, or None for a date from today to BOOKING_MAX_DAYS_AHEAD ahead."""
+    if not isinstance(value, str) or not valid_appointment_date(value):
+        return "Please choose a valid appointment date"
+    day = datetime.strptime(value, '%Y-%m-%d').date()
+    today = datetime.now().date()
+    if day < today:
+        return "Please choose today or a later date"
+    max_days = app.config["BOOKING_MAX_DAYS_AHEAD"]
+    if (day - today).days > max_days:
+        return f"Appointments can be booked at most {max_days} days ahead"
+    return None
+
+# Total, today's and per-status counts in one pass over the covering
+# (doctor_id, status, appointment_date) index of the live and the archived rows.
+# Counted per side: through appointment_all every row would be read from its table.
+APPOINTMENT_COUNTS_SQL = """
+    SELECT COALESCE(SUM(total), 0), COALESCE(SUM(today), 0),
+           COALESCE(SUM(confirmed), 0), COALESCE(SUM(cancelled), 0)
+    FROM (
+        SELECT COUNT(*) AS total, SUM(appointment_date = :today) AS today,
+               SUM(status = 'confirmed') AS confirmed, SUM(status = 'cancelled') AS cancelled
+        FROM main.appointment WHERE doctor_id = :doctor_id
+        UNION ALL
+        SELECT COUNT(*), SUM(appointment_date = :today), SUM(status = 'confirmed'), SUM(status = 'cancelled')
+        FROM archive.appointment WHERE doctor_id = :doctor_id
+    )
+"""
+
+def appointment_counts(cur, doctor_id, today):
+    cur.execute(APPOINTMENT_COUNTS_SQL, {"today": today, "doctor_id": doctor_id})
+    total, today_count, confirmed, cancelled = cur.fetchone()
+    return {"total": total, "today": today_count, "confirmed": confirmed, "cancelled": cancelled}
+
+DUPLICATE_BOOKING = "duplicate"
+
+# Takes a slot only while the day is below max_appointments; no row back means the day is full
+RESERVE_SLOT_SQL = """
+    UPDATE doctor_day_capacity SET booked = booked + 1
+    WHERE doctor_id=? AND appointment_date=? AND booked < ?
+    RETURNING booked
+"""
+INSERT_APPOINTMENT_SQL = """
+    INSERT INTO appointment (doctor_id, appointment_date, patient_name, patient_phone, phone_digits, status)
+    VALUES (?, ?, ?, ?, ?, 'confirmed')
+"""
+
+def reserve_appointment(con, doctor_id, max_appts, appointment, on_booked=None):
+    """Book one appointment if the doctor's day still has a free slot.
+
+    Returns (appointment_id, booked_count), None when the day is full, or
+    DUPLICATE_BOOKING when the patient already has an active booking with the doctor
+    that day. The slot counter and the insert happen in one BEGIN IMMEDIATE
+    transaction, so concurrent workers can never push a day past max_appts.
+    on_booked(cur, appointment_id, booked_count) runs inside that transaction.
+    """
+    appointment_date, patient_name, patient_phone, phone_digits = appointment
     cur = con.cursor()
-   
+    if con.in_transaction:
+        con.commit()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        cur.execute("INSERT OR IGNORE INTO doctor_day_capacity (doctor_id, appointment_date, booked) VALUES (?, ?, 0)",
+                    (doctor_id, appointment_date))
+        cur.execute(RESERVE_SLOT_SQL, (doctor_id, appointment_date, max_appts))
+        row = cur.fetchone()
+        if row is None:
+            con.rollback()
+            return None
+
+        try:
+            cur.execute(INSERT_APPOINTMENT_SQL, (doctor_id, appointment_date, patient_name, patient_phone, phone_digits))
+        except sqlite3.IntegrityError:
+            # idx_appointment_active_booking: a resubmitted form, the slot is given back
+            con.rollback()
+            return DUPLICATE_BOOKING
+        appointment_id = cur.lastrowid
+        if on_booked is not None:
+            on_booked(cur, appointment_id, row[0])
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    return appointment_id, row[0]
+
+@app.template_global()
+def new_idempotency_key():
+    # Rendered into booking forms, so every resubmit of one form shares a key
+    return secrets.token_hex(16)
+
+def idempotency_key():
+    key = (request.headers.get("Idempotency-Key") or request.form.get("idempotency_key") or "").strip()
+    return key[:IDEMPOTENCY_KEY_MAX_LENGTH] or None
+
+def request_fingerprint():
+    # Same key with a different booking is a client bug, not a retry
+    fields = sorted((name, value) for name, value in request.form.items(multi=True) if name != "idempotency_key")
+    return hashlib.sha256(repr((request.method, request.path, fields)).encode()).hexdigest()[:32]
+
+IDEMPOTENCY_REPLAY_SQL = "SELECT fingerprint, status, mimetype, body FROM idempotency_key WHERE key=? AND expires_at > ?"
+IDEMPOTENCY_PURGE_SQL = "DELETE FROM idempotency_key WHERE expires_at <= ?"
+
+def idempotent_replay(cur, key, fingerprint):
+    """The stored response for key, a 422 if key was used for a different request, or None."""
+    cur.execute(IDEMPOTENCY_REPLAY_SQL, (key, int(time.time())))
+    stored = cur.fetchone()
+    if stored is None:
+        return None
+    if stored[0] != fingerprint:
+        return jsonify({"status": "error", "message": "Idempotency-Key was already used for a different request"}), 422
+    response = Response(zlib.decompress(stored[3]), status=stored[1], mimetype=stored[2])
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+def store_idempotent_response(cur, key, fingerprint, response):
+    now = int(time.time())
+    # Expired keys go as new ones come in, through the expires_at index
+    cur.execute(IDEMPOTENCY_PURGE_SQL, (now,))
     cur.execute("""
-        SELECT DISTINCT h.* FROM hospital h
-        INNER JOIN doctor d ON h.username = d.username
-        WHERE h.name != h.username AND h.location != 'Not Set'
-    """)
+        INSERT OR REPLACE INTO idempotency_key (key, fingerprint, status, mimetype, body, expires_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (key, fingerprint, response.status_code, response.mimetype, zlib.compress(response.get_data()),
+          now + app.config["IDEMPOTENCY_TTL"]))
+
+HOSPITAL_PAGE_SIZE = 10
+HOSPITAL_MAX_PAGE_SIZE = 50
+DOCTOR_PAGE_SIZE = 12
+DOCTOR_MAX_PAGE_SIZE = 50
+
+# One keyset page of the hospitals that have filled in their details and list at
+# least one (matching) doctor, in primary key order
+HOSPITAL_PAGE_SQL = """
+    SELECT h.username, h.name, h.location, h.image
+    FROM hospital h
+    WHERE h.name != h.username AND h.location != 'Not Set' AND h.username > :cursor
+      AND EXISTS (SELECT 1 FROM doctor d WHERE d.username = h.username{search_filter})
+    ORDER BY h.username
+    LIMIT :limit
+"""
+
+# The first :per_hospital doctors of every hospital on a page, in one query
+HOSPITAL_DOCTORS_SQL = """
+    SELECT * FROM (
+        SELECT d.*, ROW_NUMBER() OVER (PARTITION BY d.username ORDER BY d.id) AS position
+        FROM doctor d
+        INNER JOIN hospital h ON h.username = d.username
+        WHERE d.username IN ({usernames}){search_filter}
+    )
+    WHERE position <= :per_hospital
+    ORDER BY username, id
+"""
+
+# Later pages of one hospital's doctors
+DOCTOR_PAGE_SQL = """
+    SELECT d.*
+    FROM doctor d
+    INNER JOIN hospital h ON h.username = d.username
+    WHERE d.username = :username AND d.id > :cursor{search_filter}
+    ORDER BY d.id
+    LIMIT :limit
+"""
+
+HOME_FTS_FILTER = """
+      AND d.id IN (SELECT rowid FROM doctor_search WHERE doctor_search MATCH :match)"""
+
+HOME_SEARCH_FILTER = """
+      AND (d.name LIKE :pattern ESCAPE '\\'
+           OR d.specialization LIKE :pattern ESCAPE '\\'
+           OR h.name LIKE :pattern ESCAPE '\\')"""
+
+def like_pattern(text):
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+def listing_filter(search_query):
+    match = fts_match_expression(search_query) if HAS_FTS5 else ""
+    if match:
+        return HOME_FTS_FILTER, {"match": match}
+    if search_query:
+        return HOME_SEARCH_FILTER, {"pattern": like_pattern(search_query)}
+    return "", {}
+
+def listed_doctors(doctors, search_query):
+    listed = []
+    for doctor in doctors:
+        # **ADD AVAILABILITY STATUS TO ALL DOCTORS**
+        unavailable, reason, detail = is_doctor_unavailable_today(doctor)
+        if search_query and unavailable:
+            # Search results only list doctors that can be booked today
+            continue
+        doctor_with_status = list(doctor)
+        doctor_with_status.extend([unavailable, reason, detail])  # Add status at end
+        listed.append(doctor_with_status)
+    return listed
+
+def load_hospital_page(cur, search_query="", cursor="", limit=HOSPITAL_PAGE_SIZE, doctors_per_hospital=DOCTOR_PAGE_SIZE):
+    """One page of the public listing: hospitals with their first doctors, plus the next hospital cursor.
+
+    Two queries whatever the catalogue size. Each hospital carries a doctors_cursor
+    when it has more doctors than fit on the card.
+    """
+    search_filter, params = listing_filter(search_query)
+    cur.execute(HOSPITAL_PAGE_SQL.format(search_filter=search_filter), {**params, "cursor": cursor, "limit": limit + 1})
     hospitals = cur.fetchall()
-   
+    next_cursor = hospitals[limit - 1][0] if len(hospitals) > limit else None
+    hospitals = hospitals[:limit]
+    if not hospitals:
+        return [], None
+
+    usernames = {f"u{i}": hospital[0] for i, hospital in enumerate(hospitals)}
+    cur.execute(HOSPITAL_DOCTORS_SQL.format(usernames=", ".join(f":{name}" for name in usernames), search_filter=search_filter),
+                {**params, **usernames, "per_hospital": doctors_per_hospital + 1})
+    doctors = {}
+    for row in cur:
+        doctors.setdefault(row[1], []).append(row[:-1])
+
     hospitals_with_doctors = []
     for hospital in hospitals:
-        hospital_username = hospital[0]
-        cur.execute("SELECT * FROM doctor WHERE username=?", (hospital_username,))
-        doctors = cur.fetchall()
+        rows = doctors.get(hospital[0], [])
+        doctors_cursor = rows[doctors_per_hospital - 1][0] if len(rows) > doctors_per_hospital else None
+        listed = listed_doctors(rows[:doctors_per_hospital], search_query)
+        if listed or doctors_cursor:
+            hospitals_with_doctors.append({'hospital': hospital, 'doctors': listed, 'doctors_cursor': doctors_cursor})
+    return hospitals_with_doctors, next_cursor
 
-        # **ADD AVAILABILITY STATUS TO ALL DOCTORS**
-        doctors_with_status = []
-        for doctor in doctors:
-            unavailable, reason, detail = is_doctor_unavailable_today(doctor)
-            doctor_with_status = list(doctor)
-            doctor_with_status.extend([unavailable, reason, detail])  # Add status at end
-            doctors_with_status.append(doctor_with_status)
-
-        if search_query:
-            # Filter available doctors only for search
-            filtered_doctors = [d for d in doctors_with_status if not d[-3] and (
-                search_query in d[2].lower() or
-                search_query in d[3].lower() or
-                search_query in hospital[1].lower()
-            )]
-            if filtered_doctors:
-                hospitals_with_doctors.append({
-                    'hospital': hospital,
-                    'doctors': filtered_doctors
-                })
-        else:
-            hospitals_with_doctors.append({
-                'hospital': hospital,
-                'doctors': doctors_with_status
-            })
+def load_doctor_page(cur, username, search_query="", cursor=0, limit=DOCTOR_PAGE_SIZE):
+    search_filter, params = listing_filter(search_query)
+    cur.execute(DOCTOR_PAGE_SQL.format(search_filter=search_filter),
+                {**params, "username": username, "cursor": cursor, "limit": limit + 1})
+    doctors = cur.fetchall()
+    next_cursor = doctors[limit - 1][0] if len(doctors) > limit else None
+    return listed_doctors(doctors[:limit], search_query), next_cursor
+
+def doctor_json(doctor):
+    # Doctor row with the three availability fields appended by listed_doctors()
+    return {
+        "id": doctor[0], "name": doctor[2], "specialization": doctor[3],
+        "education": doctor[4], "timings": doctor[5], "weekly_holiday": doctor[6],
+        "image": doctor[8], "image_srcset": image_json(doctor[8]), "max_appointments": doctor[9],
+        "is_unavailable": doctor[-3], "unavailable_reason": doctor[-2], "unavailable_detail": doctor[-1]
+    }
+
+def page_limit(default, maximum):
+    return min(max(request.args.get("limit", default, type=int), 1), maximum)
+
+class MemoryPageCache:
+    """LRU of rendered pages held by one worker process."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, body):
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, body)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def size(self):
+        with self.lock:
+            return len(self.entries)
+
+class SQLitePageCache:
+    """Rendered pages in a SQLite file next to the database, shared by all workers on the host.
+
+    Entries are evicted oldest-stored first once the file holds more than max_entries,
+    so hits stay read-only.
+    """
+
+    def __init__(self, path, max_entries, ttl):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.con = None
+        self.pid = None
+        self.evictions = 0
+
+    def _connect(self):
+        # Reopened after a fork, like the connection pool
+        if self.con is None or self.pid != os.getpid():
+            self.con = connect_db(self.path, archive=False)
+            self.con.execute("""
+            CREATE TABLE IF NOT EXISTS page_cache(
+                key TEXT PRIMARY KEY,
+                body TEXT NOT NULL,
+                stored_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )""")
+            self.con.execute("CREATE INDEX IF NOT EXISTS idx_page_cache_stored ON page_cache(stored_at)")
+            self.con.commit()
+            self.pid = os.getpid()
+        return self.con
+
+    def get(self, key):
+        with self.lock:
+            cur = self._connect().cursor()
+            cur.execute("SELECT body FROM page_cache WHERE key=? AND expires_at >= ?", (key, time.time()))
+            row = cur.fetchone()
+            return row[0] if row else None
+
+    def set(self, key, body):
+        now = time.time()
+        with self.lock:
+            con = self._connect()
+            cur = con.cursor()
+            cur.execute("INSERT OR REPLACE INTO page_cache (key, body, stored_at, expires_at) VALUES (?, ?, ?, ?)",
+                        (key, body, now, now + self.ttl))
+            cur.execute("DELETE FROM page_cache WHERE expires_at < ?", (now,))
+            evicted = cur.rowcount
+            cur.execute("""
+                DELETE FROM page_cache WHERE key IN (
+                    SELECT key FROM page_cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?
+                )""", (self.max_entries,))
+            evicted += cur.rowcount
+            con.commit()
+            self.evictions += evicted
+
+    def clear(self):
+        with self.lock:
+            con = self._connect()
+            con.execute("DELETE FROM page_cache")
+            con.commit()
+
+    def size(self):
+        with self.lock:
+            cur = self._connect().cursor()
+            cur.execute("SELECT COUNT(*) FROM page_cache")
+            return cur.fetchone()[0]
+
+page_caches = {}
+page_caches_lock = threading.Lock()
+page_cache_counts = {"hits": 0, "misses": 0}
+
+def get_page_cache():
+    backend = app.config["PAGE_CACHE"]
+    if not backend:
+        return None
+    if backend == "sqlite":
+        path = app.config["PAGE_CACHE_PATH"] or os.path.splitext(app.config["DATABASE"])[0] + "_pages.db"
+    elif backend == "memory":
+        path = app.config["DATABASE"]
+    else:
+        raise ValueError(f"unknown PAGE_CACHE backend {backend!r}")
+
+    settings = (backend, path, app.config["PAGE_CACHE_SIZE"], app.config["PAGE_CACHE_TTL"])
+    with page_caches_lock:
+        cache = page_caches.get(settings)
+        if cache is None:
+            if backend == "sqlite":
+                cache = SQLitePageCache(path, settings[2], settings[3])
+            else:
+                cache = MemoryPageCache(settings[2], settings[3])
+            page_caches[settings] = cache
+        return cache
+
+def count_page_cache(outcome):
+    with page_caches_lock:
+        page_cache_counts[outcome] += 1
+
+@app.route("/", methods=["GET","POST"])
+def home():
+    search_query = request.args.get("search", "").strip().lower()
    
-    con.close()
-    return render_template("user.html", hospitals_with_doctors=hospitals_with_doctors, search_query=search_query)
+    con = get_db()
+    cur = con.cursor()
+
+    # The page only depends on the search, today's availability and the listing data,
+    # so that is the whole cache key; any write moves the generation on
+    cache = get_page_cache() if request.method == "GET" else None
+    if cache is not None:
+        key = f"{datetime.now().date()}|{cache_generation(cur, 'listing')}|{search_query}"
+        body = cache.get(key)
+        if body is not None:
+            count_page_cache("hits")
+            return Response(body, mimetype="text/html", headers={"X-Page-Cache": "HIT"})
+        count_page_cache("misses")
+
+    # Only the first page is rendered; the page script fetches the rest from /hospitals while scrolling
+    hospitals_with_doctors, next_cursor = load_hospital_page(cur, search_query)
+    body = render_template("user.html", hospitals_with_doctors=hospitals_with_doctors,
+                           next_cursor=next_cursor, search_query=search_query)
+    if cache is None:
+        return body
+    cache.set(key, body)
+    return Response(body, mimetype="text/html", headers={"X-Page-Cache": "MISS"})
+
+@app.route("/hospitals", methods=["GET"])
+def list_hospitals():
+    search_query = request.args.get("search", "").strip().lower()
+    limit = page_limit(HOSPITAL_PAGE_SIZE, HOSPITAL_MAX_PAGE_SIZE)
+
+    con = get_db()
+    cur = con.cursor()
+    hospitals_with_doctors, next_cursor = load_hospital_page(cur, search_query, request.args.get("cursor", ""), limit)
+    return jsonify({
+        "hospitals": [{
+            "username": item['hospital'][0], "name": item['hospital'][1],
+            "location": item['hospital'][2], "image": item['hospital'][3],
+            "image_srcset": image_json(item['hospital'][3]),
+            "doctors": [doctor_json(doctor) for doctor in item['doctors']],
+            "doctors_cursor": item['doctors_cursor']
+        } for item in hospitals_with_doctors],
+        "next_cursor": next_cursor
+    })
+
+@app.route("/hospitals/<username>/doctors", methods=["GET"])
+def list_hospital_doctors(username):
+    search_query = request.args.get("search", "").strip().lower()
+    limit = page_limit(DOCTOR_PAGE_SIZE, DOCTOR_MAX_PAGE_SIZE)
+
+    con = get_db()
+    cur = con.cursor()
+    doctors, next_cursor = load_doctor_page(cur, username, search_query, request.args.get("cursor", 0, type=int), limit)
+    return jsonify({
+        "doctors": [doctor_json(doctor) for doctor in doctors],
+        "next_cursor": next_cursor
+    })
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 50
+
+# Columns: name, specialization, education, hospital_name, location
+SEARCH_RANKED_SQL = """
+    SELECT d.*, h.name, h.location
+    FROM doctor_search
+    JOIN doctor d ON d.id = doctor_search.rowid
+    JOIN hospital h ON h.username = d.username
+    WHERE doctor_search MATCH ? AND h.name != h.username AND h.location != 'Not Set'
+    ORDER BY bm25(doctor_search, 10.0, 5.0, 1.0, 3.0, 2.0), d.id
+    LIMIT ? OFFSET ?
+"""
+
+SEARCH_LIKE_SQL = """
+    SELECT d.*, h.name, h.location
+    FROM doctor d
+    JOIN hospital h ON h.username = d.username
+    WHERE h.name != h.username AND h.location != 'Not Set'
+      AND (d.name LIKE :pattern ESCAPE '\\' OR d.specialization LIKE :pattern ESCAPE '\\'
+           OR d.education LIKE :pattern ESCAPE '\\' OR h.name LIKE :pattern ESCAPE '\\'
+           OR h.location LIKE :pattern ESCAPE '\\')
+    ORDER BY d.name, d.id
+    LIMIT :limit OFFSET :offset
+"""
+
+@app.route("/search_doctors", methods=["GET"])
+def search_doctors():
+    query = request.args.get("q", "").strip()
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = min(max(request.args.get("per_page", SEARCH_PAGE_SIZE, type=int), 1), SEARCH_MAX_PAGE_SIZE)
+    offset = (page - 1) * per_page
+
+    con = get_db()
+    cur = con.cursor()
+    # Fetch one extra row to know whether another page exists without counting every match
+    if HAS_FTS5:
+        match = fts_match_expression(query)
+        if match:
+            cur.execute(SEARCH_RANKED_SQL, (match, per_page + 1, offset))
+    elif query:
+        cur.execute(SEARCH_LIKE_SQL, {"pattern": like_pattern(query), "limit": per_page + 1, "offset": offset})
+    rows = cur.fetchall() if cur.description else []
+
+    results = []
+    for row in rows[:per_page]:
+        doctor, hospital_name, hospital_location = row[:-2], row[-2], row[-1]
+        unavailable, reason, detail = is_doctor_unavailable_today(doctor)
+        results.append({
+            "id": doctor[0], "name": doctor[2], "specialization": doctor[3],
+            "education": doctor[4], "timings": doctor[5], "image": doctor[8], "image_srcset": image_json(doctor[8]),
+            "hospital_name": hospital_name, "hospital_location": hospital_location,
+            "is_unavailable": unavailable, "unavailable_reason": reason, "unavailable_detail": detail
+        })
+
+    return jsonify({
+        "query": query,
+        "page": page,
+        "per_page": per_page,
+        "results": results,
+        "has_more": len(rows) > per_page
+    })
+
+DOCTOR_BY_ID_SQL = "SELECT * FROM doctor WHERE id=?"
+# Bumped by triggers on every change to the doctor or their appointments
+DOCTOR_VERSION_SQL = "SELECT version FROM doctor_change WHERE doctor_id=?"
+
+PROFILE_HISTORY_PAGE_SIZE = 25
 
 @app.route("/doctor_profile/<int:doctor_id>", methods=["GET"])
 def doctor_profile(doctor_id):
     con = get_db()
     cur = con.cursor()
     
-    cur.execute("SELECT * FROM doctor WHERE id=?", (doctor_id,))
+    cur.execute(DOCTOR_BY_ID_SQL, (doctor_id,))
     doctor = cur.fetchone()
     
     if not doctor:
-        con.close()
         return "Doctor not found", 404
     
     is_unavailable, reason, detail = is_doctor_unavailable_today(doctor)
@@ -157,89 +1884,80 @@ def doctor_profile(doctor_id):
     cur.execute("SELECT * FROM hospital WHERE username=?", (doctor[1],))
     hospital = cur.fetchone()
     
-    cur.execute("""
-        SELECT id, doctor_name, hospital_name, appointment_date, patient_name, patient_phone, status 
-        FROM appointment WHERE doctor_id=? ORDER BY appointment_date DESC, id DESC
-    """, (doctor_id,))
-    appointments = cur.fetchall()
-    
-    con.close()
+    # First page of the history; the rest comes from /doctor_profile/<id>/appointments
+    appointments, next_cursor = appointment_history(cur, "doctor_id", doctor_id, None, PROFILE_HISTORY_PAGE_SIZE)
+    leaves = upcoming_leaves(cur, [doctor_id]).get(doctor_id, [])
     
     return render_template("doctor_profile.html", 
                            doctor=doctor, 
                            hospital=hospital, 
                            appointments=appointments,
+                           next_cursor=next_cursor,
+                           leaves=leaves,
                            is_unavailable=is_unavailable,
                            unavailable_reason=reason,
                            unavailable_detail=detail)
 
+@app.route("/doctor_profile/<int:doctor_id>/appointments", methods=["GET"])
+def doctor_profile_appointments(doctor_id):
+    limit = page_limit(PROFILE_HISTORY_PAGE_SIZE, MY_APPOINTMENTS_MAX_PAGE_SIZE)
+    cursor = parse_history_cursor(request.args.get("cursor"))
+
+    con = get_db()
+    cur = con.cursor()
+    appointments, next_cursor = appointment_history(cur, "doctor_id", doctor_id, cursor, limit)
+    return jsonify({
+        "appointments": [appointment_json(apt) for apt in appointments],
+        "next_cursor": next_cursor
+    })
+
 @app.route("/book_appointment/<int:doctor_id>", methods=["GET", "POST"])
 def book_appointment_page(doctor_id):
     con = get_db()
     cur = con.cursor()
     
-    cur.execute("SELECT * FROM doctor WHERE id=?", (doctor_id,))
+    cur.execute(DOCTOR_BY_ID_SQL, (doctor_id,))
     doctor = cur.fetchone()
     
     if not doctor:
-        con.close()
         return "Doctor not found", 404
-    
-    # **INLINE UNAVAILABLE MESSAGE - NO SEPARATE TEMPLATE NEEDED**
-    is_unavailable, reason, detail = is_doctor_unavailable_today(doctor)
-    if is_unavailable:
-        cur.execute("SELECT * FROM hospital WHERE username=?", (doctor[1],))
-        hospital = cur.fetchone()
-        con.close()
-        
-        return f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Doctor Unavailable</title>
-            <style>
-                body {{ font-family: Arial; text-align: center; padding: 50px; background: #f5f5f5; margin: 0; }}
-                .msg {{ background: white; padding: 40px; border-radius: 15px; box-shadow: 0 10px 30px rgba(0,0,0,0.2); max-width: 500px; margin: 0 auto; }}
-                h1 {{ color: #dc3545; font-size: 32px; margin-bottom: 20px; }}
-                .doctor-name {{ font-size: 24px; color: #333; margin: 20px 0; }}
-                .reason {{ background: #f8d7da; color: #721c24; padding: 15px; border-radius: 8px; margin: 20px 0; font-size: 16px; }}
-                .back {{ padding: 12px 30px; background: #007bff; color: white; text-decoration: none; border-radius: 25px; display: inline-block; margin-top: 20px; }}
-                .back:hover {{ background: #0056b3; }}
-            </style>
-        </head>
-        <body>
-            <div class='msg'>
-                <h1>🚨 Doctor Unavailable Today</h1>
-                <div class='reason'>
-                    <strong>Reason:</strong> {reason.title() if reason else 'Unknown'}<br>
-                    <strong>Details:</strong> {detail or 'No details available'}
-                </div>
-                <div class='doctor-name'>{doctor[2]}</div>
-                <p style='color: #666; font-size: 16px;'>Please try another doctor or check back tomorrow.</p>
-                <a href='/' class='back'>🏥 Browse Other Doctors</a>
-            </div>
-        </body>
-        </html>
-        """
+
+    # A resubmitted form carries the key it was rendered with and gets the original confirmation
+    key = idempotency_key() if request.method == "POST" else None
+    if key:
+        fingerprint = request_fingerprint()
+        replay = idempotent_replay(cur, key, fingerprint)
+        if replay is not None:
+            return replay
     
     cur.execute("SELECT * FROM hospital WHERE username=?", (doctor[1],))
     hospital = cur.fetchone()
     
-    cur.execute("SELECT COUNT(*) FROM appointment WHERE doctor_id=?", (doctor_id,))
-    existing_count = cur.fetchone()[0]
-    
     today = datetime.now().strftime('%Y-%m-%d')
-    cur.execute("SELECT COUNT(*) FROM appointment WHERE doctor_id=? AND appointment_date=?", (doctor_id, today))
-    today_count = cur.fetchone()[0]
-    
-    cur.execute("SELECT COUNT(*) FROM appointment WHERE doctor_id=?", (doctor_id,))
-    next_number = cur.fetchone()[0] + 1
-
+    counts = appointment_counts(cur, doctor_id, today)
+    existing_count = counts["total"]
+    today_count = counts["today"]
+    next_number = existing_count + 1
     
     max_appts = doctor[9] if len(doctor) > 9 and doctor[9] else DAILY_APPOINTMENT_LIMIT
-    can_book_today = today_count < max_appts
-    
-    con.close()
+    # Only today's stat box uses these: the form books any date, checked against that date below
+    is_unavailable, _, unavailable_detail = is_doctor_unavailable_today(doctor)
+    can_book_today = today_count < max_appts and not is_unavailable
+
+    def render_booking_page(error=None, **overrides):
+        return render_template("book_appointment.html",
+                               doctor=doctor,
+                               hospital=hospital,
+                               existing_count=existing_count,
+                               today_count=today_count,
+                               daily_limit=max_appts,
+                               can_book_today=can_book_today,
+                               unavailable_detail=unavailable_detail,
+                               next_appointment_number=next_number,
+                               earliest_date=today,
+                               latest_date=(datetime.now() + timedelta(days=app.config["BOOKING_MAX_DAYS_AHEAD"])).strftime('%Y-%m-%d'),
+                               error=error,
+                               **overrides)
     
     if request.method == "POST":
         appointment_date = request.form.get("appointment_date")
@@ -247,237 +1965,822 @@ def book_appointment_page(doctor_id):
         patient_phone = request.form.get("patient_phone", "").strip()
 
         if not patient_name or len(patient_name) < 2:
-            return render_template("book_appointment.html", 
-                                   doctor=doctor, 
-                                   hospital=hospital,
-                                   existing_count=existing_count,
-                                   today_count=today_count,
-                                   daily_limit=max_appts,
-                                   can_book_today=can_book_today,
-                                   next_appointment_number=next_number,
-                                   error="Patient name is required (minimum 2 characters)")
-
-        phone_digits = re.sub(r'\D', '', patient_phone)
+            return render_booking_page("Patient name is required (minimum 2 characters)")
+
+        phone_digits = normalize_phone(patient_phone)
         if len(phone_digits) != 10:
-            return render_template("book_appointment.html", 
-                                   doctor=doctor, 
-                                   hospital=hospital,
-                                   existing_count=existing_count,
-                                   today_count=today_count,
-                                   daily_limit=max_appts,
-                                   can_book_today=can_book_today,
-                                   next_appointment_number=next_number,
-                                   error="Phone number must be exactly 10 digits")
+            return render_booking_page("Phone number must be exactly 10 digits")
 
-        con = get_db()
-        cur = con.cursor()
-        
-        cur.execute("SELECT COUNT(*) FROM appointment WHERE doctor_id=? AND appointment_date=?", (doctor_id, appointment_date))
-        daily_count = cur.fetchone()[0]
-        
-        if daily_count >= max_appts:
-            con.close()
-            return render_template("book_appointment.html", 
-                                   doctor=doctor, 
-                                   hospital=hospital,
-                                   existing_count=existing_count,
-                                   today_count=today_count,
-                                   daily_limit=max_appts,
-                                   can_book_today=False,
-                                   next_appointment_number=next_number,
-                                   error=f"Daily limit reached! Maximum {max_appts} appointments per day per doctor.")
+        date_error = booking_date_error(appointment_date)
+        if date_error:
+            return render_booking_page(date_error)
+
+        date_unavailable, _, date_detail = doctor_unavailable_on(
+            cur, doctor, datetime.strptime(appointment_date, '%Y-%m-%d').date())
+        if date_unavailable:
+            return render_booking_page(f"Doctor is unavailable on the selected date: {date_detail}")
+
+        confirmation = []
+
+        def on_booked(cur, appointment_id, booked):
+            response = Response(render_template("booking_success.html", 
+                                                doctor=doctor, 
+                                                hospital=hospital,
+                                                appointment_date=appointment_date,
+                                                patient_name=patient_name,
+                                                patient_phone=patient_phone,
+                                                appointment_number=next_number), mimetype="text/html")
+            if key:
+                store_idempotent_response(cur, key, fingerprint, response)
+            confirmation.append(response)
+
+        booking = reserve_appointment(con, doctor_id, max_appts, (
+            appointment_date, patient_name, patient_phone, phone_digits), on_booked)
         
-        cur.execute("""
-            INSERT INTO appointment (doctor_id, doctor_name, hospital_name, appointment_date, patient_name, patient_phone, status)
-            VALUES (?, ?, ?, ?, ?, ?, 'confirmed')""", (doctor_id, doctor[2], hospital[1], appointment_date, patient_name, patient_phone))
-        con.commit()
-        con.close()
+        if booking == DUPLICATE_BOOKING:
+            replay = idempotent_replay(cur, key, fingerprint) if key else None
+            return replay or render_booking_page("You already have an appointment with this doctor on that date")
 
-        return render_template("booking_success.html", 
-                               doctor=doctor, 
-                               hospital=hospital,
-                               appointment_date=appointment_date,
-                               patient_name=patient_name,
-                               patient_phone=patient_phone,
-                               appointment_number=next_number)
+        if booking is None:
+            return render_booking_page(f"Daily limit reached on {appointment_date}! Maximum {max_appts} appointments per day per doctor.")
+
+        return confirmation[0]
     
     now = datetime.now()
     appointment_date = now if now.hour < 9 else now + timedelta(days=1)
     default_date = appointment_date.strftime('%Y-%m-%d')
     
-    return render_template("book_appointment.html", 
-                           doctor=doctor, 
-                           hospital=hospital,
-                           existing_count=existing_count,
-                           today_count=today_count,
-                           daily_limit=max_appts,
-                           can_book_today=can_book_today,
-                           next_appointment_number=next_number,
-                           default_date=default_date)
+    return render_booking_page(default_date=default_date)
+
+def appointment_stats(cur, doctor, today, unavailable):
+    is_unavailable, reason, detail = unavailable
+    max_appts = doctor[9] if len(doctor) > 9 and doctor[9] else DAILY_APPOINTMENT_LIMIT
+    counts = appointment_counts(cur, doctor[0], today)
+    can_book_today = counts["today"] < max_appts and not is_unavailable
+
+    return {
+        "existing_count": counts["total"],
+        "today_count": counts["today"],
+        "confirmed_count": counts["confirmed"],
+        "cancelled_count": counts["cancelled"],
+        "daily_limit": max_appts,
+        "can_book_today": can_book_today,
+        "is_unavailable": is_unavailable,
+        "unavailable_reason": reason,
+        "next_appointment_number": counts["total"] + 1
+    }
 
 @app.route("/get_appointment_stats/<int:doctor_id>", methods=["GET"])
 def get_appointment_stats(doctor_id):
     con = get_db()
     cur = con.cursor()
     
-    cur.execute("SELECT * FROM doctor WHERE id=?", (doctor_id,))
+    cur.execute(DOCTOR_BY_ID_SQL, (doctor_id,))
     doctor = cur.fetchone()
-    
-    is_unavailable, reason, detail = is_doctor_unavailable_today(doctor)
-    
-    max_appts = doctor[9] if len(doctor) > 9 and doctor[9] else DAILY_APPOINTMENT_LIMIT
-    
-    cur.execute("SELECT COUNT(*) FROM appointment WHERE doctor_id=?", (doctor_id,))
-    existing_count = cur.fetchone()[0]
-    
+    if not doctor:
+        return jsonify({"status": "error", "message": "Doctor not found"}), 404
+
+    # **CONDITIONAL GET** - the answer only changes with the doctor's appointments/profile or the date
+    # ETag only: changed_at has one-second resolution, so a Last-Modified validator could
+    # answer 304 for a booking made in the same second as the client's copy
     today = datetime.now().strftime('%Y-%m-%d')
-    cur.execute("SELECT COUNT(*) FROM appointment WHERE doctor_id=? AND appointment_date=?", (doctor_id, today))
-    today_count = cur.fetchone()[0]
-    
-    cur.execute("SELECT COUNT(*) FROM appointment WHERE doctor_id=?", (doctor_id,))
-    next_number = cur.fetchone()[0] + 1
-    
-    can_book_today = today_count < max_appts and not is_unavailable
-    
-    con.close()
-    return jsonify({
-        "existing_count": existing_count,
-        "today_count": today_count,
-        "daily_limit": max_appts,
-        "can_book_today": can_book_today,
-        "is_unavailable": is_unavailable,
-        "unavailable_reason": reason,
-        "next_appointment_number": next_number
-    })
+    cur.execute(DOCTOR_VERSION_SQL, (doctor_id,))
+    change = cur.fetchone() or (0,)
+    etag = f"{doctor_id}-{change[0]}-{today}"
+
+    if not is_resource_modified(request.environ, etag=etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(appointment_stats(cur, doctor, today, is_doctor_unavailable_today(doctor)))
+
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+# ---------------------------------------------------------------------------
+# Live slot push: /doctor_events/<doctor_id> streams a doctor's stats as
+# server-sent events whenever a booking, cancellation, profile or leave change
+# (from any worker) moves them, instead of clients polling /get_appointment_stats.
+# ---------------------------------------------------------------------------
+
+class SlotSubscription:
+    """Mailbox of one open event stream: the hub's poller thread puts stats in, the stream takes them out."""
+
+    def __init__(self, doctor_id):
+        self.doctor_id = doctor_id
+        self.updates = queue.SimpleQueue()
+        self.last = None
+        # Set once the ASGI event loop takes over the stream after the first message
+        self.loop = None
+        self.ready = None
+
+    def put(self, payload):
+        self.updates.put(payload)
+        loop = self.loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self.ready.set)
+
+    def attach(self, loop):
+        self.ready = asyncio.Event()
+        self.loop = loop
+        if not self.updates.empty():
+            self.ready.set()
+
+    def event(self, payload):
+        """The SSE message for payload, or None if the stream has already sent it (or something newer)."""
+        if payload is None:
+            return "event: gone\ndata: {}\n\n"
+        if self.last is not None and (payload["version"] < self.last["version"] or payload == self.last):
+            return None
+        self.last = payload
+        return f"id: {payload['version']}\nevent: stats\ndata: {json.dumps(payload)}\n\n"
+
+DOCTOR_VERSIONS_SQL = "SELECT doctor_id, version FROM doctor_change WHERE doctor_id IN ({placeholders})"
+
+class SlotHub:
+    """In-process pub/sub of each doctor's live stats.
+
+    One poller thread per worker process watches PRAGMA data_version, which moves
+    whenever another connection (in any worker) commits, and only then re-reads the
+    doctor_change versions of the doctors someone is subscribed to. A doctor whose
+    version moved gets its stats computed once and handed to every subscriber, so the
+    database load depends on the number of changes, not on the number of open pages.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        # doctor_id -> (doctor_change version, date) last published
+        self.published = {}
+        self.pid = None
+
+    def subscribe(self, subscription):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.subscribers = {}
+                self.published = {}
+                threading.Thread(target=self.poll, name="slot-hub", daemon=True).start()
+            self.subscribers.setdefault(subscription.doctor_id, set()).add(subscription)
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.doctor_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[subscription.doctor_id]
+                    self.published.pop(subscription.doctor_id, None)
+
+    def subscriber_count(self):
+        with self.lock:
+            return sum(len(subscribers) for subscribers in self.subscribers.values())
+
+    def publish(self, doctor_id, payload):
+        with self.lock:
+            subscribers = list(self.subscribers.get(doctor_id, ()))
+        for subscription in subscribers:
+            subscription.put(payload)
+
+    def poll(self):
+        con = None
+        database = None
+        seen = None
+        while True:
+            time.sleep(app.config["SLOT_EVENTS_POLL_INTERVAL"])
+            with self.lock:
+                doctor_ids = list(self.subscribers)
+            if not doctor_ids:
+                continue
+            try:
+                if con is None or database != app.config["DATABASE"]:
+                    if con is not None:
+                        con.close()
+                    database = app.config["DATABASE"]
+                    con = connect_db(database)
+                    seen = None
+                cur = con.cursor()
+                cur.execute("PRAGMA data_version")
+                # New subscribers are checked against the next commit, the view sent them the current stats
+                current = (cur.fetchone()[0], datetime.now().date())
+                if current != seen:
+                    seen = current
+                    self.refresh(cur, doctor_ids, current[1])
+            except Exception:
+                # Anything escaping here would end the thread, and with it every live update of this worker
+                app.logger.exception("slot event poller failed; reconnecting")
+                if con is not None:
+                    with contextlib.suppress(sqlite3.Error):
+                        con.close()
+                con = None
+                # Doctors marked published by the failed refresh are sent again after reconnecting
+                with self.lock:
+                    self.published = {}
+
+    def refresh(self, cur, doctor_ids, today):
+        versions = {}
+        for start in range(0, len(doctor_ids), 500):
+            chunk = doctor_ids[start:start + 500]
+            cur.execute(DOCTOR_VERSIONS_SQL.format(placeholders=",".join("?" * len(chunk))), chunk)
+            versions.update(cur.fetchall())
+
+        unavailable = None
+        for doctor_id in doctor_ids:
+            version = versions.get(doctor_id)
+            with self.lock:
+                if self.published.get(doctor_id) == (version, today):
+                    continue
+                self.published[doctor_id] = (version, today)
+            payload = None
+            if version is not None:
+                cur.execute(DOCTOR_BY_ID_SQL, (doctor_id,))
+                doctor = cur.fetchone()
+                if doctor:
+                    if unavailable is None:
+                        unavailable = availability.today_status(cur)
+                    payload = appointment_stats(cur, doctor, today.strftime('%Y-%m-%d'),
+                                                unavailable.get(doctor_id, AVAILABLE))
+                    payload["version"] = version
+            self.publish(doctor_id, payload)
+
+slot_hub = SlotHub()
+
+@app.template_global()
+def live_slot_events():
+    """True when asgi_app serves the request, the only mode that streams /doctor_events."""
+    return SLOT_SUBSCRIPTION_KEY in request.environ
+
+@app.route("/doctor_events/<int:doctor_id>", methods=["GET"])
+def doctor_events(doctor_id):
+    if not live_slot_events():
+        # A stream would hold this sync worker for SLOT_EVENTS_MAX_SECONDS; 204 tells
+        # EventSource not to reconnect, and booking pages poll /get_appointment_stats instead
+        return Response(status=204)
 
-@app.route("/my_appointments/<phone>", methods=["GET"])
-def my_appointments(phone):
-    clean_phone = re.sub(r'\D', '', phone)
     con = get_db()
     cur = con.cursor()
-    cur.execute("""
-        SELECT id, doctor_name, hospital_name, appointment_date, patient_name, patient_phone, status 
-        FROM appointment 
-        WHERE patient_phone LIKE ? OR patient_phone LIKE ?
-        ORDER BY appointment_date DESC, id DESC
-    """, (f'%{clean_phone}%', f'%{clean_phone}'))
+
+    cur.execute(DOCTOR_BY_ID_SQL, (doctor_id,))
+    doctor = cur.fetchone()
+    if not doctor:
+        return jsonify({"status": "error", "message": "Doctor not found"}), 404
+
+    # Subscribe before reading the current stats so no change can slip in between
+    subscription = SlotSubscription(doctor_id)
+    slot_hub.subscribe(subscription)
+    try:
+        cur.execute(DOCTOR_VERSION_SQL, (doctor_id,))
+        change = cur.fetchone()
+        stats = appointment_stats(cur, doctor, datetime.now().strftime('%Y-%m-%d'), is_doctor_unavailable_today(doctor))
+        stats["version"] = change[0] if change else 0
+    except Exception:
+        slot_hub.unsubscribe(subscription)
+        raise
+    first = f"retry: {SLOT_EVENTS_RETRY_MS}\n\n" + subscription.event(stats)
+
+    # asgi_app sends the rest of the stream from its event loop
+    request.environ[SLOT_SUBSCRIPTION_KEY] = subscription
+    response = Response([first], mimetype="text/event-stream")
+    # The stream goes on after the first message, so it must not get a Content-Length
+    response.automatically_set_content_length = False
+    response.cache_control.no_cache = True
+    # Tell nginx-style proxies not to buffer the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+OPEN_DAYS_DEFAULT_WEEKS = 4
+OPEN_DAYS_MAX_WEEKS = 12
+
+# Profile, overlapping leaves and booked counts for the whole window in one round trip
+DOCTOR_OPEN_DAYS_SQL = """
+    SELECT 'doctor', weekly_holiday, NULL, max_appointments FROM doctor WHERE id = :doctor_id
+    UNION ALL
+    SELECT 'leave', start_date, end_date, session FROM doctor_leave
+    WHERE doctor_id = :doctor_id AND start_date <= :end AND end_date >= :start
+    UNION ALL
+    SELECT 'booked', appointment_date, NULL, booked FROM doctor_day_capacity
+    WHERE doctor_id = :doctor_id AND appointment_date BETWEEN :start AND :end
+"""
+
+@app.route("/doctor_open_days/<int:doctor_id>", methods=["GET"])
+def doctor_open_days(doctor_id):
+    weeks = min(max(request.args.get("weeks", OPEN_DAYS_DEFAULT_WEEKS, type=int), 1), OPEN_DAYS_MAX_WEEKS)
+    first_day = datetime.now().date()
+    last_day = first_day + timedelta(days=weeks * 7 - 1)
+    window = {"doctor_id": doctor_id, "start": first_day.strftime('%Y-%m-%d'), "end": last_day.strftime('%Y-%m-%d')}
+
+    con = get_db()
+    cur = con.cursor()
+    cur.execute(DOCTOR_OPEN_DAYS_SQL, window)
+
+    profile = None
+    leaves = []
+    booked = {}
+    for kind, first, second, value in cur.fetchall():
+        if kind == "doctor":
+            profile = (first, value)
+        elif kind == "leave":
+            leaves.append((first, second, value))
+        else:
+            booked[first] = value
+    if profile is None:
+        return jsonify({"status": "error", "message": "Doctor not found"}), 404
+
+    mask = weekday_mask(profile[0])
+    max_appts = profile[1] or DAILY_APPOINTMENT_LIMIT
+    days = []
+    for offset in range((last_day - first_day).days + 1):
+        day = first_day + timedelta(days=offset)
+        day_str = day.strftime('%Y-%m-%d')
+        leave_session = next((leave[2] for leave in leaves if leave[0] <= day_str <= leave[1]), None)
+        unavailable, reason, detail = unavailability_on(mask, leave_session, day)
+        day_booked = booked.get(day_str, 0)
+        days.append({
+            "date": day_str,
+            "weekday": WEEKDAYS[day.weekday()],
+            "open": not unavailable and day_booked < max_appts,
+            "unavailable_reason": reason,
+            "unavailable_detail": detail,
+            "booked": day_booked,
+            "daily_limit": max_appts
+        })
+
+    return jsonify({"doctor_id": doctor_id, "from": window["start"], "to": window["end"], "days": days})
+
+MY_APPOINTMENTS_PAGE_SIZE = 20
+MY_APPOINTMENTS_MAX_PAGE_SIZE = 100
+
+def parse_history_cursor(cursor):
+    # Cursors look like "<appointment_date>|<id>" - the sort key of the last row already returned
+    try:
+        appointment_date, appointment_id = cursor.rsplit("|", 1)
+        return appointment_date, int(appointment_id)
+    except (AttributeError, ValueError):
+        return None
+
+def history_cursor(appointment_date, appointment_id):
+    return f"{appointment_date}|{appointment_id}"
+
+# Appointment rows as pages and exports show them, live and archived. Only doctor_id is
+# stored; the names come from primary key lookups on doctor and hospital, once per returned row.
+APPOINTMENT_ROWS = """
+    SELECT a.id, d.name, h.name, a.appointment_date, a.patient_name, a.patient_phone, a.status
+    FROM appointment_all a
+    LEFT JOIN doctor d ON d.id = a.doctor_id
+    LEFT JOIN hospital h ON h.username = d.username
+"""
+
+HISTORY_ORDER = " ORDER BY a.appointment_date DESC, a.id DESC LIMIT ?"
+
+# Filter column -> (first page, later pages); each column is backed by a (column, appointment_date)
+# index, so every page is an index range walk
+APPOINTMENT_HISTORY_SQL = {
+    "doctor_id": (
+        APPOINTMENT_ROWS + " WHERE a.doctor_id = ?" + HISTORY_ORDER,
+        APPOINTMENT_ROWS + " WHERE a.doctor_id = ? AND (a.appointment_date, a.id) < (?, ?)" + HISTORY_ORDER),
+    "phone_digits": (
+        APPOINTMENT_ROWS + " WHERE a.phone_digits = ?" + HISTORY_ORDER,
+        APPOINTMENT_ROWS + " WHERE a.phone_digits = ? AND (a.appointment_date, a.id) < (?, ?)" + HISTORY_ORDER),
+}
+
+def appointment_history(cur, column, value, cursor, limit):
+    """One page of appointments with <column> = value, newest first, and the cursor for the next page."""
+    first_page, next_page = APPOINTMENT_HISTORY_SQL[column]
+    if cursor:
+        cur.execute(next_page, (value, cursor[0], cursor[1], limit + 1))
+    else:
+        cur.execute(first_page, (value, limit + 1))
     appointments = cur.fetchall()
-    con.close()
-    return jsonify([{
-        "id": apt[0], "doctor_name": apt[1], "hospital_name": apt[2], 
-        "appointment_date": apt[3], "patient_name": apt[4], 
+
+    next_cursor = None
+    if len(appointments) > limit:
+        appointments = appointments[:limit]
+        next_cursor = history_cursor(appointments[-1][3], appointments[-1][0])
+    return appointments, next_cursor
+
+def appointment_json(apt):
+    return {
+        "id": apt[0], "doctor_name": apt[1], "hospital_name": apt[2],
+        "appointment_date": apt[3], "patient_name": apt[4],
         "patient_phone": apt[5], "status": apt[6]
-    } for apt in appointments])
+    }
+
+@app.route("/my_appointments/<phone>", methods=["GET"])
+def my_appointments(phone):
+    clean_phone = normalize_phone(phone)
+    limit = page_limit(MY_APPOINTMENTS_PAGE_SIZE, MY_APPOINTMENTS_MAX_PAGE_SIZE)
+    cursor = parse_history_cursor(request.args.get("cursor"))
+
+    con = get_db()
+    cur = con.cursor()
+    # Exact match on the indexed digits column, walked in (appointment_date, id) order
+    appointments, next_cursor = appointment_history(cur, "phone_digits", clean_phone, cursor, limit)
+
+    return jsonify({
+        "appointments": [appointment_json(apt) for apt in appointments],
+        "next_cursor": next_cursor
+    })
+
+APPOINTMENT_BY_ID_SQL = "SELECT phone_digits, status FROM appointment WHERE id=?"
 
 @app.route("/cancel_appointment/<int:appointment_id>", methods=["POST"])
 def cancel_appointment(appointment_id):
     patient_phone = request.form.get("patient_phone", "")
-    clean_phone = re.sub(r'\D', '', patient_phone)
+    clean_phone = normalize_phone(patient_phone)
     
     con = get_db()
     cur = con.cursor()
     
-    cur.execute("SELECT patient_phone FROM appointment WHERE id=?", (appointment_id,))
+    cur.execute(APPOINTMENT_BY_ID_SQL, (appointment_id,))
     apt = cur.fetchone()
-    if not apt or re.sub(r'\D', '', apt[0]) != clean_phone:
-        con.close()
+    if not apt or apt[0] != clean_phone:
         return jsonify({"status": "error", "message": "❌ Unauthorized: You can only cancel your own appointments"}), 403
     
     cur.execute("UPDATE appointment SET status='cancelled' WHERE id=?", (appointment_id,))
     con.commit()
-    con.close()
     
     return jsonify({"status": "success", "message": "✅ Appointment cancelled successfully!"})
 
 @app.route("/confirm_appointment/<int:appointment_id>", methods=["POST"])
 def confirm_appointment(appointment_id):
     patient_phone = request.form.get("patient_phone", "")
-    clean_phone = re.sub(r'\D', '', patient_phone)
+    clean_phone = normalize_phone(patient_phone)
     
     con = get_db()
     cur = con.cursor()
     
-    cur.execute("SELECT patient_phone, status FROM appointment WHERE id=?", (appointment_id,))
+    cur.execute(APPOINTMENT_BY_ID_SQL, (appointment_id,))
     apt = cur.fetchone()
-    if not apt or re.sub(r'\D', '', apt[0]) != clean_phone:
-        con.close()
+    if not apt or apt[0] != clean_phone:
         return jsonify({"status": "error", "message": "❌ Unauthorized: You can only confirm your own appointments"}), 403
     
     if apt[1] == 'confirmed':
-        con.close()
         return jsonify({"status": "error", "message": "✅ Appointment already confirmed!"}), 400
     
-    cur.execute("UPDATE appointment SET status='confirmed' WHERE id=?", (appointment_id,))
+    try:
+        cur.execute("UPDATE appointment SET status='confirmed' WHERE id=?", (appointment_id,))
+    except sqlite3.IntegrityError:
+        # Reviving a cancelled booking while another one for the same doctor and day is active
+        con.rollback()
+        return jsonify({"status": "error", "message": "You already have an appointment with this doctor on that date"}), 409
     con.commit()
-    con.close()
     
     return jsonify({"status": "success", "message": "✅ Appointment confirmed successfully!"})
 
 @app.route("/appointment", methods=["POST"])
 def book_appointment():
     doctor_id = request.form.get("doctor_id")
-    doctor_name = request.form.get("doctor_name")
-    hospital_name = request.form.get("hospital_name")
     appointment_date = request.form.get("appointment_date")
     patient_name = request.form.get("patient_name", "").strip()
     patient_phone = request.form.get("patient_phone", "").strip()
 
+    con = get_db()
+    cur = con.cursor()
+
+    # **IDEMPOTENT RETRIES** - a repeated key gets the original response, no slot is used
+    key = idempotency_key()
+    if key:
+        fingerprint = request_fingerprint()
+        replay = idempotent_replay(cur, key, fingerprint)
+        if replay is not None:
+            return replay
+
     if not patient_name or len(patient_name) < 2:
         return jsonify({"status": "error", "message": "Patient name is required (minimum 2 characters)"}), 400
     
-    phone_digits = re.sub(r'\D', '', patient_phone)
+    phone_digits = normalize_phone(patient_phone)
     if len(phone_digits) != 10:
         return jsonify({"status": "error", "message": "Phone number must be exactly 10 digits"}), 400
-
-    con = get_db()
-    cur = con.cursor()
     
-    cur.execute("SELECT * FROM doctor WHERE id=?", (doctor_id,))
+    date_error = booking_date_error(appointment_date)
+    if date_error:
+        return jsonify({"status": "error", "message": date_error}), 400
+
+    cur.execute(DOCTOR_BY_ID_SQL, (doctor_id,))
     doctor = cur.fetchone()
+    if not doctor:
+        return jsonify({"status": "error", "message": "Doctor not found"}), 404
     max_appts = doctor[9] if len(doctor) > 9 and doctor[9] else DAILY_APPOINTMENT_LIMIT
     
-    # **CHECK DOCTOR AVAILABILITY**
-    is_unavailable, reason, detail = is_doctor_unavailable_today(doctor)
+    # **CHECK DOCTOR AVAILABILITY ON THE REQUESTED DATE**
+    is_unavailable, reason, detail = doctor_unavailable_on(
+        cur, doctor, datetime.strptime(appointment_date, '%Y-%m-%d').date())
     if is_unavailable:
-        con.close()
         return jsonify({
             "status": "error",
-            "message": f"🚨 Doctor unavailable today: {detail}"
+            "message": f"🚨 Doctor unavailable: {detail}"
         }), 400
     
-    cur.execute("SELECT COUNT(*) FROM appointment WHERE doctor_id=? AND appointment_date=?", (doctor_id, appointment_date))
-    daily_count = cur.fetchone()[0]
+    existing_count = appointment_counts(cur, doctor[0], appointment_date)["total"]
+    next_appointment_number = existing_count + 1
+    confirmation = []
+
+    def on_booked(cur, appointment_id, booked):
+        response = jsonify({
+            "status": "success",
+            "message": "✅ Appointment confirmed!",
+            "existing_count": existing_count,
+            "today_count": booked - 1,
+            "your_appointment_number": next_appointment_number,
+            "patient_name": patient_name,
+            "patient_phone": patient_phone
+        })
+        # Committed with the appointment, so a retry never sees one without the other
+        if key:
+            store_idempotent_response(cur, key, fingerprint, response)
+        confirmation.append(response)
+
+    booking = reserve_appointment(con, doctor[0], max_appts, (
+        appointment_date, patient_name, patient_phone, phone_digits), on_booked)
     
-    if daily_count >= max_appts:
-        con.close()
+    if booking is None:
         return jsonify({
             "status": "error",
             "message": f"❌ Daily limit reached! Maximum {max_appts} appointments per day per doctor."
         }), 400
-    
-    cur.execute("SELECT COUNT(*) FROM appointment WHERE doctor_id=?", (doctor_id,))
-    existing_count = cur.fetchone()[0]
-    
-    cur.execute("SELECT COUNT(*) FROM appointment WHERE doctor_id=?", (doctor_id,))
-    next_appointment_number = cur.fetchone()[0] + 1
+    if booking == DUPLICATE_BOOKING:
+        # A concurrent retry may have committed its response while this one waited for the lock
+        replay = idempotent_replay(cur, key, fingerprint) if key else None
+        return replay or (jsonify({
+            "status": "error",
+            "message": "You already have an appointment with this doctor on that date"
+        }), 409)
 
-    
-    cur.execute("""
-        INSERT INTO appointment (doctor_id, doctor_name, hospital_name, appointment_date, patient_name, patient_phone, status)
-        VALUES (?, ?, ?, ?, ?, ?, 'confirmed')""", (doctor_id, doctor_name, hospital_name, appointment_date, patient_name, patient_phone))
-    con.commit()
-    con.close()
+    return confirmation[0]
+
+BATCH_MAX_ITEMS = 500
+
+def batch_payload():
+    """The JSON array posted to a batch endpoint as (items, None), or (None, error response)."""
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or not items:
+        return None, (jsonify({"status": "error", "message": "Expected a non-empty JSON array"}), 400)
+    if len(items) > BATCH_MAX_ITEMS:
+        return None, (jsonify({"status": "error", "message": f"At most {BATCH_MAX_ITEMS} items per batch"}), 400)
+    return items, None
 
+ID_RE = re.compile(r"[0-9]{1,18}")
+
+def parse_id(value):
+    """value as a row id if it is a JSON integer or a string of ASCII digits, else None.
+
+    str.isdigit() also accepts characters like "²" that int() rejects, and ids must fit
+    SQLite's 64-bit integers.
+    """
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value if 0 <= value < 2 ** 63 else None
+    if isinstance(value, str) and ID_RE.fullmatch(value):
+        return int(value)
+    return None
+
+def batch_error(index, message):
+    return {"index": index, "status": "error", "message": message}
+
+def batch_response(results):
+    succeeded = sum(1 for result in results if result["status"] == "success")
     return jsonify({
         "status": "success",
-        "message": "✅ Appointment confirmed!",
-        "existing_count": existing_count,
-        "today_count": daily_count,
-        "your_appointment_number": next_appointment_number,
-        "patient_name": patient_name,
-        "patient_phone": patient_phone
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results
     })
 
+LEAVES_BETWEEN_SQL = """
+    SELECT doctor_id, start_date, end_date, session FROM doctor_leave
+    WHERE doctor_id IN ({placeholders}) AND end_date >= ? AND start_date <= ?
+    ORDER BY start_date, id
+"""
+
+def leaves_between(cur, doctor_ids, first_day, last_day):
+    # {doctor_id: [(start_date, end_date, session), ...]} overlapping [first_day, last_day]
+    cur.execute(LEAVES_BETWEEN_SQL.format(placeholders=",".join("?" * len(doctor_ids))),
+                (*doctor_ids, first_day, last_day))
+    leaves = {}
+    for doctor_id, start_date, end_date, session_name in cur.fetchall():
+        leaves.setdefault(doctor_id, []).append((start_date, end_date, session_name))
+    return leaves
+
+# Joined from a VALUES list of the requested days so every lookup is a primary key search
+BATCH_SLOT_COUNTERS_SQL = """
+    SELECT c.doctor_id, c.appointment_date, c.booked
+    FROM (VALUES {values}) AS v
+    INNER JOIN doctor_day_capacity c ON c.doctor_id = v.column1 AND c.appointment_date = v.column2
+"""
+# Active bookings for (doctor_id, appointment_date, phone_digits) triples, through idx_appointment_active_booking
+BATCH_ACTIVE_BOOKINGS_SQL = """
+    SELECT a.id, a.doctor_id, a.appointment_date, a.phone_digits
+    FROM (VALUES {values}) AS v
+    INNER JOIN appointment a
+        ON a.phone_digits = v.column3 AND a.appointment_date = v.column2 AND a.doctor_id = v.column1
+    WHERE a.status != 'cancelled'
+"""
+BATCH_APPOINTMENTS_SQL = "SELECT id, phone_digits, status, doctor_id, appointment_date FROM appointment WHERE id IN ({placeholders})"
+
+@app.route("/appointments/batch", methods=["POST"])
+def book_appointments_batch():
+    """Book a JSON array of {doctor_id, appointment_date, patient_name, patient_phone}.
+
+    Every item is validated like /appointment, then all of them are booked in one
+    BEGIN IMMEDIATE transaction: the slot counters of every (doctor, day) in the batch
+    are read once, items are accepted in order until a day is full, then the counters
+    are written with executemany and the appointments one by one. Returns one result per item.
+    """
+    items, error = batch_payload()
+    if error:
+        return error
+
+    results = [None] * len(items)
+    pending = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = batch_error(index, "Each item must be a JSON object")
+            continue
+        patient_name = str(item.get("patient_name") or "").strip()
+        patient_phone = str(item.get("patient_phone") or "").strip()
+        appointment_date = item.get("appointment_date")
+        phone_digits = normalize_phone(patient_phone)
+        date_error = booking_date_error(appointment_date)
+        if len(patient_name) < 2:
+            results[index] = batch_error(index, "Patient name is required (minimum 2 characters)")
+        elif len(phone_digits) != 10:
+            results[index] = batch_error(index, "Phone number must be exactly 10 digits")
+        elif date_error:
+            results[index] = batch_error(index, date_error)
+        elif parse_id(item.get("doctor_id")) is None:
+            results[index] = batch_error(index, "Doctor not found")
+        else:
+            pending.append((index, parse_id(item["doctor_id"]), appointment_date, patient_name, patient_phone, phone_digits))
+
+    con = get_db()
+    cur = con.cursor()
+
+    if pending:
+        doctor_ids = sorted({booking[1] for booking in pending})
+        placeholders = ",".join("?" * len(doctor_ids))
+        cur.execute(f"""
+            SELECT * FROM doctor WHERE id IN ({placeholders})
+        """, doctor_ids)
+        doctors = {doctor[0]: doctor for doctor in cur.fetchall()}
+        dates = sorted(booking[2] for booking in pending)
+        leaves = leaves_between(cur, list(doctors), dates[0], dates[-1]) if doctors else {}
+
+        # **CHECK DOCTOR AVAILABILITY ON EVERY REQUESTED DATE**
+        bookable = []
+        for booking in pending:
+            index, doctor_id, appointment_date = booking[:3]
+            doctor = doctors.get(doctor_id)
+            if not doctor:
+                results[index] = batch_error(index, "Doctor not found")
+                continue
+            day = datetime.strptime(appointment_date, '%Y-%m-%d').date()
+            if day == datetime.now().date():
+                is_unavailable, _, detail = doctor_unavailable_on(cur, doctor, day)
+            else:
+                session_name = next((leave[2] for leave in leaves.get(doctor_id, [])
+                                     if leave[0] <= appointment_date <= leave[1]), None)
+                is_unavailable, _, detail = unavailability_on(weekday_mask(doctor[6]), session_name, day)
+            if is_unavailable:
+                results[index] = batch_error(index, f"🚨 Doctor unavailable: {detail}")
+            else:
+                bookable.append(booking)
+        pending = bookable
+
+    if pending:
+        if con.in_transaction:
+            con.commit()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            days = sorted({(booking[1], booking[2]) for booking in pending})
+            cur.execute(BATCH_SLOT_COUNTERS_SQL.format(values=",".join(["(?, ?)"] * len(days))),
+                        [value for day in days for value in day])
+            booked = {(doctor_id, appointment_date): count for doctor_id, appointment_date, count in cur.fetchall()}
+
+            # Patients who already hold an active booking with the doctor that day
+            patient_days = sorted({(booking[1], booking[2], booking[5]) for booking in pending})
+            cur.execute(BATCH_ACTIVE_BOOKINGS_SQL.format(values=",".join(["(?, ?, ?)"] * len(patient_days))),
+                        [value for patient_day in patient_days for value in patient_day])
+            active = {tuple(row[1:]) for row in cur.fetchall()}
+
+            accepted = []
+            for booking in pending:
+                index, doctor_id, appointment_date = booking[:3]
+                if (doctor_id, appointment_date, booking[5]) in active:
+                    results[index] = batch_error(index, "You already have an appointment with this doctor on that date")
+                    continue
+                doctor = doctors[doctor_id]
+                max_appts = doctor[9] if doctor[9] else DAILY_APPOINTMENT_LIMIT
+                count = booked.get((doctor_id, appointment_date), 0)
+                if count >= max_appts:
+                    results[index] = batch_error(
+                        index, f"❌ Daily limit reached! Maximum {max_appts} appointments per day per doctor.")
+                    continue
+                booked[(doctor_id, appointment_date)] = count + 1
+                active.add((doctor_id, appointment_date, booking[5]))
+                accepted.append((booking, count + 1))
+
+            if accepted:
+                cur.executemany("""
+                    INSERT INTO doctor_day_capacity (doctor_id, appointment_date, booked) VALUES (?, ?, ?)
+                    ON CONFLICT(doctor_id, appointment_date) DO UPDATE SET booked = excluded.booked
+                """, [(doctor_id, appointment_date, booked[(doctor_id, appointment_date)])
+                      for doctor_id, appointment_date in {(b[1], b[2]) for b, _ in accepted}])
+                # One statement per row, so each result gets the id of its own row
+                for (index, doctor_id, appointment_date, patient_name, patient_phone, phone_digits), number in accepted:
+                    cur.execute(INSERT_APPOINTMENT_SQL,
+                                (doctor_id, appointment_date, patient_name, patient_phone, phone_digits))
+                    results[index] = {
+                        "index": index,
+                        "status": "success",
+                        "appointment_id": cur.lastrowid,
+                        "doctor_id": doctor_id,
+                        "appointment_date": appointment_date,
+                        "daily_number": number,
+                        "patient_name": patient_name,
+                        "patient_phone": patient_phone
+                    }
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+
+    return batch_response(results)
+
+@app.route("/appointments/batch_status", methods=["POST"])
+def update_appointments_batch():
+    """Cancel or confirm a JSON array of {appointment_id, patient_phone, status} in one transaction.
+
+    Each item is authorised like /cancel_appointment and /confirm_appointment (the phone
+    must match the booking); the accepted changes are applied with one executemany.
+    """
+    items, error = batch_payload()
+    if error:
+        return error
+
+    results = [None] * len(items)
+    pending = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = batch_error(index, "Each item must be a JSON object")
+        elif item.get("status") not in ("cancelled", "confirmed"):
+            results[index] = batch_error(index, "status must be 'cancelled' or 'confirmed'")
+        elif parse_id(item.get("appointment_id")) is None:
+            results[index] = batch_error(index, "❌ Unauthorized: You can only change your own appointments")
+        else:
+            pending.append((index, parse_id(item["appointment_id"]), normalize_phone(str(item.get("patient_phone") or "")),
+                            item["status"]))
+
+    con = get_db()
+    cur = con.cursor()
+
+    if pending:
+        if con.in_transaction:
+            con.commit()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            appointment_ids = sorted({change[1] for change in pending})
+            cur.execute(BATCH_APPOINTMENTS_SQL.format(placeholders=",".join("?" * len(appointment_ids))), appointment_ids)
+            current = {row[0]: list(row[1:]) for row in cur.fetchall()}
+
+            # Confirming a cancelled booking must not give a patient two active ones for the same doctor and day
+            revived = sorted({tuple(current[change[1]][2:]) + (current[change[1]][0],) for change in pending
+                              if change[3] == "confirmed" and change[1] in current and current[change[1]][1] == "cancelled"})
+            active = {}
+            if revived:
+                cur.execute(BATCH_ACTIVE_BOOKINGS_SQL.format(values=",".join(["(?, ?, ?)"] * len(revived))),
+                            [value for patient_day in revived for value in patient_day])
+                for appointment_id, *patient_day in cur.fetchall():
+                    active.setdefault(tuple(patient_day), set()).add(appointment_id)
+
+            updates = []
+            for index, appointment_id, phone_digits, status in pending:
+                apt = current.get(appointment_id)
+                if not apt or apt[0] != phone_digits:
+                    action = "cancel" if status == "cancelled" else "confirm"
+                    results[index] = batch_error(index, f"❌ Unauthorized: You can only {action} your own appointments")
+                elif status == "confirmed" and apt[1] == "confirmed":
+                    results[index] = batch_error(index, "✅ Appointment already confirmed!")
+                elif status == "confirmed" and apt[1] == "cancelled" and active.get((apt[2], apt[3], apt[0])):
+                    results[index] = batch_error(index, "You already have an appointment with this doctor on that date")
+                else:
+                    patient_day = (apt[2], apt[3], apt[0])
+                    if status == "cancelled":
+                        active.get(patient_day, set()).discard(appointment_id)
+                    elif apt[1] == "cancelled":
+                        active.setdefault(patient_day, set()).add(appointment_id)
+                    apt[1] = status
+                    updates.append((status, appointment_id))
+                    results[index] = {"index": index, "status": "success", "appointment_id": appointment_id,
+                                      "appointment_status": status}
+
+            if updates:
+                cur.executemany("UPDATE appointment SET status=? WHERE id=?", updates)
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+
+    return batch_response(results)
+
 @app.route("/login", methods=["GET","POST"])
 def login():
     if request.method == "POST":
@@ -490,6 +2793,21 @@ def login():
             return render_template("login.html", error="Invalid username or password")
     return render_template("login.html")
 
+HOSPITAL_DOCTOR_COUNT_SQL = "SELECT COUNT(*) FROM doctor WHERE username=?"
+# Everything keyed by a doctor, live and archived, removed before the doctor row itself
+DOCTOR_ROWS_DELETE_SQL = [
+    "DELETE FROM appointment WHERE doctor_id=?",
+    "DELETE FROM archive.appointment WHERE doctor_id=?",
+    "DELETE FROM appointment_daily WHERE doctor_id=?",
+    "DELETE FROM appointment_monthly WHERE doctor_id=?",
+    "DELETE FROM doctor_day_capacity WHERE doctor_id=?",
+    "DELETE FROM doctor_leave WHERE doctor_id=?",
+]
+
+def delete_doctor_rows(cur, doctor_id):
+    for sql in DOCTOR_ROWS_DELETE_SQL:
+        cur.execute(sql, (doctor_id,))
+
 @app.route("/dashboard", methods=["GET", "POST"])
 def dashboard():
     if "user" not in session:
@@ -503,14 +2821,15 @@ def dashboard():
         delete_doctor_id = request.form.get("delete_doctor_id")
         if delete_doctor_id:
             # Ensure the doctor belongs to this logged-in hospital
-            cur.execute("SELECT id FROM doctor WHERE id=? AND username=?", (delete_doctor_id, username))
+            cur.execute("SELECT id, image FROM doctor WHERE id=? AND username=?", (delete_doctor_id, username))
             doc = cur.fetchone()
             if doc:
                 # First delete all appointments for this doctor
-                cur.execute("DELETE FROM appointment WHERE doctor_id=?", (delete_doctor_id,))
+                delete_doctor_rows(cur, delete_doctor_id)
                 # Then delete the doctor record itself
                 cur.execute("DELETE FROM doctor WHERE id=? AND username=?", (delete_doctor_id, username))
                 con.commit()
+                release_image(doc[1])
             return redirect("/dashboard")
             
         name = request.form.get("name", "").strip()
@@ -520,9 +2839,7 @@ def dashboard():
         if "hospital_image" in request.files:
             file = request.files["hospital_image"]
             if file and file.filename:
-                filename = secure_filename(file.filename)
-                image_filename = f"{username}_{filename}"
-                file.save(os.path.join(app.config["UPLOAD_FOLDER"], image_filename))
+                image_filename = save_upload(file)
         
         cur.execute("SELECT * FROM hospital WHERE username=?", (username,))
         existing = cur.fetchone()
@@ -539,13 +2856,43 @@ def dashboard():
                        (username, name, location, image_filename))
         
         con.commit()
+        if existing and image_filename and existing[3] != image_filename:
+            release_image(existing[3])
         return redirect("/dashboard")
     
     cur.execute("SELECT * FROM hospital WHERE username=?", (username,))
     hospital = cur.fetchone()
     
-    cur.execute("SELECT * FROM doctor WHERE username=?", (username,))
+    cur.execute(HOSPITAL_DOCTOR_COUNT_SQL, (username,))
+    doctor_count = cur.fetchone()[0]
+    # First page only; the dashboard script loads the rest from /dashboard/doctors while scrolling
+    doctors_with_status, next_cursor = load_dashboard_doctors(cur, username)
+    # Last ANALYTICS_DEFAULT_MONTHS months; the panel fetches other ranges from /dashboard/analytics
+    analytics = hospital_analytics(cur, username, "month", *analytics_range({}, "month")[0])
+    
+    # If there is no hospital record yet, force edit mode
+    # so the user is immediately asked to enter hospital details.
+    edit_mode = (request.args.get("edit") == "1") or (hospital is None)
+    
+    return render_template("dashboard.html", 
+                           hospital=hospital, 
+                           doctors_with_status=doctors_with_status, 
+                           doctor_count=doctor_count,
+                           next_cursor=next_cursor,
+                           analytics=analytics,
+                           edit_mode=edit_mode)
+
+DASHBOARD_DOCTORS_SQL = "SELECT * FROM doctor WHERE username=? AND id > ? ORDER BY id LIMIT ?"
+# A doctor only if it belongs to the logged-in hospital
+HOSPITAL_DOCTOR_SQL = "SELECT * FROM doctor WHERE id=? AND username=?"
+
+def load_dashboard_doctors(cur, username, cursor=0, limit=DOCTOR_PAGE_SIZE):
+    cur.execute(DASHBOARD_DOCTORS_SQL, (username, cursor, limit + 1))
     doctors = cur.fetchall()
+    next_cursor = doctors[limit - 1][0] if len(doctors) > limit else None
+    doctors = doctors[:limit]
+    
+    leaves = upcoming_leaves(cur, [doctor[0] for doctor in doctors])
     
     # **MARK DOCTORS UNAVAILABLE TODAY**
     doctors_with_status = []
@@ -553,22 +2900,152 @@ def dashboard():
         unavailable, reason, detail = is_doctor_unavailable_today(doctor)
         doctors_with_status.append({
             'doctor': doctor,
+            'leaves': leaves.get(doctor[0], []),
             'is_unavailable': unavailable,
             'unavailable_reason': reason,
             'unavailable_detail': detail
         })
+    return doctors_with_status, next_cursor
+
+@app.route("/dashboard/doctors", methods=["GET"])
+def dashboard_doctors():
+    if "user" not in session:
+        return jsonify({"status": "error", "message": "Login required"}), 401
     
-    con.close()
-    
-    # If there is no hospital record yet, force edit mode
-    # so the user is immediately asked to enter hospital details.
-    edit_mode = (request.args.get("edit") == "1") or (hospital is None)
-    
-    return render_template("dashboard.html", 
-                           hospital=hospital, 
-                           doctors_with_status=doctors_with_status, 
-                           edit_mode=edit_mode)
+    limit = page_limit(DOCTOR_PAGE_SIZE, DOCTOR_MAX_PAGE_SIZE)
+    con = get_db()
+    cur = con.cursor()
+    doctors_with_status, next_cursor = load_dashboard_doctors(cur, session["user"], request.args.get("cursor", 0, type=int), limit)
+    return jsonify({
+        "doctors": [{
+            **doctor_json(list(item['doctor']) + [item['is_unavailable'], item['unavailable_reason'], item['unavailable_detail']]),
+            "leaves": [{"id": leave[0], "start_date": leave[1], "end_date": leave[2], "session": leave[3]}
+                       for leave in item['leaves']]
+        } for item in doctors_with_status],
+        "next_cursor": next_cursor
+    })
+
+
+ANALYTICS_STATUSES = ("confirmed", "cancelled")
+ANALYTICS_DEFAULT_MONTHS = 12
+ANALYTICS_DEFAULT_DAYS = 30
+# granularity -> (rollup table, period column, period format)
+ANALYTICS_ROLLUPS = {
+    "day": ("appointment_daily", "appointment_date", "%Y-%m-%d"),
+    "month": ("appointment_monthly", "month", "%Y-%m"),
+}
+
+def analytics_period(granularity, day):
+    # isoformat() zero-pads the year like the stored dates; glibc's strftime("%Y") writes year 1 as "1"
+    return day.isoformat()[:7] if granularity == "month" else day.isoformat()
+
+def analytics_periods(granularity, start, end):
+    # Every day or month from start to end inclusive, so periods without bookings show as zero
+    fmt = ANALYTICS_ROLLUPS[granularity][2]
+    day = datetime.strptime(start, fmt).date()
+    last = datetime.strptime(end, fmt).date()
+    periods = [analytics_period(granularity, day)]
+    # Stops on the last period before stepping, so a range ending in 9999-12 never steps past date.max
+    while day < last:
+        day = day + timedelta(days=1) if granularity == "day" else (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+        periods.append(analytics_period(granularity, day))
+    return periods
+
+def analytics_range(args, granularity):
+    """(start, end) periods from ?from=&to= with a recent window as the default, or an error message."""
+    fmt = ANALYTICS_ROLLUPS[granularity][2]
+    today = datetime.now().date()
+    if granularity == "day":
+        default_start = today - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+    else:
+        default_start = today.replace(day=1)
+        for _ in range(ANALYTICS_DEFAULT_MONTHS - 1):
+            default_start = (default_start - timedelta(days=1)).replace(day=1)
+    bounds = []
+    for name, default in (("from", default_start), ("to", today)):
+        value = args.get(name) or analytics_period(granularity, default)
+        try:
+            # strptime also accepts "2024-1-5"; only the zero-padded form compares correctly as text
+            canonical = analytics_period(granularity, datetime.strptime(value, fmt).date()) == value
+        except ValueError:
+            canonical = False
+        if not canonical:
+            return None, f"{name} must look like {analytics_period(granularity, today)}"
+        bounds.append(value)
+    if bounds[0] > bounds[1]:
+        return None, "from must not be after to"
+    return tuple(bounds), None
+
+ANALYTICS_DOCTOR_FILTER = " AND d.id = :doctor_id"
+# Granularity -> (counts per period, counts per doctor); {doctor_filter} is "" or ANALYTICS_DOCTOR_FILTER
+ANALYTICS_SQL = {
+    granularity: tuple(f"""
+        SELECT {select}, r.status, SUM(r.appointments)
+        FROM doctor d JOIN {table} r ON r.doctor_id = d.id
+        WHERE d.username = :username{{doctor_filter}} AND r.{column} BETWEEN :start AND :end
+        GROUP BY {group}, r.status
+    """ for select, group in ((f"r.{column}", f"r.{column}"), ("d.id, d.name", "d.id")))
+    for granularity, (table, column, _) in ANALYTICS_ROLLUPS.items()
+}
+
+def hospital_analytics(cur, username, granularity, start, end, doctor_id=None):
+    """Appointment counts per period and per doctor for one hospital, read only from the rollups."""
+    doctor_filter = ANALYTICS_DOCTOR_FILTER if doctor_id is not None else ""
+    params = {"username": username, "start": start, "end": end, "doctor_id": doctor_id}
+    by_period_sql, by_doctor_sql = ANALYTICS_SQL[granularity]
+    cur.execute(by_period_sql.format(doctor_filter=doctor_filter), params)
+    by_period = cur.fetchall()
+    cur.execute(by_doctor_sql.format(doctor_filter=doctor_filter), params)
+    by_doctor = cur.fetchall()
+
+    def counts():
+        return {**{status: 0 for status in ANALYTICS_STATUSES}, "total": 0}
+
+    def add(bucket, status, appointments):
+        bucket[status] = bucket.get(status, 0) + appointments
+        bucket["total"] += appointments
 
+    # Zero-filled between the first and last period with bookings (and the current one),
+    # so an open-ended range such as from=0001-01 stays as long as the hospital's history
+    current = min(max(analytics_period(granularity, datetime.now().date()), start), end)
+    periods = [row[0] for row in by_period] + [current]
+    series = {period: {"period": period, **counts()}
+              for period in analytics_periods(granularity, min(periods), max(periods))}
+    totals = counts()
+    for period, status, appointments in by_period:
+        add(series[period], status, appointments)
+        add(totals, status, appointments)
+    doctors = {}
+    for doctor, name, status, appointments in by_doctor:
+        add(doctors.setdefault(doctor, {"id": doctor, "name": name, **counts()}), status, appointments)
+
+    return {
+        "granularity": granularity,
+        "from": start,
+        "to": end,
+        "series": list(series.values()),
+        "doctors": sorted(doctors.values(), key=lambda doctor: (-doctor["total"], doctor["id"])),
+        "totals": totals,
+    }
+
+@app.route("/dashboard/analytics", methods=["GET"])
+def dashboard_analytics():
+    """Booking volume for the logged-in hospital: ?granularity=day|month&from=&to=&doctor_id="""
+    if "user" not in session:
+        return jsonify({"status": "error", "message": "Login required"}), 401
+
+    granularity = request.args.get("granularity", "month")
+    if granularity not in ANALYTICS_ROLLUPS:
+        return jsonify({"status": "error", "message": "granularity must be day or month"}), 400
+    bounds, error = analytics_range(request.args, granularity)
+    if error:
+        return jsonify({"status": "error", "message": error}), 400
+
+    con = get_db()
+    cur = con.cursor()
+    analytics = hospital_analytics(cur, session["user"], granularity, *bounds,
+                                   doctor_id=request.args.get("doctor_id", type=int))
+    return jsonify({"status": "success", **analytics})
 
 @app.route("/delete_doctor/<int:doctor_id>", methods=["POST"])
 def delete_doctor_profile(doctor_id):
@@ -581,18 +3058,17 @@ def delete_doctor_profile(doctor_id):
     cur = con.cursor()
 
     # Verify this doctor belongs to the logged-in hospital
-    cur.execute("SELECT id FROM doctor WHERE id=? AND username=?", (doctor_id, username))
+    cur.execute("SELECT id, image FROM doctor WHERE id=? AND username=?", (doctor_id, username))
     doctor = cur.fetchone()
     if not doctor:
-        con.close()
         return "Doctor not found or unauthorized", 404
 
     # Delete all appointments for this doctor first
-    cur.execute("DELETE FROM appointment WHERE doctor_id=?", (doctor_id,))
+    delete_doctor_rows(cur, doctor_id)
     # Then delete the doctor record
     cur.execute("DELETE FROM doctor WHERE id=?", (doctor_id,))
     con.commit()
-    con.close()
+    release_image(doctor[1])
 
     return redirect("/dashboard")
 
@@ -608,15 +3084,22 @@ def manage_doctors():
     if request.method == "POST":
         # **PAST DATE VALIDATION**
         emergency_date = request.form.get("emergency_date")
+        emergency_end_date = request.form.get("emergency_end_date") or emergency_date
         if emergency_date:
             today = datetime.now().date()
             try:
                 input_date = datetime.strptime(emergency_date, '%Y-%m-%d').date()
+                end_date = datetime.strptime(emergency_end_date, '%Y-%m-%d').date()
                 if input_date < today:
                     return render_template("doctor.html", 
                                           doctor=None, 
                                           today_date=today_date,
                                           error="past_date")
+                if end_date < input_date:
+                    return render_template("doctor.html", 
+                                          doctor=None, 
+                                          today_date=today_date,
+                                          error="invalid_range")
             except ValueError:
                 return render_template("doctor.html", 
                                       doctor=None, 
@@ -627,37 +3110,40 @@ def manage_doctors():
         if "photo" in request.files:
             file = request.files["photo"]
             if file and file.filename:
-                filename = secure_filename(file.filename)
-                image_filename = f"{username}_doctor_{filename}"
-                file.save(os.path.join(app.config["UPLOAD_FOLDER"], image_filename))
+                image_filename = save_upload(file)
         
-        emergency_leave = ""
-        if request.form.get("emergency_date") and request.form.get("emergency_session"):
-            emergency_leave = request.form["emergency_date"] + " " + request.form["emergency_session"]
+        # New leave range for the doctor's leave calendar (existing leaves are kept)
+        new_leave = None
+        if emergency_date and request.form.get("emergency_session"):
+            new_leave = (emergency_date, emergency_end_date, request.form["emergency_session"])
         
         if doctor_id:
             con = get_db()
             cur = con.cursor()
             
+            cur.execute("SELECT image FROM doctor WHERE id=? AND username=?", (doctor_id, username))
+            current = cur.fetchone()
+            previous_image = current[0] if current else None
             if not image_filename:
-                cur.execute("SELECT image FROM doctor WHERE id=? AND username=?", (doctor_id, username))
-                current = cur.fetchone()
-                if current and current[0]:
-                    image_filename = current[0]
+                image_filename = previous_image
             
             cur.execute("""
                 UPDATE doctor SET 
                 name=?, specialization=?, education=?, timings=?, weekly_holiday=?, 
-                emergency_leave=?, image=?, max_appointments=?
+                image=?, max_appointments=?
                 WHERE id=? AND username=?
             """, (
                 request.form["name"], request.form["specialization"], request.form["education"],
                 request.form["timings"], request.form["weekly_holiday"], 
-                emergency_leave, image_filename, request.form.get("max_appointments", 3),
+                image_filename, request.form.get("max_appointments", 3),
                 doctor_id, username
             ))
+            if new_leave and cur.rowcount:
+                cur.execute("INSERT INTO doctor_leave (doctor_id, start_date, end_date, session) VALUES (?, ?, ?, ?)",
+                            (doctor_id, *new_leave))
             con.commit()
-            con.close()
+            if previous_image != image_filename:
+                release_image(previous_image)
         else:
             con = get_db()
             cur = con.cursor()
@@ -667,20 +3153,24 @@ def manage_doctors():
             """, (
                 username, request.form["name"], request.form["specialization"], 
                 request.form["education"], request.form["timings"], request.form["weekly_holiday"],
-                emergency_leave, image_filename, request.form.get("max_appointments", 3)
+                "", image_filename, request.form.get("max_appointments", 3)
             ))
+            if new_leave:
+                cur.execute("INSERT INTO doctor_leave (doctor_id, start_date, end_date, session) VALUES (?, ?, ?, ?)",
+                            (cur.lastrowid, *new_leave))
             con.commit()
-            con.close()
         
         return redirect("/dashboard")
     
     doctor = None
+    leaves = []
     if doctor_id:
         con = get_db()
         cur = con.cursor()
-        cur.execute("SELECT * FROM doctor WHERE id=? AND username=?", (doctor_id, username))
+        cur.execute(HOSPITAL_DOCTOR_SQL, (doctor_id, username))
         doctor = cur.fetchone()
-        con.close()
+        if doctor:
+            leaves = upcoming_leaves(cur, [doctor[0]]).get(doctor[0], [])
     
     # **CHECK DOCTOR STATUS FOR TODAY**
     is_unavailable, reason, detail = is_doctor_unavailable_today(doctor)
@@ -688,65 +3178,818 @@ def manage_doctors():
     error = request.args.get("error")
     return render_template("doctor.html", 
                            doctor=doctor, 
+                           leaves=leaves,
                            today_date=today_date, 
                            error=error,
                            is_unavailable=is_unavailable,
                            unavailable_reason=reason,
                            unavailable_detail=detail)
 
+@app.route("/delete_leave/<int:leave_id>", methods=["POST"])
+def delete_leave(leave_id):
+    """Remove one leave range from a doctor of the logged-in hospital."""
+    if "user" not in session:
+        return redirect("/login")
+
+    con = get_db()
+    cur = con.cursor()
+    cur.execute("""
+        SELECT l.doctor_id FROM doctor_leave l JOIN doctor d ON d.id = l.doctor_id
+        WHERE l.id=? AND d.username=?
+    """, (leave_id, session["user"]))
+    leave = cur.fetchone()
+    if not leave:
+        return "Leave not found or unauthorized", 404
+
+    cur.execute("DELETE FROM doctor_leave WHERE id=?", (leave_id,))
+    con.commit()
+    return redirect(f"/doctors?id={leave[0]}")
+
+DOCTOR_IMPORT_CHUNK_SIZE = 500
+DOCTOR_IMPORT_MAX_ERRORS = 200
+DOCTOR_IMPORT_FIELDS = ("name", "specialization", "education", "timings", "weekly_holiday", "max_appointments")
+
+class DoctorImportBusy(Exception):
+    pass
+
+JSON_WHITESPACE = " \t\r\n"
+
+def json_array_items(text, chunk_size=64 * 1024):
+    """Items of the JSON array read from text, decoded one at a time as the text arrives."""
+    decoder = json.JSONDecoder()
+    buffer, position, eof = "", 0, False
+    # Characters dropped from the front of buffer, so errors point into the whole text
+    consumed = 0
+
+    def read_more():
+        nonlocal buffer, position, eof, consumed
+        chunk = text.read(chunk_size)
+        consumed += position
+        buffer, position, eof = buffer[position:] + chunk, 0, not chunk
+
+    def next_char():
+        # Skips whitespace; "" at the end of the text
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in JSON_WHITESPACE:
+                position += 1
+            if position < len(buffer) or eof:
+                return buffer[position:position + 1]
+            read_more()
+
+    if next_char() != "[":
+        raise ValueError("Expected a JSON array of doctors")
+    position += 1
+    if next_char() == "]":
+        position += 1
+    else:
+        while True:
+            next_char()
+            while True:
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError as exc:
+                    if eof:
+                        raise ValueError(f"{exc.msg} at character {consumed + exc.pos}") from None
+                    read_more()
+                    continue
+                # A number cut off at the end of the buffer would decode as a shorter one
+                if end == len(buffer) and not eof:
+                    read_more()
+                    continue
+                break
+            position = end
+            yield item
+            separator = next_char()
+            position += 1
+            if separator == "]":
+                break
+            if separator != ",":
+                raise ValueError("Expected ',' or ']' after an item of the JSON array")
+    if next_char():
+        raise ValueError("Unexpected data after the JSON array")
+
+def doctor_import_records(stream, kind):
+    """(row number, record) pairs from a CSV or JSON upload, read as the upload arrives."""
+    text = TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if kind == "json":
+        yield from enumerate(json_array_items(text), 1)
+        return
+    reader = csv.DictReader(text)
+    for record in reader:
+        # Row numbers as a spreadsheet shows them, header included
+        yield reader.line_num, record
+
+def doctor_import_row(record):
+    """(id, name, specialization, education, timings, weekly_holiday, max_appointments) or an error message.
+
+    Blank fields are None: an update keeps the doctor's current value for them.
+    """
+    if not isinstance(record, dict):
+        return None, "Expected an object with doctor fields"
+    row = {str(key).strip().lower(): str(value).strip() for key, value in record.items()
+           if key is not None and value is not None}
+    doctor_id = None
+    if row.get("id"):
+        doctor_id = parse_id(row["id"])
+        if doctor_id is None:
+            return None, "id must be a doctor id"
+    values = {field: row.get(field) or None for field in DOCTOR_IMPORT_FIELDS}
+
+    if values["name"] is not None and len(values["name"]) < 2:
+        return None, "name must be at least 2 characters"
+    if values["weekly_holiday"] is not None:
+        days = [day.strip().capitalize() for day in values["weekly_holiday"].split(",") if day.strip()]
+        unknown = [day for day in days if day not in WEEKDAYS]
+        if unknown:
+            return None, f"weekly_holiday has unknown day {unknown[0]!r}"
+        values["weekly_holiday"] = ", ".join(days)
+    if values["max_appointments"] is not None:
+        max_appointments = parse_id(values["max_appointments"])
+        if max_appointments is None or not 1 <= max_appointments <= 20:
+            return None, "max_appointments must be a number from 1 to 20"
+        values["max_appointments"] = max_appointments
+    return (doctor_id, *values.values()), None
+
+def start_doctor_import(con, username):
+    cur = con.cursor()
+    if con.in_transaction:
+        con.commit()
+    cur.execute("BEGIN IMMEDIATE")
+    cur.execute("SELECT 1 FROM doctor_import WHERE username=? AND started_at > ?",
+                (username, time.time() - DOCTOR_IMPORT_STALE_SECONDS))
+    if cur.fetchone():
+        con.rollback()
+        raise DoctorImportBusy(username)
+    cur.execute("INSERT OR REPLACE INTO doctor_import (username, started_at) VALUES (?, ?)", (username, time.time()))
+    con.commit()
+
+DOCTOR_IMPORT_NAMES_SQL = "SELECT id, name FROM doctor WHERE username=?"
+
+def import_doctors(con, username, records, dry_run=False, chunk_size=DOCTOR_IMPORT_CHUNK_SIZE):
+    """Create or update username's doctors from (row number, record) pairs; returns a summary.
+
+    A row with an id updates that doctor; without one it updates the hospital's only doctor
+    of that name, or adds a new doctor. Rows are validated as they stream in and written
+    chunk_size at a time, one executemany transaction per chunk; rows that fail validation
+    are reported and skipped. A file that stops parsing ends the import with the chunks
+    before it written and summary["error"] set. Raises DoctorImportBusy while another
+    import for username runs.
+    """
+    cur = con.cursor()
+    cur.execute(DOCTOR_IMPORT_NAMES_SQL, (username,))
+    existing = {}
+    by_name = {}
+    for doctor_id, name in cur.fetchall():
+        existing[doctor_id] = name
+        by_name.setdefault((name or "").casefold(), []).append(doctor_id)
+
+    summary = {"inserted": 0, "updated": 0, "failed": 0, "errors": [], "error": None}
+    inserts, updates = [], []
+    seen = set()
+
+    def fail(row_number, message):
+        summary["failed"] += 1
+        if len(summary["errors"]) < DOCTOR_IMPORT_MAX_ERRORS:
+            summary["errors"].append({"row": row_number, "message": message})
+
+    def flush():
+        if not dry_run and (inserts or updates):
+            cur.execute("BEGIN IMMEDIATE")
+            # Renewed with every chunk so a long import never looks stale
+            cur.execute("UPDATE doctor_import SET started_at=? WHERE username=?", (time.time(), username))
+            cur.executemany("""
+                UPDATE doctor SET
+                name=COALESCE(?, name), specialization=COALESCE(?, specialization),
+                education=COALESCE(?, education), timings=COALESCE(?, timings),
+                weekly_holiday=COALESCE(?, weekly_holiday), max_appointments=COALESCE(?, max_appointments)
+                WHERE id=? AND username=?
+            """, updates)
+            cur.executemany("""
+                INSERT INTO doctor (username, name, specialization, education, timings, weekly_holiday, emergency_leave, image, max_appointments)
+                VALUES (?, ?, ?, ?, ?, COALESCE(?, ''), '', NULL, COALESCE(?, 3))
+            """, inserts)
+            con.commit()
+        summary["updated"] += len(updates)
+        summary["inserted"] += len(inserts)
+        updates.clear()
+        inserts.clear()
+
+    if not dry_run:
+        start_doctor_import(con, username)
+    records = iter(records)
+    try:
+        while True:
+            # Only reading the file may fail here; a bad value fails just its own row
+            try:
+                row_number, record = next(records)
+            except StopIteration:
+                break
+            except (ValueError, UnicodeDecodeError, csv.Error) as exc:
+                summary["error"] = f"Could not read the file: {exc}"
+                break
+            doctor, error = doctor_import_row(record)
+            if error:
+                fail(row_number, error)
+                continue
+            doctor_id, name, *fields = doctor
+            if doctor_id is None:
+                if name is None:
+                    fail(row_number, "name or id is required")
+                    continue
+                matches = by_name.get(name.casefold(), [])
+                if len(matches) > 1:
+                    fail(row_number, f"{len(matches)} doctors are named {name!r}; give the id of the one to update")
+                    continue
+                doctor_id = matches[0] if matches else None
+                if doctor_id is not None:
+                    # Matched by name: keep the stored spelling
+                    name = None
+            elif doctor_id not in existing:
+                fail(row_number, f"No doctor {doctor_id} in this hospital")
+                continue
+
+            key = doctor_id if doctor_id is not None else name.casefold()
+            if key in seen:
+                fail(row_number, "The same doctor appears earlier in this import")
+                continue
+            seen.add(key)
+            if doctor_id is None:
+                if not all(fields[:3]):
+                    fail(row_number, "specialization, education and timings are required for a new doctor")
+                    continue
+                inserts.append((username, name, *fields))
+            else:
+                updates.append((name, *fields, doctor_id, username))
+            if len(inserts) + len(updates) >= chunk_size:
+                flush()
+        # Rows read before a broken part of the file are kept
+        flush()
+    finally:
+        if not dry_run:
+            refresh_doctor_import(con, username)
+    return summary
+
+@app.route("/doctors/import", methods=["POST"])
+def import_doctors_route():
+    """Bulk create/update of the logged-in hospital's doctors from CSV or a JSON array.
+
+    Upload a file field named "file" (.csv or .json) or post the body as text/csv or
+    application/json; ?dry_run=1 validates without writing.
+    """
+    if "user" not in session:
+        return jsonify({"status": "error", "message": "Login required"}), 401
+
+    upload = request.files.get("file")
+    if upload and upload.filename:
+        stream = upload.stream
+        kind = "json" if upload.filename.lower().endswith(".json") else "csv"
+    elif request.mimetype in ("text/csv", "application/json"):
+        stream = request.stream
+        kind = "json" if request.mimetype == "application/json" else "csv"
+    else:
+        return jsonify({"status": "error", "message": "Upload a CSV or JSON file"}), 400
+
+    con = get_db()
+    try:
+        summary = import_doctors(con, session["user"], doctor_import_records(stream, kind),
+                                 dry_run=request.args.get("dry_run") == "1")
+    except DoctorImportBusy:
+        return jsonify({"status": "error", "message": "Another import for this hospital is still running"}), 409
+    error = summary.pop("error")
+    if error:
+        return jsonify({"status": "error", "message": error, "dry_run": request.args.get("dry_run") == "1", **summary}), 400
+    return jsonify({"status": "success", "dry_run": request.args.get("dry_run") == "1", **summary})
+
+@app.cli.command("import-doctors")
+@click.argument("username")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--dry-run", is_flag=True, help="Validate every row without writing.")
+@click.option("--chunk-size", default=DOCTOR_IMPORT_CHUNK_SIZE, help="Doctors written per transaction.")
+def import_doctors_command(username, path, dry_run, chunk_size):
+    """Create or update USERNAME's doctors from a CSV or JSON file at PATH."""
+    con = connect_db()
+    try:
+        cur = con.cursor()
+        cur.execute("SELECT 1 FROM hospital WHERE username=?", (username,))
+        if username not in users and not cur.fetchone():
+            raise click.ClickException(f"unknown hospital {username!r}")
+        kind = "json" if path.lower().endswith(".json") else "csv"
+        started = time.perf_counter()
+        with open(path, "rb") as stream:
+            try:
+                summary = import_doctors(con, username, doctor_import_records(stream, kind), dry_run, chunk_size)
+            except DoctorImportBusy:
+                raise click.ClickException(f"another import for {username} is still running")
+    finally:
+        con.close()
+
+    for error in summary["errors"]:
+        click.echo(f"row {error['row']}: {error['message']}", err=True)
+    click.echo(f"{'checked' if dry_run else 'imported'} {path} for {username} in {time.perf_counter() - started:.2f}s: "
+               f"{summary['inserted']} new, {summary['updated']} updated, {summary['failed']} failed")
+    if summary["error"]:
+        raise click.ClickException(f"{summary['error']}; rows before it were imported")
+
+EXPORT_BATCH_SIZE = 500
+EXPORT_STATUSES = ("confirmed", "cancelled", "all")
+EXPORT_HEADER = [
+    'Appointment ID', 'Doctor Name', 'Hospital Name', 'Appointment Date',
+    'Patient Name', 'Patient Phone', 'Status'
+]
+
+def export_filters(args):
+    """SQL conditions and params for the ?status=&from=&to= export filters, or an error message."""
+    status = args.get("status", "confirmed")
+    if status not in EXPORT_STATUSES:
+        return None, None, f"status must be one of {', '.join(EXPORT_STATUSES)}"
+
+    conditions, params = [], []
+    if status != "all":
+        conditions.append("a.status = ?")
+        params.append(status)
+    for arg, operator in (("from", ">="), ("to", "<=")):
+        value = args.get(arg)
+        if value:
+            if not valid_appointment_date(value):
+                return None, None, f"{arg} must be a YYYY-MM-DD date"
+            conditions.append(f"a.appointment_date {operator} ?")
+            params.append(value)
+    return "".join(f" AND {condition}" for condition in conditions), params, None
+
+def fetch_batches(cur):
+    while True:
+        rows = cur.fetchmany(EXPORT_BATCH_SIZE)
+        if not rows:
+            return
+        yield rows
+
+def csv_chunks(batches):
+    # Hand each fetchmany batch out as soon as it is encoded, so only one batch
+    # is ever held in memory
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_HEADER)
+    yield buffer.getvalue()
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate(0)
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def csv_download(batches, name):
+    filename = f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    if request.args.get("gzip") == "1":
+        return Response(
+            stream_with_context(gzip_chunks(csv_chunks(batches))),
+            mimetype="application/gzip",
+            headers={"Content-disposition": f"attachment; filename={filename}.gz"}
+        )
+    return Response(
+        stream_with_context(csv_chunks(batches)),
+        mimetype="text/csv",
+        headers={"Content-disposition": f"attachment; filename={filename}"}
+    )
+
+# {filters} comes from export_filters
+EXPORT_ROWS_SQL = APPOINTMENT_ROWS + """
+    WHERE a.doctor_id=?{filters}
+    ORDER BY a.appointment_date DESC, a.id DESC
+"""
+HOSPITAL_EXPORT_DOCTORS_SQL = "SELECT id FROM doctor WHERE username=? ORDER BY id"
+
 @app.route("/view_appointments/<int:doctor_id>")
 def view_appointments(doctor_id):
     if "user" not in session:
         return redirect("/login")
     
     username = session["user"]
+    filters, params, error = export_filters(request.args)
+    if error:
+        return error, 400
     
     con = get_db()
     cur = con.cursor()
     
-    cur.execute("SELECT * FROM doctor WHERE id=? AND username=?", (doctor_id, username))
+    cur.execute(HOSPITAL_DOCTOR_SQL, (doctor_id, username))
     doctor = cur.fetchone()
     if not doctor:
-        con.close()
         return "Doctor not found", 404
     
-    cur.execute("SELECT * FROM hospital WHERE username=?", (username,))
-    hospital = cur.fetchone()
-    
-    cur.execute("""
-        SELECT id, doctor_name, hospital_name, appointment_date, patient_name, patient_phone, status 
-        FROM appointment 
-        WHERE doctor_id=? AND status='confirmed'
-        ORDER BY appointment_date DESC, id DESC
-    """, (doctor_id,))
-    appointments = cur.fetchall()
-    
-    con.close()
-    
-    output = StringIO()
-    writer = csv.writer(output)
-    
-    writer.writerow([
-        'Appointment ID', 'Doctor Name', 'Hospital Name', 'Appointment Date', 
-        'Patient Name', 'Patient Phone', 'Status'
-    ])
-    
-    for apt in appointments:
-        writer.writerow(apt)
-    
-    csv_data = output.getvalue()
-    filename = f"appointments_{doctor[2].replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    # Rows are read lazily by the response generator while the export streams
+    cur.execute(EXPORT_ROWS_SQL.format(filters=filters), (doctor_id, *params))
     
-    return Response(
-        csv_data,
-        mimetype="text/csv",
-        headers={"Content-disposition": f"attachment; filename={filename}"}
-    )
+    return csv_download(fetch_batches(cur), f"appointments_{doctor[2].replace(' ', '_')}")
+
+@app.route("/export_appointments")
+def export_appointments():
+    """Every doctor's appointments for the logged-in hospital as one streamed CSV."""
+    if "user" not in session:
+        return redirect("/login")
+
+    username = session["user"]
+    filters, params, error = export_filters(request.args)
+    if error:
+        return error, 400
+
+    con = get_db()
+    cur = con.cursor()
+    cur.execute(HOSPITAL_EXPORT_DOCTORS_SQL, (username,))
+    doctor_ids = [row[0] for row in cur.fetchall()]
+
+    def batches():
+        # Doctor by doctor, newest first. One query per doctor lets SQLite merge the live
+        # and archived index walks; a join over appointment_all would sort everything.
+        for doctor_id in doctor_ids:
+            cur.execute(EXPORT_ROWS_SQL.format(filters=filters), (doctor_id, *params))
+            yield from fetch_batches(cur)
+
+    return csv_download(batches(), f"appointments_{username}")
+
+UPLOAD_MAX_AGE = 365 * 24 * 3600
+# Names derived from the upload's content hash: the bytes behind them never change
+HASHED_UPLOAD_RE = re.compile(r"[0-9a-f]{20}(-[a-z]+)?\.[a-z0-9]+")
+
+@lru_cache(maxsize=4096)
+def content_etag(path, mtime_ns, size):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:32]
+
+@app.route("/uploads/<path:filename>")
+def serve_upload(filename):
+    """Uploaded photos with strong ETags, Range support and far-future caching for hashed names."""
+    path = safe_join(app.config["UPLOAD_FOLDER"], filename)
+    if path is None or filename.endswith(".gz"):
+        return "Not found", 404
+    if not os.path.isfile(path):
+        return serve_pending_upload(filename)
+
+    gzipped = path + ".gz"
+    use_gzip = request.accept_encodings["gzip"] > 0 and os.path.isfile(gzipped)
+    # Uploads are written relative to the working directory; send_file would resolve against the app root
+    send_path = os.path.abspath(gzipped if use_gzip else path)
+    stat = os.stat(send_path)
+
+    immutable = HASHED_UPLOAD_RE.fullmatch(filename) is not None
+    # send_file answers If-None-Match with 304 and Range/If-Range with 206
+    response = send_file(send_path, mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+                         conditional=True, etag=content_etag(send_path, stat.st_mtime_ns, stat.st_size),
+                         max_age=UPLOAD_MAX_AGE if immutable else 0)
+    if immutable:
+        response.cache_control.immutable = True
+    response.accept_ranges = "bytes"
+    response.vary.add("Accept-Encoding")
+    if use_gzip:
+        response.content_encoding = "gzip"
+    return response
+
+def serve_pending_upload(filename):
+    # Pages link a variant as soon as the upload is accepted; until the worker has written it,
+    # answer with the original from the pending folder and let nothing cache that stand-in
+    match = IMAGE_VARIANT_RE.fullmatch(filename)
+    source = match and os.path.join(app.config["IMAGE_PENDING_FOLDER"], match[1])
+    if Image is None or not source:
+        return "Not found", 404
+    try:
+        # Read it whole: the worker removes the file as soon as the variants are in place
+        with open(source, "rb") as f:
+            data = f.read()
+        with Image.open(BytesIO(data)) as img:
+            mimetype = Image.MIME.get(img.format, "application/octet-stream")
+    except OSError:
+        return "Not found", 404
+    response = send_file(BytesIO(data), mimetype=mimetype, conditional=False, etag=False, max_age=0)
+    response.cache_control.no_store = True
+    return response
+
+def diagnostic_samples():
+    """Connection pool and page cache state of this worker, for /metrics."""
+    with db_pools_lock:
+        pools = list(db_pools.values())
+    samples = []
+    for pool in pools:
+        stats = pool.stats()
+        database = {"database": stats["database"]}
+        samples += [
+            ("drinfo_db_pool_connections", {**database, "state": "idle"}, stats["idle"]),
+            ("drinfo_db_pool_connections", {**database, "state": "in_use"}, stats["in_use"]),
+            ("drinfo_db_pool_checkouts_total", database, stats["checkouts"]),
+            ("drinfo_db_pool_waits_total", database, stats["waits"]),
+        ]
+
+    cache = get_page_cache()
+    if cache is not None:
+        backend = {"backend": app.config["PAGE_CACHE"]}
+        with page_caches_lock:
+            counts = dict(page_cache_counts)
+        samples += [
+            ("drinfo_page_cache_lookups_total", {**backend, "outcome": "hit"}, counts["hits"]),
+            ("drinfo_page_cache_lookups_total", {**backend, "outcome": "miss"}, counts["misses"]),
+            ("drinfo_page_cache_entries", backend, cache.size()),
+            ("drinfo_page_cache_evictions_total", backend, cache.evictions),
+        ]
+    return samples
 
 @app.route("/logout")
 def logout():
     session.pop("user", None)
     return redirect("/")
 
-if __name__ == "__main__":
-    app.run(debug=True, host="127.0.0.1", port=5000)
+# ---------------------------------------------------------------------------
+# ASGI serving mode
+#
+# Sync workers (today's setup):  gunicorn -w 5 app:app
+#   One request per process at a time. A slow read, render or client occupies the
+#   whole worker, so concurrent connections beyond the worker count queue in the
+#   listen backlog.
+#
+# ASGI:  uvicorn app:asgi_app --workers 2 --limit-concurrency 2000
+#   One process per core. The event loop holds every open connection, feeds request
+#   bodies to the views as they read them and writes responses. Views run on ASGI_THREADS threads per process,
+#   each taking a connection from the pool. SQLite releases the GIL while it works
+#   and WAL lets readers run next to the writer, so home(), doctor_profile(),
+#   get_appointment_stats() and my_appointments() overlap inside one process.
+#   --limit-concurrency answers 503 beyond that many connections instead of
+#   queueing forever.
+#
+# `flask --app cli bench-concurrency` compares the two under rising load.
+# ---------------------------------------------------------------------------
+
+ASGI_BUFFER_SIZE = 64 * 1024
+
+class ASGIRequestBody(RawIOBase):
+    """wsgi.input for a request on a pool thread, pulling http.request messages as the view reads.
+
+    Nothing is held beyond the message being read, so an upload is never in memory whole.
+    """
+
+    def __init__(self, receive, loop):
+        self.receive = receive
+        self.loop = loop
+        self.chunk = b""
+        self.more_body = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.chunk and self.more_body:
+            message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+            if message["type"] == "http.disconnect":
+                self.more_body = False
+                raise ClientDisconnected()
+            self.chunk = message.get("body", b"")
+            self.more_body = message.get("more_body", False)
+        size = min(len(buffer), len(self.chunk))
+        buffer[:size] = self.chunk[:size]
+        self.chunk = self.chunk[size:]
+        return size
+
+class ASGIAdapter:
+    """Serve a WSGI app to an ASGI server, running each request on a bounded thread pool.
+
+    The request body is streamed to the view: each read of wsgi.input waits for the
+    next http.request message. The response is sent back in chunks as the view
+    produces them, so streamed exports keep streaming.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.executor = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+
+        if self.executor is None:
+            # Created on first use, inside the server process (uvicorn spawns its workers)
+            self.executor = ThreadPoolExecutor(max_workers=app.config["ASGI_THREADS"], thread_name_prefix="asgi")
+        loop = asyncio.get_running_loop()
+        # Small responses come back whole and are sent from here; bigger ones were streamed by the thread
+        messages, subscription = await loop.run_in_executor(self.executor, self.run, scope, receive, send, loop)
+        for message in messages:
+            await send(message)
+        if subscription is not None:
+            await self.stream_slot_events(subscription, receive, send)
+
+    async def stream_slot_events(self, subscription, receive, send):
+        """Push a /doctor_events stream from the event loop, so open streams cost no threads."""
+        loop = asyncio.get_running_loop()
+        subscription.attach(loop)
+
+        async def wait_for_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        disconnected = asyncio.ensure_future(wait_for_disconnect())
+        deadline = loop.time() + app.config["SLOT_EVENTS_MAX_SECONDS"]
+        try:
+            while not disconnected.done() and loop.time() < deadline:
+                ready = asyncio.ensure_future(subscription.ready.wait())
+                done, _ = await asyncio.wait({ready, disconnected}, timeout=app.config["SLOT_EVENTS_KEEPALIVE"],
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if disconnected in done:
+                    ready.cancel()
+                    return
+                if ready not in done:
+                    ready.cancel()
+                    await send({"type": "http.response.body", "body": b": keepalive\n\n", "more_body": True})
+                    continue
+                subscription.ready.clear()
+                while not subscription.updates.empty():
+                    payload = subscription.updates.get_nowait()
+                    message = subscription.event(payload)
+                    if message:
+                        await send({"type": "http.response.body", "body": message.encode(), "more_body": True})
+                    if payload is None:
+                        return
+        finally:
+            slot_hub.unsubscribe(subscription)
+            disconnected.cancel()
+            await send({"type": "http.response.body", "body": b""})
+
+    def environ(self, scope, body):
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("", 0)
+        root_path = scope.get("root_path", "")
+        path = scope["path"]
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            # WSGI carries the raw UTF-8 bytes of the path as latin-1 text
+            "SCRIPT_NAME": root_path.encode("utf-8").decode("latin-1"),
+            "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": scope["query_string"].decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+            "REMOTE_ADDR": client[0],
+            "REMOTE_PORT": str(client[1]),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": body,
+            # The body ends with the last http.request message, Content-Length or not (chunked uploads)
+            "wsgi.input_terminated": True,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+            # Replaced by the view of a /doctor_events stream for __call__ to take over
+            SLOT_SUBSCRIPTION_KEY: None,
+        }
+        for name, value in scope["headers"]:
+            name = name.decode("latin-1")
+            value = value.decode("latin-1")
+            if name == "content-length":
+                environ["CONTENT_LENGTH"] = value
+                continue
+            if name == "content-type":
+                environ["CONTENT_TYPE"] = value
+                continue
+            key = "HTTP_" + name.upper().replace("-", "_")
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    def run(self, scope, receive, send, loop):
+        # Runs on a pool thread; streamed messages are handed to the event loop to be sent
+        def emit(*messages):
+            async def send_all():
+                for message in messages:
+                    await send(message)
+            asyncio.run_coroutine_threadsafe(send_all(), loop).result()
+
+        status_headers = []
+        # Up to ASGI_BUFFER_SIZE bytes are buffered; a response that fits is returned to the event
+        # loop whole, anything longer is sent chunk by chunk from this thread as it is produced
+        buffered = []
+        size = 0
+        streaming = False
+
+        def push(chunk):
+            nonlocal size, streaming
+            if not chunk:
+                return
+            if not streaming and size + len(chunk) <= ASGI_BUFFER_SIZE:
+                buffered.append(chunk)
+                size += len(chunk)
+                return
+            if not streaming:
+                streaming = True
+                emit(start_message(), {"type": "http.response.body", "body": b"".join(buffered), "more_body": True})
+            emit({"type": "http.response.body", "body": chunk, "more_body": True})
+
+        def start_response(status, headers, exc_info=None):
+            status_headers[:] = [int(status.split(" ", 1)[0]),
+                                 [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]]
+            # Legacy write() output goes out ahead of the returned iterable, through the same buffer
+            return push
+
+        def start_message():
+            return {"type": "http.response.start", "status": status_headers[0], "headers": status_headers[1]}
+
+        environ = self.environ(scope, BufferedReader(ASGIRequestBody(receive, loop), ASGI_BUFFER_SIZE))
+        response = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in response:
+                push(chunk)
+            subscription = environ[SLOT_SUBSCRIPTION_KEY]
+            if streaming:
+                if subscription is None:
+                    emit({"type": "http.response.body", "body": b""})
+                return [], subscription
+            return [start_message(), {"type": "http.response.body", "body": b"".join(buffered),
+                                      "more_body": subscription is not None}], subscription
+        finally:
+            if hasattr(response, "close"):
+                response.close()
+
+asgi_app = ASGIAdapter(app)
+
+# ---------------------------------------------------------------------------
+# Appointment archive (run daily: `flask --app app archive-appointments`)
+# ---------------------------------------------------------------------------
+
+ARCHIVE_COLUMNS = "id, doctor_id, appointment_date, patient_name, patient_phone, status, phone_digits"
+
+# Last id and size of the next batch of rows to archive, walking the primary key
+ARCHIVE_BATCH_END_SQL = """
+    SELECT MAX(id), COUNT(*) FROM (
+        SELECT id FROM main.appointment WHERE id > ? AND appointment_date < ? ORDER BY id LIMIT ?
+    )
+"""
+
+def archive_appointments(con, cutoff, batch_size):
+    """Move appointments dated before cutoff into the archive database; returns how many moved.
+
+    The live table is walked in id order, batch_size rows per BEGIN IMMEDIATE, so bookings
+    only ever wait for one short batch. Rows are copied before they are deleted and the
+    copy replaces by id: a run cut off between the two files is finished by the next one.
+    """
+    cur = con.cursor()
+    if con.in_transaction:
+        con.commit()
+    moved = 0
+    last_id = 0
+    while True:
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute(ARCHIVE_BATCH_END_SQL, (last_id, cutoff, batch_size))
+        upto, count = cur.fetchone()
+        if not count:
+            con.rollback()
+            return moved
+        batch = (last_id, upto, cutoff)
+        cur.execute(f"""
+            INSERT OR REPLACE INTO archive.appointment ({ARCHIVE_COLUMNS})
+            SELECT {ARCHIVE_COLUMNS} FROM main.appointment WHERE id > ? AND id <= ? AND appointment_date < ?
+        """, batch)
+        cur.execute("DELETE FROM main.appointment WHERE id > ? AND id <= ? AND appointment_date < ?", batch)
+        con.commit()
+        moved += count
+        last_id = upto
+
+@app.cli.command("archive-appointments")
+@click.option("--days", default=None, type=int,
+              help="Archive appointments dated more than this many days ago (default ARCHIVE_AFTER_DAYS).")
+@click.option("--batch-size", default=None, type=int, help="Rows moved per transaction (default ARCHIVE_BATCH_SIZE).")
+@click.option("--vacuum", is_flag=True, help="VACUUM the live database afterwards so its file shrinks.")
+def archive_appointments_command(days, batch_size, vacuum):
+    """Move past appointments out of the live table into the archive database."""
+    days = app.config["ARCHIVE_AFTER_DAYS"] if days is None else days
+    if days < 1:
+        raise click.ClickException("--days must be at least 1, today's appointments stay live")
+    cutoff = (datetime.now().date() - timedelta(days=days)).strftime('%Y-%m-%d')
+    database = app.config["DATABASE"]
+
+    con = connect_db(database)
+    try:
+        started = time.perf_counter()
+        moved = archive_appointments(con, cutoff, batch_size or app.config["ARCHIVE_BATCH_SIZE"])
+        click.echo(f"archived {moved} appointments dated before {cutoff} into {archive_path(database)} "
+                   f"in {time.perf_counter() - started:.1f}s")
+        if vacuum:
+            # Rewrites the live file, holding off writers until it is done
+            size = os.path.getsize(database)
+            started = time.perf_counter()
+            con.execute("VACUUM main")
+            con.execute("PRAGMA main.wal_checkpoint(TRUNCATE)")
+            click.echo(f"vacuumed {database}: {size / 1e6:.1f}MB -> {os.path.getsize(database) / 1e6:.1f}MB "
+                       f"in {time.perf_counter() - started:.1f}s")
+    finally:
+        con.close()
@@ -0,0 +1,7 @@
+"""Developer tooling kept out of the production module: `flask --app cli <command>`.
+
+Importing the package registers the check, benchmark and data commands on the app's CLI;
+gunicorn and uvicorn only ever import app.py.
+"""
+from app import app
+from cli import bench, checks, data
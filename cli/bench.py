@@ -0,0 +1,757 @@
+"""Benchmarks (run with `flask --app cli <command>`)."""
+import contextlib
+import contextvars
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+import click
+
+from app import (app, connect_db, init_db, get_page_cache, page_cache_counts, migrate_doctor_day_capacity,
+                 APPOINTMENT_ROWS)
+
+BENCH_SPECIALIZATIONS = ["Cardiologist", "Dentist", "Pediatrician", "Orthopedic", "Dermatologist", "General Physician"]
+
+def seed_benchmark_data(con, hospitals, doctors_per_hospital=5):
+    cur = con.cursor()
+    cur.executemany("INSERT INTO hospital (username, name, location, image) VALUES (?, ?, ?, ?)", [
+        (f"bench{h}", f"Bench Hospital {h}", f"Town {h % 50}", None)
+        for h in range(hospitals)
+    ])
+    cur.executemany("""
+        INSERT INTO doctor (username, name, specialization, education, timings, weekly_holiday, emergency_leave, image, max_appointments)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (f"bench{h}", f"Dr. Bench {h}-{d}", BENCH_SPECIALIZATIONS[(h + d) % len(BENCH_SPECIALIZATIONS)],
+         "MBBS", "9:00 AM - 5:00 PM", "Sunday", "", None, 3)
+        for h in range(hospitals) for d in range(doctors_per_hospital)
+    ])
+    con.commit()
+
+def isolated(fn, *args, **kwargs):
+    # The flask CLI keeps an app context pushed around every command, which test client
+    # requests would share; run them in an empty context so each request gets its own
+    # app context, pooled connection and teardown, as under a real server.
+    return contextvars.Context().run(fn, *args, **kwargs)
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+@app.cli.command("bench-home")
+@click.option("--sizes", default="10,100,1000", help="Comma-separated hospital counts.")
+@click.option("--doctors", default=5, help="Doctors per hospital.")
+@click.option("--requests", "n_requests", default=50, help="Requests per size and URL.")
+def bench_home(sizes, doctors, n_requests):
+    """Report query count and latency of the public listing at several catalogue sizes."""
+    statements = []
+    original_db = app.config["DATABASE"]
+    original_page_cache = app.config["PAGE_CACHE"]
+    client = app.test_client()
+
+    try:
+        # Measure rendering, not the page cache (see bench-page-cache)
+        app.config["PAGE_CACHE"] = None
+        for size in [int(s) for s in sizes.split(",")]:
+            with tempfile.TemporaryDirectory() as tmp:
+                app.config["DATABASE"] = os.path.join(tmp, "bench.db")
+                init_db()
+                con = connect_db()
+                seed_benchmark_data(con, size, doctors)
+                con.close()
+
+                app.config["SQL_TRACE"] = statements.append
+                for url in ["/", "/?search=cardio"]:
+                    timings = []
+                    statements.clear()
+                    for _ in range(n_requests):
+                        start = time.perf_counter()
+                        isolated(client.get, url)
+                        timings.append((time.perf_counter() - start) * 1000)
+                    # Statements run inside triggers or virtual tables are traced with a "--" prefix
+                    queries = sum(1 for sql in statements if not sql.startswith("--"))
+                    click.echo(f"hospitals={size:<5} url={url:<16} queries/request={queries / n_requests:<5g} "
+                               f"p50={percentile(timings, 50):.2f}ms p95={percentile(timings, 95):.2f}ms")
+                app.config["SQL_TRACE"] = None
+    finally:
+        app.config["DATABASE"] = original_db
+        app.config["PAGE_CACHE"] = original_page_cache
+        app.config["SQL_TRACE"] = None
+
+@app.cli.command("bench-page-cache")
+@click.option("--hospitals", default=500, help="Hospitals to seed.")
+@click.option("--doctors", default=5, help="Doctors per hospital.")
+@click.option("--requests", "n_requests", default=200, help="Requests per backend and URL.")
+@click.option("--backends", default="memory,sqlite", help="Comma-separated page cache backends to compare against no cache.")
+def bench_page_cache(hospitals, doctors, n_requests, backends):
+    """Compare requests/second of the public listing with and without the page cache."""
+    original = {name: app.config[name] for name in ("DATABASE", "PAGE_CACHE", "PAGE_CACHE_PATH")}
+    client = app.test_client()
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            app.config["DATABASE"] = os.path.join(tmp, "bench.db")
+            app.config["PAGE_CACHE_PATH"] = os.path.join(tmp, "bench_pages.db")
+            init_db()
+            con = connect_db()
+            seed_benchmark_data(con, hospitals, doctors)
+            con.close()
+
+            for backend in [None] + [b for b in backends.split(",") if b]:
+                app.config["PAGE_CACHE"] = backend
+                for url in ["/", "/?search=cardio"]:
+                    cache = get_page_cache()
+                    if cache is not None:
+                        cache.clear()
+                    page_cache_counts.update(hits=0, misses=0)
+                    timings = []
+                    started = time.perf_counter()
+                    for _ in range(n_requests):
+                        start = time.perf_counter()
+                        isolated(client.get, url)
+                        timings.append((time.perf_counter() - start) * 1000)
+                    elapsed = time.perf_counter() - started
+                    click.echo(f"cache={backend or 'off':<7} url={url:<16} req/s={n_requests / elapsed:<8.1f} "
+                               f"p50={percentile(timings, 50):.2f}ms p95={percentile(timings, 95):.2f}ms "
+                               f"hits={page_cache_counts['hits']} misses={page_cache_counts['misses']}")
+    finally:
+        app.config.update(original)
+
+def stress_booking_worker(worker, bookings, dates, start_barrier, results):
+    client = app.test_client()
+    outcome = {"booked": 0, "full": 0, "errors": 0}
+    start_barrier.wait()
+    for i in range(bookings):
+        response = isolated(client.post, "/appointment", data={
+            "doctor_id": "1",
+            "appointment_date": dates[(worker + i) % len(dates)],
+            "patient_name": f"Stress Patient {worker}-{i}",
+            "patient_phone": f"9{worker:03d}{i:06d}"
+        })
+        if response.status_code == 200:
+            outcome["booked"] += 1
+        elif response.status_code == 400:
+            outcome["full"] += 1
+        else:
+            outcome["errors"] += 1
+    results.put(outcome)
+
+@app.cli.command("stress-booking")
+@click.option("--processes", default=8, help="Concurrent booking processes.")
+@click.option("--bookings", default=2000, help="Total booking attempts across all processes.")
+@click.option("--days", default=5, help="Distinct appointment dates the attempts are spread over.")
+@click.option("--limit", default=20, help="The doctor's max_appointments per day.")
+def stress_booking(processes, bookings, days, limit):
+    """Fire simultaneous bookings from several processes and check nobody overbooks."""
+    import multiprocessing
+
+    ctx = multiprocessing.get_context("fork")
+    original_db = app.config["DATABASE"]
+    with tempfile.TemporaryDirectory() as tmp:
+        app.config["DATABASE"] = os.path.join(tmp, "stress.db")
+        try:
+            init_db()
+            con = connect_db()
+            con.execute("INSERT INTO hospital (username, name, location) VALUES ('stress', 'Stress Hospital', 'Test')")
+            con.execute("""INSERT INTO doctor (id, username, name, specialization, education, timings, weekly_holiday, emergency_leave, max_appointments)
+                           VALUES (1, 'stress', 'Dr. Stress', 'General Physician', 'MBBS', '9-5', '', '', ?)""", (limit,))
+            con.commit()
+
+            start = datetime.now().date() + timedelta(days=1)
+            dates = [(start + timedelta(days=d)).strftime('%Y-%m-%d') for d in range(days)]
+            start_barrier = ctx.Barrier(processes + 1)
+            results = ctx.Queue()
+            per_process = bookings // processes
+            workers = [ctx.Process(target=stress_booking_worker, args=(w, per_process, dates, start_barrier, results))
+                       for w in range(processes)]
+            for worker in workers:
+                worker.start()
+
+            start_barrier.wait()
+            started = time.perf_counter()
+            outcomes = [results.get() for _ in workers]
+            elapsed = time.perf_counter() - started
+            for worker in workers:
+                worker.join()
+
+            cur = con.cursor()
+            cur.execute("SELECT appointment_date, COUNT(*) FROM appointment WHERE doctor_id=1 GROUP BY appointment_date")
+            per_day = dict(cur.fetchall())
+            cur.execute("SELECT appointment_date, booked FROM doctor_day_capacity WHERE doctor_id=1")
+            counters = dict(cur.fetchall())
+            con.close()
+        finally:
+            app.config["DATABASE"] = original_db
+
+    booked = sum(o["booked"] for o in outcomes)
+    attempts = per_process * processes
+    overbooked = {day: count for day, count in per_day.items() if count > limit}
+    click.echo(f"attempts={attempts} booked={booked} rejected_full={sum(o['full'] for o in outcomes)} "
+               f"errors={sum(o['errors'] for o in outcomes)} elapsed={elapsed:.2f}s throughput={attempts / elapsed:.0f} req/s")
+    click.echo(f"appointments per day: {per_day}")
+
+    if overbooked:
+        raise click.ClickException(f"overbooked days: {overbooked}")
+    if per_day != counters:
+        raise click.ClickException(f"slot counters {counters} do not match appointments {per_day}")
+    if booked != min(attempts, limit * days):
+        raise click.ClickException(f"expected {min(attempts, limit * days)} bookings, got {booked}")
+    click.echo("zero overbookings")
+
+@app.cli.command("bench-batch")
+@click.option("--items", "n_items", default=300, help="Appointments booked and then cancelled per run.")
+def bench_batch(n_items):
+    """Compare booking and cancelling n appointments one request at a time against the batch endpoints."""
+    original_db = app.config["DATABASE"]
+    client = app.test_client()
+    today = datetime.now().date()
+
+    try:
+        for mode in ["single", "batch"]:
+            with tempfile.TemporaryDirectory() as tmp:
+                app.config["DATABASE"] = os.path.join(tmp, "bench.db")
+                init_db()
+                con = connect_db()
+                seed_benchmark_data(con, max(1, n_items // 50), 10)
+                con.execute("UPDATE doctor SET weekly_holiday=''")
+                con.commit()
+                doctor_ids = [row[0] for row in con.execute("SELECT id FROM doctor")]
+                con.close()
+                # Spread over doctors and days so no day hits the daily limit
+                items = [{
+                    "doctor_id": doctor_ids[i % len(doctor_ids)],
+                    "appointment_date": (today + timedelta(days=1 + i // len(doctor_ids))).strftime('%Y-%m-%d'),
+                    "patient_name": f"Batch Patient {i}",
+                    "patient_phone": f"9{i:09d}"
+                } for i in range(n_items)]
+
+                started = time.perf_counter()
+                if mode == "single":
+                    booked = []
+                    for item in items:
+                        response = isolated(client.post, "/appointment", data=item)
+                        booked.append(response.status_code == 200)
+                    booking_seconds = time.perf_counter() - started
+                    started = time.perf_counter()
+                    for appointment_id, item in enumerate(items, 1):
+                        isolated(client.post, f"/cancel_appointment/{appointment_id}",
+                                 data={"patient_phone": item["patient_phone"]})
+                else:
+                    results = isolated(client.post, "/appointments/batch", json=items).get_json()["results"]
+                    booked = [result["status"] == "success" for result in results]
+                    booking_seconds = time.perf_counter() - started
+                    started = time.perf_counter()
+                    isolated(client.post, "/appointments/batch_status", json=[{
+                        "appointment_id": result["appointment_id"],
+                        "patient_phone": item["patient_phone"],
+                        "status": "cancelled"
+                    } for result, item in zip(results, items)])
+                cancel_seconds = time.perf_counter() - started
+
+                con = connect_db()
+                cancelled = con.execute("SELECT COUNT(*) FROM appointment WHERE status='cancelled'").fetchone()[0]
+                con.close()
+                click.echo(f"mode={mode:<6} items={n_items} booked={sum(booked)} cancelled={cancelled} "
+                           f"book={n_items / booking_seconds:.0f} items/s cancel={n_items / cancel_seconds:.0f} items/s")
+    finally:
+        app.config["DATABASE"] = original_db
+
+# ---------------------------------------------------------------------------
+# Benchmark harness: `flask --app cli bench --scale medium --save baseline.json`,
+# later `flask --app cli bench --scale medium --baseline baseline.json`
+# ---------------------------------------------------------------------------
+
+# (hospitals, doctors per hospital, appointments)
+BENCH_SCALES = {
+    "small": (20, 5, 10_000),
+    "medium": (200, 10, 250_000),
+    "large": (1000, 10, 2_000_000),
+}
+BENCH_PATIENTS = 50_000
+BENCH_SEARCHES = ["cardio", "dent", "pedia", "bench hospital 1", "general"]
+
+def seed_benchmark_appointments(con, appointments, seed=42):
+    """Spread appointments over every seeded doctor and the year around today, in one transaction."""
+    rng = random.Random(seed)
+    cur = con.cursor()
+    cur.execute("SELECT id FROM doctor")
+    doctors = [row[0] for row in cur.fetchall()]
+    today = datetime.now().date()
+
+    def rows():
+        for _ in range(appointments):
+            doctor_id = doctors[rng.randrange(len(doctors))]
+            day = (today + timedelta(days=rng.randrange(-365, 365))).strftime('%Y-%m-%d')
+            phone = f"9{rng.randrange(BENCH_PATIENTS):09d}"
+            status = "cancelled" if rng.random() < 0.1 else "confirmed"
+            yield doctor_id, day, f"Patient {phone[-5:]}", phone, phone, status
+
+    # The odd random patient drawn twice for one doctor and day is skipped (idx_appointment_active_booking)
+    cur.executemany("""
+        INSERT OR IGNORE INTO appointment (doctor_id, appointment_date, patient_name, patient_phone, phone_digits, status)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, rows())
+    # Same backfill as the migration, so the slot counters match the seeded rows
+    migrate_doctor_day_capacity(cur)
+    con.commit()
+
+def seed_bench_database(workdir, scale):
+    """Create and seed <workdir>/hospital.db at one of BENCH_SCALES (reused if it exists); returns (path, doctor ids)."""
+    hospitals, doctors, appointments = BENCH_SCALES[scale]
+    os.makedirs(workdir, exist_ok=True)
+    database = os.path.join(workdir, "hospital.db")
+    if os.path.exists(database):
+        click.echo(f"reusing {database}")
+        init_db(database)
+    else:
+        started = time.perf_counter()
+        init_db(database)
+        con = connect_db(database)
+        seed_benchmark_data(con, hospitals, doctors)
+        seed_benchmark_appointments(con, appointments)
+        con.close()
+        click.echo(f"seeded {scale}: {hospitals} hospitals, {hospitals * doctors} doctors, "
+                   f"{appointments} appointments in {time.perf_counter() - started:.1f}s")
+
+    con = connect_db(database)
+    doctor_ids = [row[0] for row in con.execute("SELECT id FROM doctor")]
+    con.close()
+    return database, doctor_ids
+
+def bench_scenarios(rng, doctor_ids):
+    """(name, request factory) pairs; each factory returns (method, url, form data)."""
+    today = datetime.now().date()
+
+    def phone():
+        return f"9{rng.randrange(BENCH_PATIENTS):09d}"
+
+    def booking():
+        day = today + timedelta(days=rng.randrange(1, 365))
+        return "POST", "/appointment", {
+            "doctor_id": str(rng.choice(doctor_ids)),
+            "appointment_date": day.strftime('%Y-%m-%d'),
+            "patient_name": "Bench Patient",
+            "patient_phone": phone()
+        }
+
+    return [
+        ("home", lambda: ("GET", "/", None)),
+        ("search", lambda: ("GET", f"/?search={quote(rng.choice(BENCH_SEARCHES))}", None)),
+        ("doctor_profile", lambda: ("GET", f"/doctor_profile/{rng.choice(doctor_ids)}", None)),
+        ("appointment_stats", lambda: ("GET", f"/get_appointment_stats/{rng.choice(doctor_ids)}", None)),
+        ("book_appointment", booking),
+        ("my_appointments", lambda: ("GET", f"/my_appointments/{phone()}", None)),
+    ]
+
+def bench_summary(timings, elapsed, statuses, queries=None):
+    return {
+        "requests": len(timings),
+        "throughput_rps": round(len(timings) / elapsed, 1),
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+        "p99_ms": round(percentile(timings, 99), 3),
+        "queries_per_request": None if queries is None else round(queries / len(timings), 2),
+        "statuses": {str(status): count for status, count in sorted(statuses.items(), key=lambda item: str(item[0]))},
+    }
+
+def bench_test_client(scenarios, n_requests, warmup):
+    client = app.test_client()
+    statements = []
+    results = {}
+    app.config["SQL_TRACE"] = statements.append
+    for name, make_request in scenarios:
+        for _ in range(warmup):
+            method, url, data = make_request()
+            isolated(client.open, url, method=method, data=data)
+
+        timings, statuses = [], {}
+        statements.clear()
+        started = time.perf_counter()
+        for _ in range(n_requests):
+            method, url, data = make_request()
+            start = time.perf_counter()
+            response = isolated(client.open, url, method=method, data=data)
+            timings.append((time.perf_counter() - start) * 1000)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        elapsed = time.perf_counter() - started
+        # Statements run inside triggers or virtual tables are traced with a "--" prefix
+        queries = sum(1 for sql in statements if not sql.startswith("--"))
+        results[name] = bench_summary(timings, elapsed, statuses, queries)
+    app.config["SQL_TRACE"] = None
+    return results
+
+@contextlib.contextmanager
+def bench_server(command, workdir, name):
+    """Run a server command (with {port} filled in) from workdir and yield its port once it accepts connections."""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    # Started from workdir, so the app opens <workdir>/hospital.db, the database that was just seeded
+    server = subprocess.Popen([part.format(port=port) for part in command], cwd=workdir, stdout=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if server.poll() is not None or time.time() > deadline:
+                    raise click.ClickException(f"{name} did not start (is it installed?)")
+                time.sleep(0.1)
+        yield port
+    finally:
+        server.terminate()
+        server.wait()
+
+def bench_fetch(port, prepared, timeout=10):
+    """Send one (method, url, form data) request; returns (milliseconds, status or "timeout"/"error")."""
+    method, url, data = prepared
+    body = urllib.parse.urlencode(data).encode() if data else None
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(f"http://127.0.0.1:{port}{url}", data=body, method=method),
+                                    timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as error:
+        error.read()
+        status = error.code
+    except (TimeoutError, socket.timeout):
+        status = "timeout"
+    except (urllib.error.URLError, ConnectionError):
+        status = "error"
+    return (time.perf_counter() - start) * 1000, status
+
+def bench_http(port, requests, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        started = time.perf_counter()
+        outcomes = list(pool.map(lambda prepared: bench_fetch(port, prepared), requests))
+        elapsed = time.perf_counter() - started
+    statuses = {}
+    for _, status in outcomes:
+        statuses[status] = statuses.get(status, 0) + 1
+    return bench_summary([timing for timing, _ in outcomes], elapsed, statuses)
+
+def gunicorn_command(workers):
+    return [sys.executable, "-m", "gunicorn", "--workers", str(workers), "--bind", "127.0.0.1:{port}",
+            "--pythonpath", app.root_path, "--log-level", "warning", "app:app"]
+
+def uvicorn_command(workers):
+    return [sys.executable, "-m", "uvicorn", "--workers", str(workers), "--host", "127.0.0.1", "--port", "{port}",
+            "--app-dir", app.root_path, "--log-level", "warning", "--no-access-log", "app:asgi_app"]
+
+def bench_gunicorn(workdir, scenarios, n_requests, warmup, workers, concurrency):
+    results = {}
+    with bench_server(gunicorn_command(workers), workdir, "gunicorn") as port:
+        for name, make_request in scenarios:
+            bench_http(port, [make_request() for _ in range(warmup)], concurrency)
+            results[name] = bench_http(port, [make_request() for _ in range(n_requests)], concurrency)
+    return results
+
+def bench_regressions(baseline, results, threshold):
+    """Human-readable list of every number that got worse than the baseline by more than threshold."""
+    failures = []
+    for mode, scenarios in results.items():
+        for name, current in scenarios.items():
+            before = baseline.get("results", {}).get(mode, {}).get(name)
+            if not before:
+                continue
+            label = f"{mode}/{name}"
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                if current[key] > before[key] * (1 + threshold):
+                    failures.append(f"{label}: {key} {before[key]} -> {current[key]}")
+            if current["throughput_rps"] < before["throughput_rps"] * (1 - threshold):
+                failures.append(f"{label}: throughput_rps {before['throughput_rps']} -> {current['throughput_rps']}")
+            if before.get("queries_per_request") is not None and current["queries_per_request"] is not None \
+                    and current["queries_per_request"] > before["queries_per_request"] * (1 + threshold):
+                failures.append(f"{label}: queries_per_request {before['queries_per_request']} -> {current['queries_per_request']}")
+    return failures
+
+@app.cli.command("bench")
+@click.option("--scale", type=click.Choice(list(BENCH_SCALES)), default="small", help="Synthetic data size to seed.")
+@click.option("--requests", "n_requests", default=200, help="Measured requests per scenario.")
+@click.option("--workdir", default=None, help="Directory for the seeded hospital.db; reused if it already exists.")
+@click.option("--gunicorn", "use_gunicorn", is_flag=True, help="Also drive a local gunicorn over HTTP, configured as deployed (page cache on).")
+@click.option("--workers", default=4, help="gunicorn worker processes.")
+@click.option("--concurrency", default=8, help="Concurrent HTTP clients against gunicorn.")
+@click.option("--save", "save_path", default=None, help="Write the results as a JSON baseline.")
+@click.option("--baseline", "baseline_path", default=None, help="Fail if results regress against this JSON baseline.")
+@click.option("--threshold", default=0.25, help="Allowed regression as a fraction (0.25 = 25%).")
+def bench(scale, n_requests, workdir, use_gunicorn, workers, concurrency, save_path, baseline_path, threshold):
+    """Seed synthetic data, drive the browsing and booking flows and report latency, throughput and query counts."""
+    baseline = None
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if baseline.get("scale") != scale:
+            raise click.ClickException(f"baseline was recorded at scale {baseline.get('scale')!r}, not {scale!r}")
+        if not baseline.get("uncached_listing"):
+            raise click.ClickException("baseline measured the listing through the page cache; record a new one")
+
+    original = {name: app.config[name] for name in ("DATABASE", "SQL_TRACE", "PAGE_CACHE")}
+    warmup = min(20, n_requests // 10)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = workdir or tmp
+        os.makedirs(workdir, exist_ok=True)
+        try:
+            database, doctor_ids = seed_bench_database(workdir, scale)
+            app.config["DATABASE"] = database
+            # After warm-up every listing request would be a page cache hit and hide query regressions,
+            # so every scenario is measured uncached; the cached listing is reported on its own
+            app.config["PAGE_CACHE"] = None
+            results = {"test_client": bench_test_client(bench_scenarios(random.Random(1), doctor_ids), n_requests, warmup)}
+            app.config["PAGE_CACHE"] = original["PAGE_CACHE"]
+            if app.config["PAGE_CACHE"]:
+                cached = [scenario for scenario in bench_scenarios(random.Random(1), doctor_ids)
+                          if scenario[0] in ("home", "search")]
+                results["test_client_cached"] = bench_test_client(cached, n_requests, warmup)
+            if use_gunicorn:
+                results["gunicorn"] = bench_gunicorn(workdir, bench_scenarios(random.Random(1), doctor_ids),
+                                                     n_requests, warmup, workers, concurrency)
+        finally:
+            app.config.update(original)
+
+    for mode, scenarios in results.items():
+        for name, summary in scenarios.items():
+            queries = summary["queries_per_request"]
+            click.echo(f"{mode:<18} {name:<18} req/s={summary['throughput_rps']:<8g} p50={summary['p50_ms']:.2f}ms "
+                       f"p95={summary['p95_ms']:.2f}ms p99={summary['p99_ms']:.2f}ms"
+                       + (f" queries/request={queries:g}" if queries is not None else "")
+                       + f" statuses={summary['statuses']}")
+
+    report = {
+        "scale": scale,
+        "requests": n_requests,
+        "sqlite": sqlite3.sqlite_version,
+        "uncached_listing": True,
+        "recorded_at": datetime.now().isoformat(timespec="seconds"),
+        "results": results,
+    }
+    if save_path:
+        with open(save_path, "w") as f:
+            json.dump(report, f, indent=2)
+        click.echo(f"saved {save_path}")
+
+    if baseline:
+        failures = bench_regressions(baseline, results, threshold)
+        if failures:
+            raise click.ClickException("regressed beyond {:.0%}:\n  ".format(threshold) + "\n  ".join(failures))
+        click.echo(f"no regressions beyond {threshold:.0%} against {baseline_path}")
+
+# The endpoints the ASGI mode is meant to serve concurrently
+CONCURRENCY_SCENARIOS = ["home", "search", "doctor_profile", "appointment_stats", "my_appointments"]
+
+@app.cli.command("bench-concurrency")
+@click.option("--scale", type=click.Choice(list(BENCH_SCALES)), default="small", help="Synthetic data size to seed.")
+@click.option("--workers", default=2, help="Processes for both servers.")
+@click.option("--levels", default="10,50,200", help="Comma-separated numbers of concurrent clients.")
+@click.option("--requests", "n_requests", default=400, help="Requests per server and level.")
+@click.option("--slow-clients", default=0, help="Extra connections that send half a request and stall during each level.")
+@click.option("--workdir", default=None, help="Directory for the seeded hospital.db; reused if it already exists.")
+def bench_concurrency(scale, workers, levels, n_requests, slow_clients, workdir):
+    """Compare gunicorn sync workers with the ASGI mode on the read-heavy endpoints under rising concurrency."""
+    servers = [("gunicorn-sync", gunicorn_command(workers)), ("uvicorn-asgi", uvicorn_command(workers))]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = workdir or tmp
+        _, doctor_ids = seed_bench_database(workdir, scale)
+
+        for name, command in servers:
+            with bench_server(command, workdir, name) as port:
+                for level in [int(level) for level in levels.split(",")]:
+                    # Same request sequence for every server
+                    rng = random.Random(level)
+                    scenarios = dict(bench_scenarios(rng, doctor_ids))
+                    requests = [scenarios[rng.choice(CONCURRENCY_SCENARIOS)]() for _ in range(n_requests)]
+                    bench_http(port, requests[:min(50, n_requests)], level)
+
+                    stalled = []
+                    for _ in range(slow_clients):
+                        conn = socket.create_connection(("127.0.0.1", port))
+                        conn.sendall(b"GET / HTTP/1.1\r\nHost: 127.0.0.1\r\n")
+                        stalled.append(conn)
+                    try:
+                        summary = bench_http(port, requests, level)
+                    finally:
+                        for conn in stalled:
+                            conn.close()
+
+                    failed = sum(count for status, count in summary["statuses"].items() if status != "200")
+                    click.echo(f"{name:<14} clients={level:<5} req/s={summary['throughput_rps']:<8g} "
+                               f"p50={summary['p50_ms']:.1f}ms p95={summary['p95_ms']:.1f}ms "
+                               f"p99={summary['p99_ms']:.1f}ms failed={failed}")
+
+@app.cli.command("bench-slot-events")
+@click.option("--subscribers", default="10,100,1000", help="Comma-separated numbers of open /doctor_events streams.")
+@click.option("--bookings", default=10, help="Bookings made while the streams are open, per level.")
+@click.option("--workers", default=2, help="uvicorn worker processes.")
+def bench_slot_events(subscribers, bookings, workers):
+    """Hold many live slot streams open on the ASGI server and time how fast each booking reaches all of them."""
+    import selectors
+
+    today = datetime.now().strftime('%Y-%m-%d')
+    with tempfile.TemporaryDirectory() as workdir:
+        database = os.path.join(workdir, "hospital.db")
+        init_db(database)
+        con = connect_db(database)
+        seed_benchmark_data(con, 2, 2)
+        con.execute("UPDATE doctor SET weekly_holiday='', max_appointments=100000")
+        con.commit()
+        con.close()
+
+        with bench_server(uvicorn_command(workers), workdir, "uvicorn") as port:
+            for level in [int(level) for level in subscribers.split(",")]:
+                streams = {}
+                selector = selectors.DefaultSelector()
+                for _ in range(level):
+                    conn = socket.create_connection(("127.0.0.1", port))
+                    conn.sendall(b"GET /doctor_events/1 HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n")
+                    conn.setblocking(False)
+                    selector.register(conn, selectors.EVENT_READ)
+                    streams[conn] = []
+
+                def read_until(done, timeout):
+                    # Collects the arrival time of every stats event until done() or the timeout
+                    deadline = time.perf_counter() + timeout
+                    while not done() and time.perf_counter() < deadline:
+                        for key, _ in selector.select(timeout=0.05):
+                            data = key.fileobj.recv(65536)
+                            streams[key.fileobj].extend([time.perf_counter()] * data.count(b"event: stats"))
+
+                read_until(lambda: all(streams.values()), 30)
+                latencies = []
+                missed = 0
+                for booking in range(1, bookings + 1):
+                    bench_fetch(port, ("POST", "/appointment", {
+                        "doctor_id": "1", "appointment_date": today,
+                        # A new patient per level too: the same patient twice on a day is a duplicate booking
+                        "patient_name": "Live Patient", "patient_phone": f"9{level:05d}{booking:04d}"}))
+                    booked_at = time.perf_counter()
+                    read_until(lambda: all(len(events) > booking for events in streams.values()), 10)
+                    for events in streams.values():
+                        if len(events) > booking:
+                            latencies.append((events[booking] - booked_at) * 1000)
+                        else:
+                            missed += 1
+
+                for conn in streams:
+                    selector.unregister(conn)
+                    conn.close()
+                click.echo(f"streams={level:<6} bookings={bookings} delivered={len(latencies)} missed={missed} "
+                           f"p50={percentile(latencies, 50):.0f}ms p95={percentile(latencies, 95):.0f}ms "
+                           f"max={max(latencies, default=0):.0f}ms")
+
+def appointment_storage(con):
+    """(bytes per appointment row, MB) for the appointment table's own b-tree, indexes excluded."""
+    rows = con.execute("SELECT COUNT(*) FROM appointment").fetchone()[0]
+    try:
+        size = con.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = 'appointment'").fetchone()[0] or 0
+    except sqlite3.OperationalError:
+        # SQLite built without dbstat: fall back to the whole file
+        size = con.execute("PRAGMA page_count").fetchone()[0] * con.execute("PRAGMA page_size").fetchone()[0]
+    return size / max(rows, 1), size / 1e6
+
+def best_of(fn, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings)
+
+@app.cli.command("bench-storage")
+@click.option("--rows", default=1_000_000, help="Appointments seeded before the layouts are compared.")
+@click.option("--workdir", default=None, help="Where the database is built (defaults to a temporary directory).")
+def bench_storage(rows, workdir):
+    """Compare appointment rows with copied doctor/hospital names against doctor_id only.
+
+    Seeds the old layout (schema version 9, names filled in), measures it, then runs the
+    migration that drops the name columns and measures again after VACUUM.
+    """
+    hospitals = max(20, rows // 2000)
+    # The same reads on either layout: a full scan, profile history pages and a hospital export
+    queries = {
+        "names copied": {
+            "history": """
+                SELECT id, doctor_name, hospital_name, appointment_date, patient_name, patient_phone, status
+                FROM appointment WHERE doctor_id = ? ORDER BY appointment_date DESC, id DESC LIMIT 25""",
+            "export": """
+                SELECT a.id, a.doctor_name, a.hospital_name, a.appointment_date, a.patient_name, a.patient_phone, a.status
+                FROM doctor d JOIN appointment a ON a.doctor_id = d.id
+                WHERE d.username=? ORDER BY d.id, a.appointment_date DESC, a.id DESC""",
+        },
+        "doctor_id only": {
+            "history": f"""
+                {APPOINTMENT_ROWS} WHERE a.doctor_id = ? ORDER BY a.appointment_date DESC, a.id DESC LIMIT 25""",
+            "export": """
+                SELECT a.id, d.name, h.name, a.appointment_date, a.patient_name, a.patient_phone, a.status
+                FROM doctor d JOIN appointment a ON a.doctor_id = d.id
+                LEFT JOIN hospital h ON h.username = d.username
+                WHERE d.username=? ORDER BY d.id, a.appointment_date DESC, a.id DESC""",
+        },
+    }
+
+    def measure(layout, database):
+        con = connect_db(database)
+        doctor_ids = [row[0] for row in con.execute("SELECT id FROM doctor")]
+        username = con.execute("SELECT username FROM hospital LIMIT 1").fetchone()[0]
+        rng = random.Random(7)
+        pages = [rng.choice(doctor_ids) for _ in range(500)]
+        sql = queries[layout]
+        bytes_per_row, megabytes = appointment_storage(con)
+        scan = best_of(lambda: con.execute(
+            "SELECT COUNT(*) FROM appointment WHERE patient_name = ''").fetchone())
+        history = best_of(lambda: [con.execute(sql["history"], (doctor_id,)).fetchall()
+                                   for doctor_id in pages]) / len(pages)
+        export = best_of(lambda: con.execute(sql["export"], (username,)).fetchall())
+        file_mb = os.path.getsize(database) / 1e6
+        con.close()
+        click.echo(f"layout={layout:<15} rows={rows} table={megabytes:.1f}MB bytes/row={bytes_per_row:.1f} "
+                   f"file={file_mb:.1f}MB scan={scan:.0f}ms history_page={history:.3f}ms export={export:.1f}ms")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = workdir or tmp
+        os.makedirs(workdir, exist_ok=True)
+        database = os.path.join(workdir, "storage.db")
+        if os.path.exists(database):
+            os.remove(database)
+
+        started = time.perf_counter()
+        init_db(database, until=9)
+        con = connect_db(database)
+        seed_benchmark_data(con, hospitals, 10)
+        seed_benchmark_appointments(con, rows)
+        con.execute("""
+            UPDATE appointment SET
+                doctor_name = (SELECT d.name FROM doctor d WHERE d.id = appointment.doctor_id),
+                hospital_name = (SELECT h.name FROM doctor d JOIN hospital h ON h.username = d.username
+                                 WHERE d.id = appointment.doctor_id)
+        """)
+        con.commit()
+        con.execute("VACUUM")
+        con.close()
+        click.echo(f"seeded {rows} appointments for {hospitals * 10} doctors in {time.perf_counter() - started:.1f}s")
+        measure("names copied", database)
+
+        started = time.perf_counter()
+        init_db(database)
+        migrated = time.perf_counter() - started
+        started = time.perf_counter()
+        con = connect_db(database)
+        con.execute("VACUUM")
+        con.close()
+        click.echo(f"migration {migrated:.1f}s, VACUUM {time.perf_counter() - started:.1f}s")
+        measure("doctor_id only", database)
@@ -0,0 +1,156 @@
+"""Query plan and N+1 checks: `flask --app cli check-query-plans`, `flask --app cli check-n-plus-one`."""
+import os
+import tempfile
+
+import click
+from flask import g
+
+from app import (app, connect_db, get_db, init_db, metrics, export_filters, RequestProfile,
+                 ANALYTICS_DOCTOR_FILTER, ANALYTICS_SQL, APPOINTMENT_BY_ID_SQL, APPOINTMENT_COUNTS_SQL,
+                 APPOINTMENT_HISTORY_SQL, ARCHIVE_BATCH_END_SQL, BATCH_ACTIVE_BOOKINGS_SQL, BATCH_APPOINTMENTS_SQL,
+                 BATCH_SLOT_COUNTERS_SQL, DASHBOARD_DOCTORS_SQL, DOCTOR_BY_ID_SQL, DOCTOR_IMPORT_NAMES_SQL,
+                 DOCTOR_IMPORT_VERSIONS_SQL, DOCTOR_LEAVE_ON_SQL, DOCTOR_OPEN_DAYS_SQL, DOCTOR_PAGE_SQL,
+                 DOCTOR_ROWS_DELETE_SQL, DOCTOR_VERSION_SQL, DOCTOR_VERSIONS_SQL, EXPORT_ROWS_SQL, HOME_SEARCH_FILTER,
+                 HOSPITAL_DOCTOR_COUNT_SQL, HOSPITAL_DOCTOR_SQL, HOSPITAL_DOCTORS_SQL, HOSPITAL_EXPORT_DOCTORS_SQL,
+                 HOSPITAL_PAGE_SQL, IDEMPOTENCY_PURGE_SQL, IDEMPOTENCY_REPLAY_SQL, LEAVES_BETWEEN_SQL,
+                 LEAVES_COVERING_SQL, RESERVE_SLOT_SQL, UPCOMING_LEAVES_SQL)
+from cli.bench import isolated, seed_benchmark_data
+
+# Queries on the request hot paths, with representative parameters. Every entry runs the
+# statement production executes (the same constant, formatted the same way), never a copy.
+# None of them may fall back to a full table scan.
+HOT_QUERIES = {
+    "idempotency key replay": (IDEMPOTENCY_REPLAY_SQL, ("k", 0)),
+    "expired idempotency keys": (IDEMPOTENCY_PURGE_SQL, (0,)),
+    "booking slot counter": (RESERVE_SLOT_SQL, (1, "2030-01-01", 5)),
+    "batch booking slot counters": (
+        BATCH_SLOT_COUNTERS_SQL.format(values="(?, ?), (?, ?)"), (1, "2030-01-01", 2, "2030-01-02")),
+    "batch active bookings": (
+        BATCH_ACTIVE_BOOKINGS_SQL.format(values="(?, ?, ?), (?, ?, ?)"),
+        (1, "2030-01-01", "9876543210", 2, "2030-01-01", "9876543210")),
+    "batch status appointments": (BATCH_APPOINTMENTS_SQL.format(placeholders="?,?"), (1, 2)),
+    "live slot versions": (DOCTOR_VERSIONS_SQL.format(placeholders="?,?"), (1, 2)),
+    "doctor appointment counts": (APPOINTMENT_COUNTS_SQL, {"today": "2030-01-01", "doctor_id": 1}),
+    "doctor change version": (DOCTOR_VERSION_SQL, (1,)),
+    "doctor profile history first page": (APPOINTMENT_HISTORY_SQL["doctor_id"][0], (1, 26)),
+    "doctor profile history": (APPOINTMENT_HISTORY_SQL["doctor_id"][1], (1, "2030-01-01", 5, 26)),
+    "my appointments first page": (APPOINTMENT_HISTORY_SQL["phone_digits"][0], ("9876543210", 21)),
+    "my appointments by phone": (APPOINTMENT_HISTORY_SQL["phone_digits"][1], ("9876543210", "2030-01-01", 10, 21)),
+    "confirmed appointments export": (
+        EXPORT_ROWS_SQL.format(filters=export_filters({"status": "confirmed", "from": "2030-01-01"})[0]),
+        (1, "confirmed", "2030-01-01")),
+    "all appointments export": (EXPORT_ROWS_SQL.format(filters=export_filters({"status": "all"})[0]), (1,)),
+    "hospital analytics monthly": (
+        ANALYTICS_SQL["month"][0].format(doctor_filter=""),
+        {"username": "govthebri", "start": "2029-01", "end": "2030-01"}),
+    "hospital analytics daily by doctor": (
+        ANALYTICS_SQL["day"][1].format(doctor_filter=ANALYTICS_DOCTOR_FILTER),
+        {"username": "govthebri", "doctor_id": 1, "start": "2030-01-01", "end": "2030-01-30"}),
+    "hospital export doctors": (HOSPITAL_EXPORT_DOCTORS_SQL, ("govthebri",)),
+    "archive batch end": (ARCHIVE_BATCH_END_SQL, (0, "2030-01-01", 5000)),
+    **{f"doctor delete: {sql}": (sql, (1,)) for sql in DOCTOR_ROWS_DELETE_SQL},
+    "doctor import names": (DOCTOR_IMPORT_NAMES_SQL, ("h",)),
+    "doctor import change versions": (DOCTOR_IMPORT_VERSIONS_SQL, ("h",)),
+    "doctor leave on date": (DOCTOR_LEAVE_ON_SQL, (1, "2030-01-01", "2030-01-01")),
+    "leaves covering today": (LEAVES_COVERING_SQL, ("2030-01-01", "2030-01-01")),
+    "leaves between": (LEAVES_BETWEEN_SQL.format(placeholders="?,?"), (1, 2, "2030-01-01", "2030-01-28")),
+    "upcoming leaves": (UPCOMING_LEAVES_SQL.format(placeholders="?,?"), (1, 2, "2030-01-01")),
+    "doctor open days": (DOCTOR_OPEN_DAYS_SQL, {"doctor_id": 1, "start": "2030-01-01", "end": "2030-01-28"}),
+    "hospital doctors": (DASHBOARD_DOCTORS_SQL, ("govthebri", 0, 13)),
+    "hospital doctor": (HOSPITAL_DOCTOR_SQL, (1, "govthebri")),
+    "hospital doctor count": (HOSPITAL_DOCTOR_COUNT_SQL, ("govthebri",)),
+    "listing hospitals page": (
+        HOSPITAL_PAGE_SQL.format(search_filter=""), {"cursor": "", "limit": 11}),
+    "listing hospitals page search": (
+        HOSPITAL_PAGE_SQL.format(search_filter=HOME_SEARCH_FILTER), {"cursor": "", "limit": 11, "pattern": "%card%"}),
+    "listing first doctors": (
+        HOSPITAL_DOCTORS_SQL.format(usernames=":u0, :u1", search_filter=""), {"u0": "govthebri", "u1": "durgahalady", "per_hospital": 13}),
+    "listing doctors page": (
+        DOCTOR_PAGE_SQL.format(search_filter=""), {"username": "govthebri", "cursor": 0, "limit": 13}),
+    "doctor by id": (DOCTOR_BY_ID_SQL, (1,)),
+    "appointment by id": (APPOINTMENT_BY_ID_SQL, (1,)),
+}
+
+def full_scans(cur, sql, params):
+    cur.execute("EXPLAIN QUERY PLAN " + sql, params)
+    # Plan rows are (id, parent, notused, detail); "SCAN t" without "USING ... INDEX" reads the whole table.
+    # "SCAN (subquery-N)" and scans of a MATERIALIZEd or CO-ROUTINE name (views such as appointment_all)
+    # walk rows a subquery already produced, not a table; the subquery's own steps are checked.
+    plan = [row[3] for row in cur.fetchall()]
+    materialized = {detail.split()[1] for detail in plan if detail.startswith(("MATERIALIZE ", "CO-ROUTINE "))}
+    return [detail for detail in plan
+            if detail.startswith("SCAN ") and " USING " not in detail and "CONSTANT ROW" not in detail
+            and not detail.startswith("SCAN (subquery-") and detail.split()[1] not in materialized]
+
+@app.cli.command("check-query-plans")
+@click.option("--database", default=None, help="Database file to check (defaults to a freshly migrated one).")
+def check_query_plans(database):
+    """Fail if any hot query's EXPLAIN QUERY PLAN contains a full table scan."""
+    with tempfile.TemporaryDirectory() as tmp:
+        database = database or os.path.join(tmp, "plans.db")
+        init_db(database)
+        con = connect_db(database)
+        cur = con.cursor()
+        failures = 0
+        for name, (sql, params) in HOT_QUERIES.items():
+            scans = full_scans(cur, sql, params)
+            click.echo(f"{'FAIL' if scans else 'ok':<5}{name}" + (f"  ({'; '.join(scans)})" if scans else ""))
+            failures += bool(scans)
+        con.close()
+
+    if failures:
+        raise click.ClickException(f"{failures} hot quer{'y' if failures == 1 else 'ies'} fell back to a full table scan")
+
+# Public pages that must load their rows in a fixed number of statements, whatever the catalogue size
+N_PLUS_ONE_URLS = ["/", "/?search=cardio", "/hospitals", "/doctor_profile/1", "/book_appointment/1",
+                   "/get_appointment_stats/1"]
+
+@app.cli.command("check-n-plus-one")
+@click.option("--hospitals", default=20, help="Hospitals to seed.")
+def check_n_plus_one(hospitals):
+    """Fail if the N+1 detector misses a per-row query loop or fires on a public page."""
+    original = {key: app.config[key] for key in ("DATABASE", "PAGE_CACHE", "PROFILING")}
+    client = app.test_client()
+    failures = 0
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            app.config.update(DATABASE=os.path.join(tmp, "n_plus_one.db"), PAGE_CACHE=None, PROFILING=True)
+            init_db()
+            con = connect_db()
+            seed_benchmark_data(con, hospitals)
+            con.close()
+
+            def load_one_at_a_time():
+                # The shape the detector exists for: one lookup per row of a listing
+                with app.test_request_context("/"):
+                    g.profile = RequestProfile()
+                    cur = get_db().cursor()
+                    cur.execute("SELECT id FROM doctor")
+                    for (doctor_id,) in cur.fetchall():
+                        cur.execute("SELECT name, specialization FROM doctor WHERE id=?", (doctor_id,))
+                        cur.fetchone()
+                    return g.profile.repeated_statements(app.config["N_PLUS_ONE_THRESHOLD"])
+
+            before = n_plus_one_count()
+            repeated = isolated(load_one_at_a_time)
+            # The request's teardown must have logged and counted it too
+            detected = bool(repeated) and n_plus_one_count() > before
+            click.echo(f"{'ok' if detected else 'FAIL':<5}per-doctor query loop detected"
+                       + (f"  ({repeated[0][0]}x)" if repeated else ""))
+            failures += not detected
+
+            for url in N_PLUS_ONE_URLS:
+                before = n_plus_one_count()
+                status = isolated(client.get, url).status_code
+                flagged = n_plus_one_count() > before or status >= 500
+                click.echo(f"{'FAIL' if flagged else 'ok':<5}{url}" + (f"  (status {status})" if flagged else ""))
+                failures += flagged
+    finally:
+        app.config.update(original)
+
+    if failures:
+        raise click.ClickException(f"{failures} N+1 check{'' if failures == 1 else 's'} failed")
+
+def n_plus_one_count():
+    with metrics.lock:
+        return sum(value for (name, _), value in metrics.counters.items() if name == "drinfo_n_plus_one_total")
@@ -0,0 +1,301 @@
+"""Synthetic data and snapshots: `flask --app cli seed-data --years 3`, then
+`flask --app cli snapshot-db seeded.db` / `flask --app cli restore-db seeded.db`.
+"""
+import math
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import click
+
+from app import (app, connect_db, init_db, init_archive, archive_path, archive_appointments, weekday_mask,
+                 migrate_appointment_rollups, migrate_doctor_day_capacity, HAS_FTS5, MIGRATIONS, SEARCH_INDEX_ROW_SQL)
+from cli.bench import BENCH_SPECIALIZATIONS
+
+SEED_FIRST_NAMES = ["Aarav", "Priya", "Rahul", "Ananya", "Vikram", "Meera", "Arjun", "Kavya", "Rohan", "Sneha",
+                    "Karthik", "Divya", "Sanjay", "Lakshmi", "Nikhil", "Pooja", "Imran", "Fatima", "Joseph", "Maria"]
+SEED_LAST_NAMES = ["Sharma", "Iyer", "Reddy", "Nair", "Patel", "Gupta", "Khan", "Das", "Menon", "Rao",
+                   "Singh", "Pillai", "Joshi", "Bose", "Fernandes", "Kulkarni", "Chatterjee", "Verma"]
+SEED_CITIES = ["Chennai", "Bengaluru", "Hyderabad", "Kochi", "Pune", "Mumbai", "Delhi", "Kolkata", "Jaipur", "Madurai"]
+SEED_EDUCATION = {"Cardiologist": "MBBS, MD, DM Cardiology", "Dentist": "BDS, MDS", "Pediatrician": "MBBS, MD Pediatrics",
+                  "Orthopedic": "MBBS, MS Ortho", "Dermatologist": "MBBS, MD Dermatology", "General Physician": "MBBS"}
+SEED_TIMINGS = ["9:00 AM - 1:00 PM", "9:00 AM - 5:00 PM", "10:00 AM - 6:00 PM", "2:00 PM - 8:00 PM", "5:00 PM - 9:00 PM"]
+# Sunday off at most hospitals, a few doctors take the whole weekend or a weekday instead
+SEED_HOLIDAYS = ["Sunday"] * 6 + ["Saturday, Sunday"] * 2 + ["Wednesday", ""]
+SEED_LEAVE_SESSIONS = ["Full Day"] * 3 + ["Morning", "Afternoon", "Evening"]
+# Relative demand by weekday (Monday first): the Monday rush, quiet weekends
+SEED_WEEKDAY_DEMAND = [1.3, 1.1, 1.0, 1.0, 0.9, 0.7, 0.4]
+SEED_BOOKING_HORIZON_DAYS = 60
+SNAPSHOT_STEP_PAGES = 1024
+
+def seed_synthetic_data(con, hospitals, doctors_per_hospital, years, patients, seed=42):
+    """Fill an empty database with hospitals, doctors, leaves and years of appointments; returns row counts.
+
+    Demand is skewed the way production is: a few doctors are booked out while most are
+    not, Mondays and winters are busy, and volume grows towards today. Everything runs in
+    one transaction with the appointment/doctor indexes and triggers dropped, rows go in
+    through executemany, and the indexes, triggers and derived tables (slot counters,
+    rollups, change versions, search index) are built once at the end.
+    """
+    rng = random.Random(seed)
+    cur = con.cursor()
+    cur.execute("SELECT COUNT(*) FROM doctor")
+    if cur.fetchone()[0]:
+        raise ValueError("seed_synthetic_data needs an empty database")
+    today = datetime.now().date()
+    first_day = today - timedelta(days=365 * years)
+    last_day = today + timedelta(days=SEED_BOOKING_HORIZON_DAYS)
+    days = (last_day - first_day).days + 1
+    # Regulars: 2% of patients make a fifth of the bookings
+    regulars = max(1, patients // 50)
+
+    cur.execute("BEGIN")
+    cur.execute("""
+        SELECT type, name, sql FROM sqlite_master
+        WHERE tbl_name IN ('hospital', 'doctor', 'doctor_leave', 'appointment')
+          AND type IN ('index', 'trigger') AND sql IS NOT NULL
+    """)
+    deferred = cur.fetchall()
+    for kind, name, _ in deferred:
+        cur.execute(f"DROP {kind.upper()} {name}")
+
+    cur.executemany("INSERT INTO hospital (username, name, location, image) VALUES (?, ?, ?, ?)", [
+        (f"seed{h}", f"{rng.choice(SEED_LAST_NAMES)} {rng.choice(['Hospital', 'Clinic', 'Medical Centre'])} {h}",
+         SEED_CITIES[h % len(SEED_CITIES)], None)
+        for h in range(hospitals)
+    ])
+
+    doctors = []
+    for h in range(hospitals):
+        for _ in range(doctors_per_hospital):
+            specialization = rng.choice(BENCH_SPECIALIZATIONS)
+            doctors.append((f"seed{h}", f"Dr. {rng.choice(SEED_FIRST_NAMES)} {rng.choice(SEED_LAST_NAMES)}",
+                            specialization, SEED_EDUCATION[specialization], rng.choice(SEED_TIMINGS),
+                            rng.choice(SEED_HOLIDAYS), "", None, rng.choice([3, 5, 8, 10, 12, 15, 20])))
+    cur.executemany("""
+        INSERT INTO doctor (username, name, specialization, education, timings, weekly_holiday, emergency_leave, image, max_appointments)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, doctors)
+    cur.execute("SELECT id, weekly_holiday, max_appointments FROM doctor ORDER BY id")
+    doctor_rows = cur.fetchall()
+
+    # A couple of short leaves per doctor per year; nobody can book a doctor on leave
+    leaves = []
+    leave_days = {}
+    for doctor_id, _, _ in doctor_rows:
+        for _ in range(rng.randint(0, 3) * years):
+            start = first_day + timedelta(days=rng.randrange(days))
+            length = rng.choice([1, 1, 1, 2, 3, 5])
+            leaves.append((doctor_id, start.strftime('%Y-%m-%d'),
+                           (start + timedelta(days=length - 1)).strftime('%Y-%m-%d'), rng.choice(SEED_LEAVE_SESSIONS)))
+            leave_days.setdefault(doctor_id, set()).update(
+                (start + timedelta(days=offset)).toordinal() for offset in range(length))
+    cur.executemany("INSERT INTO doctor_leave (doctor_id, start_date, end_date, session) VALUES (?, ?, ?, ?)", leaves)
+
+    def appointments():
+        calendar = [first_day + timedelta(days=offset) for offset in range(days)]
+        dates = [day.strftime('%Y-%m-%d') for day in calendar]
+        # Busier in winter and growing from 60% to 100% of today's volume over the years
+        demand = [SEED_WEEKDAY_DEMAND[day.weekday()] * (1 + 0.2 * math.cos(2 * math.pi * (day.month - 1) / 12))
+                  * (0.6 + 0.4 * min(1, offset / max(1, days - SEED_BOOKING_HORIZON_DAYS)))
+                  for offset, day in enumerate(calendar)]
+        today_ordinal = today.toordinal()
+        for doctor_id, weekly_holiday, max_appointments in doctor_rows:
+            mask = weekday_mask(weekly_holiday)
+            away = leave_days.get(doctor_id, ())
+            # Pareto popularity: most doctors fill a fraction of their slots, a few are always full
+            popularity = min(1.0, 0.12 * rng.paretovariate(1.5))
+            for day, date, factor in zip(calendar, dates, demand):
+                if mask & (1 << day.weekday()) or day.toordinal() in away:
+                    continue
+                upcoming = day.toordinal() >= today_ordinal
+                # Later dates are still filling up
+                p = min(1.0, popularity * factor) * (0.5 if day.toordinal() > today_ordinal + 14 else 1)
+                booked = sum(rng.random() < p for _ in range(max_appointments))
+                phones = set()
+                while len(phones) < booked:
+                    patient = rng.randrange(regulars) if rng.random() < 0.2 else rng.randrange(patients)
+                    phones.add(f"9{patient:09d}")
+                for phone in phones:
+                    patient = int(phone)
+                    status = "cancelled" if rng.random() < (0.05 if upcoming else 0.1) else "confirmed"
+                    yield (doctor_id, date,
+                           f"{SEED_FIRST_NAMES[patient % len(SEED_FIRST_NAMES)]} {SEED_LAST_NAMES[patient // 7 % len(SEED_LAST_NAMES)]}",
+                           phone, phone, status)
+
+    cur.executemany("""
+        INSERT INTO appointment (doctor_id, appointment_date, patient_name, patient_phone, phone_digits, status)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, appointments())
+
+    # Indexes are built from sorted data once instead of row by row, triggers come back
+    # before the derived tables are filled so nothing written afterwards is missed
+    for kind, _, sql in sorted(deferred, key=lambda item: item[0] != "index"):
+        cur.execute(sql)
+    migrate_doctor_day_capacity(cur)
+    migrate_appointment_rollups(cur)
+    cur.execute("INSERT OR IGNORE INTO doctor_change (doctor_id, version, changed_at) SELECT id, 1, datetime('now') FROM doctor")
+    if HAS_FTS5:
+        cur.execute("DELETE FROM doctor_search")
+        cur.execute("INSERT INTO doctor_search (rowid, name, specialization, education, hospital_name, location) "
+                    + SEARCH_INDEX_ROW_SQL)
+    cur.execute("UPDATE cache_generation SET value = value + 1")
+    con.commit()
+
+    cur.execute("SELECT (SELECT COUNT(*) FROM hospital), (SELECT COUNT(*) FROM doctor), "
+                "(SELECT COUNT(*) FROM doctor_leave), (SELECT COUNT(*) FROM appointment)")
+    return dict(zip(("hospitals", "doctors", "leaves", "appointments"), cur.fetchone()))
+
+def remove_database(database):
+    """Delete a database, its archive and their WAL files."""
+    for path in (database, archive_path(database)):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+def backup_database(source, target):
+    """Copy source over target with SQLite's online backup API; returns the pages copied.
+
+    The source stays readable and writable meanwhile: the copy advances SNAPSHOT_STEP_PAGES
+    at a time and restarts by itself if the source is written to between steps.
+    """
+    src = sqlite3.connect(source, timeout=app.config["DB_BUSY_TIMEOUT"])
+    dst = sqlite3.connect(target, timeout=app.config["DB_BUSY_TIMEOUT"])
+    try:
+        src.backup(dst, pages=SNAPSHOT_STEP_PAGES)
+        # A target in WAL mode only has the copy in its -wal file until it is checkpointed
+        dst.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return dst.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        dst.close()
+        src.close()
+
+def schema_version(database):
+    con = sqlite3.connect(database)
+    try:
+        return con.execute("SELECT MAX(version) FROM schema_version").fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        con.close()
+
+@app.cli.command("seed-data")
+@click.option("--database", default=None, help="Database to create (default DATABASE).")
+@click.option("--hospitals", default=50, help="Hospitals to create.")
+@click.option("--doctors", default=8, help="Doctors per hospital.")
+@click.option("--years", default=3, help="Years of appointment history before today.")
+@click.option("--patients", default=100_000, help="Distinct patients booking.")
+@click.option("--seed", default=42, help="Random seed; the same options and seed give the same data.")
+@click.option("--archive", is_flag=True, help="Then move appointments older than ARCHIVE_AFTER_DAYS to the archive.")
+@click.option("--force", is_flag=True, help="Replace the database if it exists.")
+def seed_data_command(database, hospitals, doctors, years, patients, seed, archive, force):
+    """Create a database filled with realistic synthetic data."""
+    database = database or app.config["DATABASE"]
+    if os.path.exists(database):
+        if not force:
+            raise click.ClickException(f"{database} exists, pass --force to replace it")
+        remove_database(database)
+
+    started = time.perf_counter()
+    init_db(database)
+    con = connect_db(database)
+    try:
+        counts = seed_synthetic_data(con, hospitals, doctors, years, patients, seed)
+        click.echo(f"seeded {database}: {counts['hospitals']} hospitals, {counts['doctors']} doctors, "
+                   f"{counts['leaves']} leaves, {counts['appointments']} appointments "
+                   f"in {time.perf_counter() - started:.1f}s")
+        if archive:
+            started = time.perf_counter()
+            cutoff = (datetime.now().date() - timedelta(days=app.config["ARCHIVE_AFTER_DAYS"])).strftime('%Y-%m-%d')
+            moved = archive_appointments(con, cutoff, app.config["ARCHIVE_BATCH_SIZE"])
+            click.echo(f"archived {moved} appointments dated before {cutoff} in {time.perf_counter() - started:.1f}s")
+            con.execute("VACUUM main")
+        con.execute("PRAGMA main.wal_checkpoint(TRUNCATE)")
+        con.execute("PRAGMA archive.wal_checkpoint(TRUNCATE)")
+    finally:
+        con.close()
+
+@app.cli.command("snapshot-db")
+@click.argument("path")
+@click.option("--database", default=None, help="Database to copy (default DATABASE).")
+@click.option("--force", is_flag=True, help="Replace PATH if it exists.")
+def snapshot_db_command(path, database, force):
+    """Copy the database and its archive to PATH (and PATH's -archive file) while the app keeps running."""
+    database = database or app.config["DATABASE"]
+    if not os.path.exists(database):
+        raise click.ClickException(f"{database} does not exist")
+    if os.path.exists(path):
+        if not force:
+            raise click.ClickException(f"{path} exists, pass --force to replace it")
+        remove_database(path)
+
+    started = time.perf_counter()
+    pages = backup_database(database, path)
+    if os.path.exists(archive_path(database)):
+        pages += backup_database(archive_path(database), archive_path(path))
+    click.echo(f"snapshot of {database} (schema version {schema_version(path)}) written to {path}: "
+               f"{pages} pages in {time.perf_counter() - started:.1f}s")
+
+@app.cli.command("restore-db")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--database", default=None, help="Database to overwrite (default DATABASE).")
+@click.option("--yes", is_flag=True, help="Do not ask before overwriting.")
+def restore_db_command(path, database, yes):
+    """Overwrite the database and its archive with the snapshot at PATH.
+
+    Running workers keep working when the snapshot is at the current schema version: their
+    open connections see the restored data. Cache generations and change versions end up
+    above the overwritten ones, so pages and ETags cached before the restore are never
+    served again. An older snapshot keeps its schema version (to benchmark migrations on
+    it); stop the app before restoring one, and starting it migrates the database.
+    """
+    database = database or app.config["DATABASE"]
+    version = schema_version(path)
+    if version is None:
+        raise click.ClickException(f"{path} is not a snapshot of this app's database")
+    if version < MIGRATIONS[-1][0]:
+        click.echo(f"{path} is at schema version {version}, older than this app's "
+                   f"{MIGRATIONS[-1][0]}: stop the app first, starting it again migrates the database", err=True)
+    if not yes:
+        click.confirm(f"Overwrite {database} with {path} (schema version {version})?", abort=True)
+
+    counters = {}
+    if os.path.exists(database):
+        con = sqlite3.connect(database)
+        tables = {row[0] for row in con.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        if "cache_generation" in tables:
+            counters["generation"] = con.execute("SELECT COALESCE(MAX(value), 0) FROM cache_generation").fetchone()[0]
+        if "doctor_change" in tables:
+            counters["version"] = con.execute("SELECT COALESCE(MAX(version), 0) FROM doctor_change").fetchone()[0]
+        con.close()
+
+    started = time.perf_counter()
+    pages = backup_database(path, database)
+    if os.path.exists(archive_path(path)):
+        pages += backup_database(archive_path(path), archive_path(database))
+    elif os.path.exists(archive_path(database)):
+        # Snapshot without an archive: empty the live one, keeping the table that open
+        # connections (appointment_all, appointment_counts) read through
+        with tempfile.TemporaryDirectory() as tmp:
+            empty = os.path.join(tmp, "archive.db")
+            con = sqlite3.connect(":memory:")
+            con.execute("ATTACH DATABASE ? AS archive", (empty,))
+            init_archive(con.cursor())
+            con.close()
+            pages += backup_database(empty, archive_path(database))
+
+    con = sqlite3.connect(database)
+    if "generation" in counters and version >= 6:
+        con.execute("UPDATE cache_generation SET value = value + ?", (counters["generation"],))
+    if "version" in counters and version >= 5:
+        con.execute("UPDATE doctor_change SET version = version + ?", (counters["version"],))
+    con.commit()
+    con.close()
+    click.echo(f"restored {path} (schema version {version}) over {database}: "
+               f"{pages} pages in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    app.run(debug=True, host="127.0.0.1", port=5000)
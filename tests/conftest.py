@@ -0,0 +1,21 @@
+import os
+import sys
+import tempfile
+
+# app.py creates its upload folders and migrates hospital.db in the working directory on import
+os.chdir(tempfile.mkdtemp(prefix="drinfo-tests-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+from app import app, init_db  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path):
+    """A freshly migrated database that the app uses for the duration of one test."""
+    original = app.config["DATABASE"]
+    app.config["DATABASE"] = str(tmp_path / "hospital.db")
+    init_db()
+    yield app.config["DATABASE"]
+    app.config["DATABASE"] = original
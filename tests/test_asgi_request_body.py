@@ -0,0 +1,69 @@
+import asyncio
+
+from flask import Flask, request
+
+from app import ASGIAdapter
+
+echo = Flask("echo")
+
+
+@echo.post("/echo")
+def echo_body():
+    return request.get_data()
+
+
+@echo.post("/ignore")
+def ignore_body():
+    return "ok"
+
+
+def post(messages, headers=(), path="/echo"):
+    """POST to path through the adapter, feeding it messages; returns (status, body, messages received)."""
+    received = []
+    sent = []
+
+    async def receive():
+        if messages:
+            received.append(messages[0])
+            return messages.pop(0)
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": path, "query_string": b"", "http_version": "1.1",
+             "headers": [(b"content-type", b"application/octet-stream"), *headers]}
+    asyncio.run(ASGIAdapter(echo)(scope, receive, send))
+    return sent[0]["status"], b"".join(message.get("body", b"") for message in sent[1:]), received
+
+
+def chunks(body, size):
+    pieces = [body[i:i + size] for i in range(0, len(body), size)]
+    return [{"type": "http.request", "body": piece, "more_body": i < len(pieces) - 1} for i, piece in enumerate(pieces)]
+
+
+def test_chunked_body_reaches_the_view():
+    body = bytes(range(256)) * 1000
+    status, echoed, received = post(chunks(body, 4096))
+    assert status == 200
+    assert echoed == body
+    assert len(received) == len(chunks(body, 4096))
+
+
+def test_content_length_body_reaches_the_view():
+    body = b"x" * 100
+    status, echoed, _ = post(chunks(body, 7), [(b"content-length", b"100")])
+    assert (status, echoed) == (200, body)
+
+
+def test_disconnect_while_sending_the_body_is_a_bad_request():
+    messages = chunks(b"x" * 100, 10)[:3] + [{"type": "http.disconnect"}]
+    messages[2]["more_body"] = True
+    status, _, _ = post(messages, [(b"content-length", b"100")])
+    assert status == 400
+
+
+def test_view_runs_before_the_body_is_read():
+    status, echoed, received = post(chunks(b"x" * 100, 10), path="/ignore")
+    assert (status, echoed) == (200, b"ok")
+    assert received == []
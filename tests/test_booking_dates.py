@@ -0,0 +1,26 @@
+from datetime import date, timedelta
+
+import pytest
+
+from app import analytics_periods, app, booking_date_error
+
+
+@pytest.mark.parametrize("days, bookable", [(-1, False), (0, True), (1, True), (365, True), (366, False)])
+def test_booking_window(days, bookable):
+    app.config["BOOKING_MAX_DAYS_AHEAD"] = 365
+    value = (date.today() + timedelta(days=days)).isoformat()
+    assert (booking_date_error(value) is None) == bookable
+
+
+@pytest.mark.parametrize("value", [None, 20300107, "2030-1-7", "2030-02-30", ""])
+def test_booking_rejects_malformed_dates(value):
+    assert booking_date_error(value) == "Please choose a valid appointment date"
+
+
+def test_analytics_periods_end_at_date_max():
+    assert analytics_periods("day", "9999-12-30", "9999-12-31") == ["9999-12-30", "9999-12-31"]
+    assert analytics_periods("month", "9999-11", "9999-12") == ["9999-11", "9999-12"]
+
+
+def test_analytics_periods_pad_early_years():
+    assert analytics_periods("month", "0001-12", "0002-01") == ["0001-12", "0002-01"]
@@ -0,0 +1,23 @@
+import pytest
+
+from app import connect_db, init_db
+from cli.checks import HOT_QUERIES, full_scans
+
+
+@pytest.fixture(scope="module")
+def cur(tmp_path_factory):
+    database = str(tmp_path_factory.mktemp("plans") / "plans.db")
+    init_db(database)
+    con = connect_db(database)
+    yield con.cursor()
+    con.close()
+
+
+@pytest.mark.parametrize("name", sorted(HOT_QUERIES))
+def test_hot_query_avoids_full_table_scans(cur, name):
+    sql, params = HOT_QUERIES[name]
+    assert full_scans(cur, sql, params) == []
+
+
+def test_full_scans_reports_unindexed_filters(cur):
+    assert full_scans(cur, "SELECT id FROM appointment WHERE patient_name = ?", ("x",))
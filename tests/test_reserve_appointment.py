@@ -0,0 +1,77 @@
+import multiprocessing
+import threading
+
+import pytest
+
+from app import connect_db, reserve_appointment
+
+MAX_APPOINTMENTS = 3
+CONTENDERS = 12
+DAY = "2030-01-07"
+
+
+@pytest.fixture
+def doctor_id(database):
+    con = connect_db(database)
+    con.execute("INSERT INTO hospital (username, name, location) VALUES ('h', 'Race Hospital', 'Town')")
+    cur = con.execute("""
+        INSERT INTO doctor (username, name, specialization, education, timings, weekly_holiday, max_appointments)
+        VALUES ('h', 'Dr Race', 'Dentist', 'BDS', '9-5', '', ?)
+    """, (MAX_APPOINTMENTS,))
+    con.commit()
+    con.close()
+    return cur.lastrowid
+
+
+def book(database, doctor_id, patient, barrier):
+    # Every contender has its own connection, as every gunicorn worker does
+    con = connect_db(database)
+    try:
+        barrier.wait()
+        phone = f"9{patient:09d}"
+        return reserve_appointment(con, doctor_id, MAX_APPOINTMENTS, (DAY, f"Patient {patient}", phone, phone))
+    finally:
+        con.close()
+
+
+def book_in_process(database, doctor_id, patient, barrier, results):
+    results.put(book(database, doctor_id, patient, barrier) is not None)
+
+
+def assert_day_filled(database, doctor_id, booked):
+    assert booked == MAX_APPOINTMENTS
+    con = connect_db(database)
+    try:
+        assert con.execute("SELECT booked FROM doctor_day_capacity WHERE doctor_id=? AND appointment_date=?",
+                           (doctor_id, DAY)).fetchone() == (MAX_APPOINTMENTS,)
+        assert con.execute("SELECT COUNT(*) FROM appointment WHERE doctor_id=? AND appointment_date=?",
+                           (doctor_id, DAY)).fetchone() == (MAX_APPOINTMENTS,)
+    finally:
+        con.close()
+
+
+def test_concurrent_threads_never_overbook(database, doctor_id):
+    barrier = threading.Barrier(CONTENDERS)
+    results = []
+    threads = [threading.Thread(target=lambda patient=patient: results.append(book(database, doctor_id, patient, barrier)))
+               for patient in range(CONTENDERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert_day_filled(database, doctor_id, sum(result is not None for result in results))
+
+
+def test_concurrent_processes_never_overbook(database, doctor_id):
+    ctx = multiprocessing.get_context("fork")
+    barrier = ctx.Barrier(CONTENDERS)
+    results = ctx.Queue()
+    processes = [ctx.Process(target=book_in_process, args=(database, doctor_id, patient, barrier, results))
+                 for patient in range(CONTENDERS)]
+    for process in processes:
+        process.start()
+    outcomes = [results.get(timeout=30) for _ in processes]
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    assert_day_filled(database, doctor_id, sum(outcomes))